@@ -0,0 +1,282 @@
+"""
+Platform-wide analytics, precomputed for the admin API.
+
+Nothing here scans ``users``, ``user_profiles``, ``retirement_profiles`` or
+``documents`` on a read. Two kinds of small rollup documents in
+``analytics_rollups`` are kept up to date instead:
+
+* ``totals``: current state (users by type, completed profiles, estimated
+  pension and savings progress histograms, documents by category). Each
+  user's contribution is kept in ``analytics_users``; when a write path
+  reports a change (``user_changed``), an ``analytics.refresh_user`` job
+  recomputes that one user and ``$inc``s the difference into the totals.
+  Bursts of changes collapse into one job per user;
+* ``day:YYYY-MM-DD``: events of the day (signups, completed profiles,
+  saved simulations, uploads), incremented by the write paths themselves
+  (``record_event``).
+
+Totals only drift if a refresh dies between its two writes, or when a
+rebuild runs during writes. The ``analytics.rebuild`` job fixes that. It
+refreshes every user and then sums the per-user contributions again. It
+is queued by ``POST /api/internal/analytics/rebuild`` or every
+``ANALYTICS_REBUILD_INTERVAL_SECONDS``.
+
+Without Mongo (``DATABASE_BACKEND=memory``) the write hooks are no-ops.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+import jobs
+import retirement
+
+logger = logging.getLogger(__name__)
+
+TOTALS_ID = "totals"
+# Coalesces the changes of one request burst into one refresh
+REFRESH_DELAY = float(os.environ.get("ANALYTICS_REFRESH_DELAY_SECONDS", "5"))
+PENSION_BUCKET = 500
+PENSION_MAX_BUCKET = 4000
+
+
+def pension_bucket(pension: float) -> str:
+    if pension >= PENSION_MAX_BUCKET:
+        return f"{PENSION_MAX_BUCKET}+"
+    low = int(pension // PENSION_BUCKET) * PENSION_BUCKET
+    return f"{low}-{low + PENSION_BUCKET}"
+
+
+def progress_bucket(progress: float) -> str:
+    if progress >= 100:
+        return "100"
+    low = int(progress // 10) * 10
+    return f"{low}-{low + 9}"
+
+
+def _day_id(moment: datetime) -> str:
+    return f"day:{moment:%Y-%m-%d}"
+
+
+# ----------------------------------------------------------------------------
+# Write hooks
+# ----------------------------------------------------------------------------
+
+async def record_event(db, counters: Dict[str, float]):
+    """Add ``counters`` (dotted paths, e.g. ``{"signups.employee": 1}``) to today's bucket"""
+    if db is None or not counters:
+        return
+    now = datetime.utcnow()
+    try:
+        await db.analytics_rollups.update_one(
+            {"_id": _day_id(now)},
+            {"$inc": counters, "$set": {"updated_at": now},
+             "$setOnInsert": {"day": datetime(now.year, now.month, now.day)}},
+            upsert=True
+        )
+    except Exception as e:
+        # Analytics never fail the request that triggered them
+        logger.error(f"Analytics event not recorded: {e}")
+
+
+async def user_changed(db, user_id: str):
+    """Queue a refresh of the user's contribution to the totals"""
+    if db is None:
+        return
+    try:
+        await jobs.enqueue(db, "analytics.refresh_user", {"user_id": user_id},
+                           delay=REFRESH_DELAY, dedupe_key=f"analytics:{user_id}")
+    except Exception as e:
+        logger.error(f"Analytics refresh not queued for user {user_id}: {e}")
+
+
+async def users_changed(db, user_ids: List[str]):
+    """Like ``user_changed`` for a batch of users (bulk imports), in one job"""
+    if db is None or not user_ids:
+        return
+    try:
+        await jobs.enqueue(db, "analytics.refresh_users", {"user_ids": list(user_ids)}, delay=REFRESH_DELAY)
+    except Exception as e:
+        logger.error(f"Analytics refresh not queued for {len(user_ids)} user(s): {e}")
+
+
+# ----------------------------------------------------------------------------
+# Incremental totals
+# ----------------------------------------------------------------------------
+
+async def contribution(db, user_id: str) -> Optional[Dict[str, float]]:
+    """Counters one user adds to the totals (dotted paths), None if the user is gone"""
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "user_type": 1, "profile_completed": 1})
+    if user is None:
+        return None
+    user_type = user.get("user_type") or "unknown"
+    counters = {f"users.{user_type}": 1}
+    if user.get("profile_completed"):
+        counters[f"profiles_completed.{user_type}"] = 1
+
+    profile = await db.retirement_profiles.find_one(
+        {"user_id": user_id}, {"_id": 0, "simulation_data.results": 1}
+    )
+    estimates = retirement.saved_simulation_estimates(profile and profile.get("simulation_data"))
+    if estimates["estimated_pension"] > 0:
+        counters[f"simulations.{user_type}"] = 1
+        counters[f"pension_sum.{user_type}"] = estimates["estimated_pension"]
+        counters[f"pension.{pension_bucket(estimates['estimated_pension'])}"] = 1
+        counters[f"progress.{progress_bucket(estimates['savings_progress'])}"] = 1
+
+    groups = await db.documents.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": "$category", "count": {"$sum": 1}, "bytes": {"$sum": "$file_size"}}},
+    ]).to_list(length=None)
+    for group in groups:
+        counters[f"documents.{group['_id']}.count"] = group["count"]
+        counters[f"documents.{group['_id']}.bytes"] = group["bytes"]
+    return counters
+
+
+def _as_dict(entries: Optional[List[dict]]) -> Dict[str, float]:
+    return {entry["k"]: entry["v"] for entry in entries or []}
+
+
+@jobs.job("analytics.refresh_user")
+async def refresh_user(db, payload: dict):
+    user_id = payload["user_id"]
+    counters = await contribution(db, user_id)
+    now = datetime.utcnow()
+    if counters is None:
+        previous = await db.analytics_users.find_one_and_delete({"_id": user_id})
+        counters = {}
+    else:
+        # Stored as k/v pairs so a rebuild can sum them with $unwind/$group
+        previous = await db.analytics_users.find_one_and_replace(
+            {"_id": user_id},
+            {"_id": user_id, "counters": [{"k": k, "v": v} for k, v in counters.items()], "updated_at": now},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+    old = _as_dict(previous and previous.get("counters"))
+    delta = {k: counters.get(k, 0) - old.get(k, 0) for k in set(counters) | set(old)}
+    delta = {k: v for k, v in delta.items() if v}
+    if delta:
+        await db.analytics_rollups.update_one(
+            {"_id": TOTALS_ID}, {"$inc": delta, "$set": {"updated_at": now}}, upsert=True
+        )
+
+
+@jobs.job("analytics.refresh_users")
+async def refresh_users(db, payload: dict):
+    for user_id in payload["user_ids"]:
+        await refresh_user(db, {"user_id": user_id})
+
+
+def _nest(flat: Dict[str, float]) -> dict:
+    nested: dict = {}
+    for path, value in flat.items():
+        *parents, leaf = path.split(".")
+        node = nested
+        for name in parents:
+            node = node.setdefault(name, {})
+        node[leaf] = value
+    return nested
+
+
+@jobs.job("analytics.rebuild", max_attempts=2)
+async def rebuild(db, payload: dict):
+    """Refresh every user, drop departed ones, then recompute the totals"""
+    async for user in db.users.find({}, {"_id": 0, "id": 1}):
+        await refresh_user(db, {"user_id": user["id"]})
+    async for entry in db.analytics_users.find({}, {"_id": 1}):
+        if await db.users.find_one({"id": entry["_id"]}, {"_id": 1}) is None:
+            await refresh_user(db, {"user_id": entry["_id"]})
+
+    sums = await db.analytics_users.aggregate([
+        {"$unwind": "$counters"},
+        {"$group": {"_id": "$counters.k", "v": {"$sum": "$counters.v"}}},
+    ]).to_list(length=None)
+    totals = _nest({s["_id"]: s["v"] for s in sums if s["v"]})
+    await db.analytics_rollups.replace_one(
+        {"_id": TOTALS_ID}, {"_id": TOTALS_ID, **totals, "updated_at": datetime.utcnow(), "rebuilt_at": datetime.utcnow()},
+        upsert=True
+    )
+    logger.info(f"Analytics rebuilt from {await db.analytics_users.count_documents({})} user(s)")
+
+
+async def request_rebuild(db) -> bool:
+    return await jobs.enqueue(db, "analytics.rebuild", {}, dedupe_key="analytics:rebuild") is not None
+
+
+async def rebuild_periodically(db, interval: float):
+    """Background loop started with the app when ANALYTICS_REBUILD_INTERVAL_SECONDS > 0"""
+    while True:
+        try:
+            await request_rebuild(db)
+        except Exception as e:
+            logger.error(f"Analytics rebuild not queued: {e}")
+        await asyncio.sleep(interval)
+
+
+# ----------------------------------------------------------------------------
+# Reads (one or a few small documents)
+# ----------------------------------------------------------------------------
+
+def _rate(part: float, whole: float) -> float:
+    return round(part / whole * 100, 1) if whole else 0
+
+
+async def overview(db) -> dict:
+    totals = await db.analytics_rollups.find_one({"_id": TOTALS_ID}) or {}
+    users = totals.get("users", {})
+    completed = totals.get("profiles_completed", {})
+    simulations = totals.get("simulations", {})
+    pension_sum = totals.get("pension_sum", {})
+    # Counters that went back to 0 stay in the document
+    documents = {name: c for name, c in totals.get("documents", {}).items() if c.get("count")}
+    user_types = sorted(t for t, n in users.items() if n)
+    return {
+        "users": {
+            "total": sum(users.values()),
+            "by_type": {t: users[t] for t in user_types},
+        },
+        "profile_completion": {
+            "rate": _rate(sum(completed.values()), sum(users.values())),
+            "by_type": {t: _rate(completed.get(t, 0), users[t]) for t in user_types},
+        },
+        "estimated_pension": {
+            "users_with_simulation": sum(simulations.values()),
+            "average": round(sum(pension_sum.values()) / sum(simulations.values())) if sum(simulations.values()) else 0,
+            "average_by_type": {
+                t: round(pension_sum.get(t, 0) / simulations[t]) for t in sorted(simulations) if simulations[t]
+            },
+            "distribution": _distribution(totals.get("pension", {})),
+        },
+        "savings_progress": {
+            "distribution": _distribution(totals.get("progress", {})),
+        },
+        "documents": {
+            "total": sum(c.get("count", 0) for c in documents.values()),
+            "bytes": sum(c.get("bytes", 0) for c in documents.values()),
+            "by_category": {name: documents[name] for name in sorted(documents)},
+        },
+        "updated_at": totals.get("updated_at"),
+        "rebuilt_at": totals.get("rebuilt_at"),
+    }
+
+
+def _distribution(buckets: Dict[str, float]) -> Dict[str, float]:
+    """Non-empty buckets, in increasing order"""
+    ordered = sorted(buckets.items(), key=lambda item: float(item[0].rstrip("+").split("-")[0]))
+    return {bucket: count for bucket, count in ordered if count}
+
+
+async def daily(db, days: int) -> List[dict]:
+    """Event buckets of the last ``days`` days, oldest first"""
+    since = datetime.utcnow() - timedelta(days=days - 1)
+    rows = await db.analytics_rollups.find(
+        # ";" sorts right after ":", so this is every day bucket from ``since``
+        {"_id": {"$gte": _day_id(since), "$lt": "day;"}}, {"_id": 0}
+    ).sort("_id", 1).to_list(length=days)
+    return rows
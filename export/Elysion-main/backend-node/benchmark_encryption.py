@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Throughput of encrypted document storage compared with plain files.
+
+Measures, in-process (no network, no Mongo):
+  * upload: plain save vs encrypt + save through the storage driver;
+  * download: FileResponse of the plain file vs decrypting StreamingResponse,
+    served by a minimal FastAPI app through httpx's ASGI transport;
+  * ranged download: a 64KB range from the middle of the encrypted file.
+
+Needs cryptography and httpx. A random master key is generated for the run.
+
+Usage:
+    python benchmark_encryption.py --size-mb 10 --repeat 20
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DOCUMENT_MASTER_KEY", base64.b64encode(os.urandom(32)).decode())
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse, StreamingResponse
+
+import encryption
+from storage import CHUNK_SIZE, LocalStorage
+
+
+async def _chunks(data: bytes):
+    for i in range(0, len(data), CHUNK_SIZE):
+        yield data[i:i + CHUNK_SIZE]
+
+
+def _report(label: str, size: int, timings: list, baseline: float = None):
+    best = min(timings)
+    throughput = size / best / (1024 * 1024)
+    line = f"   {label:<28} {throughput:8.1f} MB/s  (meilleur {best * 1000:.1f} ms)"
+    if baseline:
+        line += f"  surcoût {(best / baseline - 1) * 100:+.0f}%"
+    print(line)
+    return best
+
+
+async def run(args):
+    size = int(args.size_mb * 1024 * 1024)
+    data = os.urandom(size)
+
+    with tempfile.TemporaryDirectory() as root:
+        storage = LocalStorage(root)
+        data_key, metadata = encryption.new_document_key(args.chunk_kb * 1024)
+
+        print(f"📦 Fichier de {args.size_mb} MB, blocs chiffrés de {args.chunk_kb} KB, {args.repeat} répétitions\n")
+        print("⬆️  Écriture")
+        plain, encrypted = [], []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            await storage.save("bench/plain.pdf", _chunks(data))
+            plain.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            await storage.save("bench/encrypted.pdf", encryption.encrypt_stream(_chunks(data), data_key, metadata))
+            encrypted.append(time.perf_counter() - started)
+        baseline = _report("clair", size, plain)
+        _report("chiffré", size, encrypted, baseline)
+
+        app = FastAPI()
+
+        @app.get("/plain")
+        async def plain_file():
+            return FileResponse(storage.local_path("bench/plain.pdf"), media_type="application/pdf")
+
+        @app.get("/encrypted")
+        async def encrypted_file(request: Request):
+            start = int(request.query_params.get("start", 0))
+            end = request.query_params.get("end")
+            return StreamingResponse(
+                encryption.decrypt_range(
+                    storage, "bench/encrypted.pdf", encryption.unwrap_key(metadata), metadata,
+                    size, start, int(end) if end else None
+                ),
+                media_type="application/pdf"
+            )
+
+        print("\n⬇️  Lecture")
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            timings = {"plain": [], "encrypted": [], "range": []}
+            middle = size // 2
+            for _ in range(args.repeat):
+                for name, url in (
+                    ("plain", "/plain"),
+                    ("encrypted", "/encrypted"),
+                    ("range", f"/encrypted?start={middle}&end={middle + 65535}"),
+                ):
+                    started = time.perf_counter()
+                    response = await http.get(url)
+                    timings[name].append(time.perf_counter() - started)
+                    assert response.status_code == 200
+            assert response.content == data[middle:middle + 65536]
+        baseline = _report("FileResponse (clair)", size, timings["plain"])
+        _report("StreamingResponse (chiffré)", size, timings["encrypted"], baseline)
+        _report("plage de 64 KB (chiffré)", 65536, timings["range"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark encrypted document storage")
+    parser.add_argument("--size-mb", type=float, default=10)
+    parser.add_argument("--chunk-kb", type=int, default=encryption.DEFAULT_CHUNK_SIZE // 1024)
+    parser.add_argument("--repeat", type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
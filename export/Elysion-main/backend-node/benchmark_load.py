@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Load and latency benchmark for the API.
+
+Drives the ASGI app in-process (httpx ASGITransport, default) or a running
+server (``--url http://localhost:8001``) with a realistic mix of requests
+from concurrent virtual users, then reports requests/s and p50/p95/p99 per
+route.
+
+Data lives in a throwaway database, per ``--backend``: the local Mongo from
+MONGO_URL (under a ``<DB_NAME>_bench_<random>`` name, dropped afterwards),
+the local Postgres from POSTGRES_URL (in a ``bench_<random>`` schema,
+dropped afterwards) or the in-memory repositories (``memory``, or
+``--in-memory``) so no database is needed at all. Several backends run the
+same workload one after the other and are compared route by route.
+
+Results can be saved as JSON and compared with a previous run: routes whose
+p95 regressed by more than ``--threshold`` percent make the command exit
+with status 1.
+
+Usage:
+    python benchmark_load.py --mix dashboard --users 20 --duration 30
+    python benchmark_load.py --mix upload --in-memory --save baselines/upload.json
+    python benchmark_load.py --mix login --baseline baselines/login.json
+    python benchmark_load.py --mix dashboard --backend mongo postgres
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+PASSWORD = "benchmark-password"
+PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[]/Count 0>>endobj\n"
+    b"3 0 obj<</Length 60>>stream\nBT /F1 12 Tf (Bulletin de salaire janvier 2024 net 2450 EUR) Tj ET\nendstream endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+) + b"0" * 60_000
+
+
+# ----------------------------------------------------------------------------
+# Virtual user
+# ----------------------------------------------------------------------------
+
+class VirtualUser:
+    def __init__(self, http: httpx.AsyncClient, email: str):
+        self.http = http
+        self.email = email
+        self.headers: Dict[str, str] = {}
+        self.document_ids: List[str] = []
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        response = await self.http.request(method, url, headers=self.headers, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url} -> {response.status_code}")
+        return response
+
+    async def register(self, user_type: str):
+        response = await self.http.post("/api/auth/register", json={
+            "email": self.email, "password": PASSWORD,
+            "full_name": "Utilisateur Benchmark", "user_type": user_type,
+        })
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    # Operations, named after the route they exercise
+
+    async def login(self):
+        response = await self.request("POST", "/api/auth/login", json={"email": self.email, "password": PASSWORD})
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def dashboard(self):
+        await self.request("GET", "/api/dashboard")
+
+    async def profile(self):
+        await self.request("GET", "/api/profile")
+
+    async def simulation_save(self):
+        await self.request("POST", "/api/simulation/save", json={
+            "results": {"scenarios": [{"age": 64, "totalMonthly": random.randint(1200, 2600)}],
+                        "currentIncome": 3200, "targetIncome": 2400},
+        })
+
+    async def simulation_latest(self):
+        await self.request("GET", "/api/simulation/latest")
+
+    async def documents(self):
+        await self.request("GET", "/api/documents")
+
+    async def document_stats(self):
+        await self.request("GET", "/api/documents/stats/summary")
+
+    async def upload(self):
+        response = await self.request(
+            "POST", "/api/documents/upload", params={"category": "salary_slip"},
+            files={"file": (f"bulletin-{uuid.uuid4().hex[:8]}.pdf", PDF, "application/pdf")},
+        )
+        self.document_ids.append(response.json()["id"])
+
+    async def download(self):
+        if not self.document_ids:
+            return await self.upload()
+        await self.request("GET", f"/api/documents/{random.choice(self.document_ids)}/download")
+
+    async def delete(self):
+        if not self.document_ids:
+            return await self.upload()
+        document_id = self.document_ids.pop(random.randrange(len(self.document_ids)))
+        await self.request("DELETE", f"/api/documents/{document_id}")
+
+
+# Route label and weight of each operation, per mix
+MIXES: Dict[str, Dict[str, tuple]] = {
+    "login": {
+        "login": ("POST /api/auth/login", 70),
+        "dashboard": ("GET /api/dashboard", 20),
+        "profile": ("GET /api/profile", 10),
+    },
+    "dashboard": {
+        "dashboard": ("GET /api/dashboard", 45),
+        "documents": ("GET /api/documents", 15),
+        "document_stats": ("GET /api/documents/stats/summary", 15),
+        "simulation_latest": ("GET /api/simulation/latest", 10),
+        "simulation_save": ("POST /api/simulation/save", 5),
+        "profile": ("GET /api/profile", 10),
+    },
+    "upload": {
+        "upload": ("POST /api/documents/upload", 40),
+        "documents": ("GET /api/documents", 25),
+        "download": ("GET /api/documents/{document_id}/download", 25),
+        "delete": ("DELETE /api/documents/{document_id}", 10),
+    },
+}
+
+
+# ----------------------------------------------------------------------------
+# Statistics
+# ----------------------------------------------------------------------------
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: Dict[str, List[float]], errors: Dict[str, int], elapsed: float) -> Dict:
+    routes = {}
+    for route in sorted(set(latencies) | set(errors)):
+        values = sorted(latencies.get(route, []))
+        routes[route] = {
+            "requests": len(values),
+            "errors": errors.get(route, 0),
+            "rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+        }
+    total = sum(r["requests"] for r in routes.values())
+    return {"total_requests": total, "rps": round(total / elapsed, 2), "routes": routes}
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    regressions = []
+    print(f"\n📐 Comparaison avec la référence ({baseline.get('created_at', '?')})")
+    for route, stats in current["routes"].items():
+        before = baseline.get("routes", {}).get(route)
+        if not before or not before["p95_ms"]:
+            continue
+        delta = (stats["p95_ms"] / before["p95_ms"] - 1) * 100
+        flag = "⚠️ " if delta > threshold else "  "
+        print(f"  {flag}{route:<45} p95 {before['p95_ms']:8.2f} → {stats['p95_ms']:8.2f} ms ({delta:+.0f}%)")
+        if delta > threshold:
+            regressions.append(route)
+    return regressions
+
+
+def compare_backends(results: Dict[str, Dict]):
+    names = list(results)
+    print(f"\n🆚 {' / '.join(names)} : req/s {' / '.join(str(r['rps']) for r in results.values())}")
+    print(f"  {'route':<45} " + " ".join(f"{f'p50 {n}':>16} {f'p95 {n}':>16}" for n in names))
+    routes = sorted({route for result in results.values() for route in result["routes"]})
+    for route in routes:
+        cells = []
+        for result in results.values():
+            stats = result["routes"].get(route, {"p50_ms": 0.0, "p95_ms": 0.0})
+            cells.append(f"{stats['p50_ms']:16.2f} {stats['p95_ms']:16.2f}")
+        print(f"  {route:<45} " + " ".join(cells))
+
+
+def print_report(result: Dict):
+    print(f"\n📊 {result['mix']} : {result['total_requests']} requêtes, {result['rps']} req/s, "
+          f"{result['users']} utilisateurs, {result['duration_s']} s")
+    print(f"  {'route':<45} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>5}")
+    for route, stats in result["routes"].items():
+        print(f"  {route:<45} {stats['rps']:8.1f} {stats['p50_ms']:8.2f} {stats['p95_ms']:8.2f} "
+              f"{stats['p99_ms']:8.2f} {stats['errors']:5d}")
+
+
+# ----------------------------------------------------------------------------
+# Runner
+# ----------------------------------------------------------------------------
+
+async def drive(user: VirtualUser, mix: Dict[str, tuple], deadline: float,
+                latencies: Dict[str, List[float]], errors: Dict[str, int], think: float):
+    names = list(mix)
+    weights = [mix[n][1] for n in names]
+    while time.perf_counter() < deadline:
+        name = random.choices(names, weights)[0]
+        route = mix[name][0]
+        started = time.perf_counter()
+        try:
+            await getattr(user, name)()
+            latencies[route].append(time.perf_counter() - started)
+        except Exception:
+            errors[route] += 1
+        if think:
+            await asyncio.sleep(random.uniform(0, think * 2))
+
+
+async def run_load(http: httpx.AsyncClient, args) -> Dict:
+    mix = MIXES[args.mix]
+    run_id = uuid.uuid4().hex[:8]
+    users = [VirtualUser(http, f"bench-{run_id}-{i}@example.com") for i in range(args.users)]
+    user_types = ["employee", "freelancer", "business_owner"]
+
+    print(f"👥 Création de {args.users} utilisateurs...")
+    await asyncio.gather(*(u.register(user_types[i % 3]) for i, u in enumerate(users)))
+    if "documents" in mix:
+        await asyncio.gather(*(u.upload() for u in users for _ in range(args.seed_documents)))
+    if "simulation_latest" in mix:
+        await asyncio.gather(*(u.simulation_save() for u in users))
+
+    # Warm-up, not measured
+    warmup_latencies, warmup_errors = defaultdict(list), defaultdict(int)
+    await asyncio.gather(*(
+        drive(u, mix, time.perf_counter() + args.warmup, warmup_latencies, warmup_errors, args.think)
+        for u in users
+    ))
+
+    print(f"🚀 Mix {args.mix} pendant {args.duration} s...")
+    latencies, errors = defaultdict(list), defaultdict(int)
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(drive(u, mix, deadline, latencies, errors, args.think) for u in users))
+    elapsed = time.perf_counter() - started
+
+    result = summarize(latencies, errors, elapsed)
+    result.update({
+        "mix": args.mix,
+        "users": args.users,
+        "duration_s": round(elapsed, 1),
+        "target": args.url or f"in-process/{args.backend}",
+        "created_at": datetime.utcnow().isoformat(),
+    })
+    return result
+
+
+def quiet_logs():
+    """Only warnings during runs: a log line per request would skew the latencies"""
+    # server.py configures the root logger at INFO when imported
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+async def run_in_process(args) -> Dict:
+    storage_root = tempfile.mkdtemp(prefix="elysion-bench-")
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["STORAGE_LOCAL_ROOT"] = storage_root
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("POSTGRES_URL", "postgresql://localhost:5432/postgres")
+    # Throwaway database (or schema), or the in-memory repositories
+    os.environ["DATABASE_BACKEND"] = args.backend
+    bench_db = f"{os.environ.get('DB_NAME', 'elysion')}_bench_{uuid.uuid4().hex[:8]}"
+    os.environ["DB_NAME"] = bench_db
+    bench_schema = f"bench_{uuid.uuid4().hex[:8]}"
+    os.environ["POSTGRES_SCHEMA"] = bench_schema
+
+    import server
+    quiet_logs()
+
+    try:
+        async with server.app.router.lifespan_context(server.app):
+            try:
+                transport = httpx.ASGITransport(app=server.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as http:
+                    return await run_load(http, args)
+            finally:
+                repos = server.app.state.repositories
+                if repos.client is not None:
+                    await repos.client.drop_database(bench_db)
+                if repos.sql is not None:
+                    from postgres_repositories import quote_identifier
+                    await repos.sql.execute(f"DROP SCHEMA IF EXISTS {quote_identifier(bench_schema)} CASCADE")
+    finally:
+        import shutil
+        shutil.rmtree(storage_root, ignore_errors=True)
+
+
+async def run(args):
+    if args.url:
+        quiet_logs()
+        async with httpx.AsyncClient(base_url=args.url, timeout=60) as http:
+            result = await run_load(http, args)
+        print_report(result)
+    else:
+        # Same workload on each backend, one after the other
+        results = {}
+        for backend in args.backends:
+            args.backend = backend
+            print(f"\n🗄️  Base de données : {backend}")
+            results[backend] = await run_in_process(args)
+            print_report(results[backend])
+        if len(results) > 1:
+            compare_backends(results)
+            return
+        result = results[args.backend]
+
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save).write_text(json.dumps(result, indent=2, sort_keys=True) + "\n")
+        print(f"\n💾 Résultats enregistrés dans {args.save}")
+
+    if args.baseline:
+        regressions = compare(result, json.loads(Path(args.baseline).read_text()), args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} route(s) en régression de plus de {args.threshold:.0f}%")
+            sys.exit(1)
+        print("\n✅ Pas de régression")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for the API")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="dashboard")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before the run")
+    parser.add_argument("--think", type=float, default=0, help="mean think time between requests (s)")
+    parser.add_argument("--seed-documents", type=int, default=5, help="documents uploaded per user beforehand")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--backend", dest="backends", nargs="+", choices=["mongo", "postgres", "memory"],
+                        default=["mongo"], help="database(s) of the in-process app, compared when several")
+    parser.add_argument("--in-memory", action="store_true", help="same as --backend memory")
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare with a previously saved JSON result")
+    parser.add_argument("--threshold", type=float, default=20, help="allowed p95 regression (%%)")
+    args = parser.parse_args()
+    if args.in_memory:
+        args.backends = ["memory"]
+    if len(args.backends) > 1 and (args.save or args.baseline):
+        parser.error("--save and --baseline take a single --backend")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the retirement calculations.
+
+Time per call of the quarters, SAM, pension and savings-effort
+computations, and of whole scenario batches. The worked examples of the
+docs and the properties of these computations are checked by
+tests/test_retirement.py.
+
+Results can be saved as JSON and compared with a previous run, like
+benchmark_load.py: operations slower by more than ``--threshold`` percent
+make the command exit with status 1.
+
+Usage:
+    python benchmark_retirement.py
+    python benchmark_retirement.py --save baselines/retirement.json
+    python benchmark_retirement.py --baseline baselines/retirement.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import retirement
+
+
+# ----------------------------------------------------------------------------
+# Micro-benchmarks
+# ----------------------------------------------------------------------------
+
+def measure(func: Callable[[], object], repeat: int, min_time: float = 0.05) -> float:
+    """Best time per call in µs over ``repeat`` rounds of calibrated loops"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+        loops *= 2
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - started) / loops)
+    return best * 1e6
+
+
+def benchmarks(rng: random.Random, repeat: int, batch: int) -> Dict[str, Dict[str, float]]:
+    salaries = [rng.uniform(20_000, 80_000) for _ in range(40)]
+    revenues = [rng.uniform(0, 90_000) for _ in range(40)]
+    profiles = [
+        (rng.randint(25, 61), rng.choice([1965, 1980, 1995]),
+         [rng.uniform(20_000, 80_000) for _ in range(rng.randint(5, 40))], rng.randint(20, 150))
+        for _ in range(batch)
+    ]
+
+    def employee_batch():
+        for age, birth_year, incomes, quarters in profiles:
+            retirement.employee_scenarios(age, birth_year, incomes, quarters)
+
+    def freelance_batch():
+        for age, birth_year, incomes, quarters in profiles:
+            retirement.freelance_scenarios(age, birth_year, incomes, quarters)
+
+    operations = {
+        "quarters/private": lambda: retirement.private_quarters(22, 2, 3.33, 18, 4, "F", 2),
+        "quarters/revenue": lambda: [retirement.quarters_for_revenue(r) for r in revenues],
+        "sam/best_25_of_40": lambda: retirement.best_years_average(salaries),
+        "pension/base": lambda: retirement.base_pension(48000, 62, 160, 1980),
+        "pension/points": lambda: retirement.points_pension(6200),
+        "savings/required": lambda: retirement.required_savings(3500, 2200, 20, "equilibre", 15000),
+        "scenarios/employee": lambda: retirement.employee_scenarios(45, 1980, salaries, 111, 6200),
+        "scenarios/freelance": lambda: retirement.freelance_scenarios(40, 1985, revenues, 82),
+        f"batch/employee_x{batch}": employee_batch,
+        f"batch/freelance_x{batch}": freelance_batch,
+    }
+
+    print(f"\n⏱️  Micro-benchmarks (meilleur de {repeat} essais)")
+    print(f"  {'opération':<28} {'µs/appel':>12} {'appels/s':>12}")
+    results = {}
+    for name, func in operations.items():
+        per_call = measure(func, repeat)
+        results[name] = {"us_per_call": round(per_call, 3), "calls_per_s": round(1e6 / per_call, 1)}
+        print(f"  {name:<28} {per_call:12.3f} {1e6 / per_call:12.1f}")
+    return results
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    regressions = []
+    print(f"\n📐 Comparaison avec la référence ({baseline.get('created_at', '?')})")
+    for name, stats in current["operations"].items():
+        before = baseline.get("operations", {}).get(name)
+        if not before or not before["us_per_call"]:
+            continue
+        delta = (stats["us_per_call"] / before["us_per_call"] - 1) * 100
+        flag = "⚠️ " if delta > threshold else "  "
+        print(f"  {flag}{name:<28} {before['us_per_call']:10.3f} → {stats['us_per_call']:10.3f} µs ({delta:+.0f}%)")
+        if delta > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for retirement.py")
+    parser.add_argument("--seed", type=int, default=20240101)
+    parser.add_argument("--repeat", type=int, default=5, help="benchmark rounds (best is kept)")
+    parser.add_argument("--batch", type=int, default=1000, help="profiles per batch benchmark")
+    parser.add_argument("--save", help="write the benchmark results as JSON")
+    parser.add_argument("--baseline", help="compare with a previously saved JSON result")
+    parser.add_argument("--threshold", type=float, default=25, help="allowed slowdown per operation (%%)")
+    args = parser.parse_args()
+
+    result = {
+        "operations": benchmarks(random.Random(args.seed), args.repeat, args.batch),
+        "python": platform.python_version(),
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save).write_text(json.dumps(result, indent=2, sort_keys=True) + "\n")
+        print(f"\n💾 Résultats enregistrés dans {args.save}")
+
+    if args.baseline:
+        regressions = compare(result, json.loads(Path(args.baseline).read_text()), args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} opération(s) en régression de plus de {args.threshold:.0f}%")
+            sys.exit(1)
+        print("\n✅ Pas de régression")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+CPU cost of response serialization: validated models + stdlib JSON (the
+previous handlers) against stored rows + FastJSONResponse (current ones).
+
+Both variants are mounted on a throwaway FastAPI app and called in-process
+through httpx's ASGI transport, so the numbers include FastAPI's own
+response handling. No Mongo access is made: rows are generated up front.
+
+Usage:
+    python benchmark_serialization.py --documents 500 --repeat 200
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "elysion_benchmark")
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from serialization import FastJSONResponse, orjson, project, trusted
+from server import DocumentCategory, DocumentResponse, User, UserType, generate_mock_retirement_data
+
+
+def make_rows(count: int):
+    now = datetime.utcnow()
+    user = {
+        "id": str(uuid.uuid4()), "email": "bench@example.com", "full_name": "Jeanne Bench",
+        "user_type": UserType.EMPLOYEE.value, "created_at": now, "is_active": True,
+    }
+    categories = list(DocumentCategory)
+    documents = [
+        {
+            "id": str(uuid.uuid4()), "user_id": user["id"],
+            "filename": f"bulletin-{i:04d}.pdf", "original_filename": f"bulletin-{i:04d}.pdf",
+            "category": categories[i % len(categories)].value, "file_size": 100_000 + i,
+            "uploaded_at": now - timedelta(days=i), "updated_at": now - timedelta(days=i),
+        }
+        for i in range(count)
+    ]
+    return user, documents
+
+
+def build_app(user_row: dict, documents: list) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/before/documents", response_model=List[DocumentResponse], response_class=JSONResponse)
+    async def documents_before():
+        User(**user_row)
+        return [DocumentResponse(**doc) for doc in documents]
+
+    @app.get("/after/documents", response_model=List[DocumentResponse])
+    async def documents_after():
+        trusted(User, user_row)
+        return FastJSONResponse([project(DocumentResponse, doc) for doc in documents])
+
+    @app.get("/before/dashboard", response_class=JSONResponse)
+    async def dashboard_before():
+        user = User(**user_row)
+        return {
+            "user": {"id": user.id, "email": user.email, "full_name": user.full_name, "user_type": user.user_type},
+            "retirement_profile": None,
+            **generate_mock_retirement_data(user, None),
+        }
+
+    @app.get("/after/dashboard")
+    async def dashboard_after():
+        user = trusted(User, user_row)
+        return FastJSONResponse({
+            "user": {"id": user.id, "email": user.email, "full_name": user.full_name, "user_type": user.user_type},
+            "retirement_profile": None,
+            **generate_mock_retirement_data(user, None),
+        })
+
+    return app
+
+
+async def run(args):
+    user_row, documents = make_rows(args.documents)
+    app = build_app(user_row, documents)
+    transport = httpx.ASGITransport(app=app)
+
+    print(f"🧪 {args.documents} documents, {args.repeat} requêtes par variante "
+          f"(encodeur : {'orjson' if orjson else 'json'})\n")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        for endpoint in ("documents", "dashboard"):
+            results = {}
+            for variant in ("before", "after"):
+                url = f"/{variant}/{endpoint}"
+                body = (await http.get(url)).json()  # warm-up
+                started = time.process_time()
+                for _ in range(args.repeat):
+                    await http.get(url)
+                results[variant] = (time.process_time() - started) / args.repeat * 1000
+                results[f"{variant}_body"] = body
+            assert results["before_body"] == results["after_body"], f"{endpoint}: réponses différentes"
+            saved = results["before"] - results["after"]
+            print(f"   /{endpoint:<10} avant {results['before']:7.3f} ms CPU  après {results['after']:7.3f} ms CPU  "
+                  f"gain {saved:6.3f} ms ({saved / results['before'] * 100:.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark response serialization")
+    parser.add_argument("--documents", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Per-user read cache shared by the uvicorn workers.
+
+Two tiers:
+
+* a local LRU in each worker (``CACHE_LOCAL_MAX_ENTRIES``), holding decoded
+  values, with a short TTL (``CACHE_LOCAL_TTL_SECONDS``) as a safety net;
+* an optional shared tier on any Redis-protocol server (``CACHE_URL``,
+  e.g. ``redis://localhost:6379/0``; Redis, Valkey, KeyDB or a local
+  stand-in for tests), holding encoded bytes for ``CACHE_SHARED_TTL_SECONDS``.
+
+Entries are keyed by user and kind (``principal``, ``dashboard``...).
+``invalidate(user_id)`` drops every entry of the user: it bumps a per-user
+generation that is part of the shared keys (``INCR``) and broadcasts the
+user id on a pub/sub channel so every worker evicts its local copies. A
+fill that raced with an invalidation is discarded locally and lands under
+the old generation in the shared tier, where it is never read again.
+
+``CACHE_BACKEND`` selects the mode: ``none`` (default, pass-through),
+``local`` (a single worker only: other workers would not be told about
+writes) or ``redis`` (local + shared tiers with invalidation broadcast).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+Loader = Callable[[], Awaitable[Any]]
+
+
+def _identity(value):
+    return value
+
+
+class LocalLRU:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # user -> number of invalidations seen, to drop fills that raced one
+        self._generations: "OrderedDict[str, int]" = OrderedDict()
+        self._kinds = set()
+
+    def get(self, user_id: str, kind: str):
+        entry = self._entries.get((user_id, kind))
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[(user_id, kind)]
+            return None
+        self._entries.move_to_end((user_id, kind))
+        return value
+
+    def generation(self, user_id: str) -> int:
+        return self._generations.get(user_id, 0)
+
+    def set(self, user_id: str, kind: str, value, generation: int):
+        if self.max_entries <= 0 or self.generation(user_id) != generation:
+            return
+        self._kinds.add(kind)
+        self._entries[(user_id, kind)] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end((user_id, kind))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def evict(self, user_id: str):
+        for kind in self._kinds:
+            self._entries.pop((user_id, kind), None)
+        self._generations[user_id] = self.generation(user_id) + 1
+        self._generations.move_to_end(user_id)
+        while len(self._generations) > max(self.max_entries, 1):
+            self._generations.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class RedisTier:
+    """Shared tier over redis-py's asyncio client"""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "elysion:cache"):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+        self.ttl_ms = int(ttl * 1000)
+        self.prefix = prefix
+        self.channel = f"{prefix}:invalidate"
+
+    def _generation_key(self, user_id: str) -> str:
+        return f"{self.prefix}:gen:{user_id}"
+
+    def _key(self, user_id: str, generation: int, kind: str) -> str:
+        return f"{self.prefix}:{user_id}:{generation}:{kind}"
+
+    async def generation(self, user_id: str) -> int:
+        return int(await self.client.get(self._generation_key(user_id)) or 0)
+
+    async def get(self, user_id: str, generation: int, kind: str) -> Optional[bytes]:
+        return await self.client.get(self._key(user_id, generation, kind))
+
+    async def set(self, user_id: str, generation: int, kind: str, value: bytes):
+        await self.client.set(self._key(user_id, generation, kind), value, px=self.ttl_ms)
+
+    async def invalidate(self, user_id: str):
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.incr(self._generation_key(user_id))
+            # Outlives every value written under the previous generations
+            pipe.pexpire(self._generation_key(user_id), self.ttl_ms * 2)
+            pipe.publish(self.channel, user_id)
+            await pipe.execute()
+
+    async def listen(self, on_message: Callable[[str], None], on_reconnect: Callable[[], None]):
+        """Call ``on_message(user_id)`` for every broadcast invalidation, forever"""
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # Messages may have been missed while disconnected
+                on_reconnect()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        data = message["data"]
+                        on_message(data.decode() if isinstance(data, bytes) else data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache invalidation listener error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await (pubsub.aclose() if hasattr(pubsub, "aclose") else pubsub.close())
+
+    async def close(self):
+        await (self.client.aclose() if hasattr(self.client, "aclose") else self.client.close())
+
+
+class Cache:
+    def __init__(self, local: Optional[LocalLRU] = None, shared: Optional[RedisTier] = None):
+        self.local = local
+        self.shared = shared
+
+    @property
+    def enabled(self) -> bool:
+        return self.local is not None
+
+    async def get_or_load(
+        self,
+        user_id: str,
+        kind: str,
+        load: Loader,
+        encode: Callable[[Any], bytes] = _identity,
+        decode: Callable[[bytes], Any] = _identity,
+    ):
+        """Cached value of ``kind`` for the user, or ``await load()`` (None is not cached).
+
+        ``encode``/``decode`` convert values to and from the shared tier's bytes.
+        """
+        if not self.enabled:
+            return await load()
+
+        value = self.local.get(user_id, kind)
+        if value is not None:
+            metrics.CACHE_REQUESTS.inc(kind, "local_hit")
+            return value
+        local_generation = self.local.generation(user_id)
+
+        shared_generation = None
+        if self.shared is not None:
+            try:
+                shared_generation = await self.shared.generation(user_id)
+                raw = await self.shared.get(user_id, shared_generation, kind)
+                if raw is not None:
+                    value = decode(raw)
+                    self.local.set(user_id, kind, value, local_generation)
+                    metrics.CACHE_REQUESTS.inc(kind, "shared_hit")
+                    return value
+            except Exception as e:
+                # The shared tier is an optimization: fall back to loading
+                logger.error(f"Cache read failed for {kind}: {e}")
+                shared_generation = None
+
+        metrics.CACHE_REQUESTS.inc(kind, "miss")
+        value = await load()
+        if value is None:
+            return None
+        self.local.set(user_id, kind, value, local_generation)
+        if shared_generation is not None:
+            try:
+                await self.shared.set(user_id, shared_generation, kind, encode(value))
+            except Exception as e:
+                logger.error(f"Cache write failed for {kind}: {e}")
+        return value
+
+    async def invalidate(self, user_id: str):
+        """Drop every cached entry of the user, in all workers"""
+        if not self.enabled:
+            return
+        self.local.evict(user_id)
+        if self.shared is not None:
+            try:
+                await self.shared.invalidate(user_id)
+            except Exception as e:
+                logger.error(f"Cache invalidation failed for user {user_id}: {e}")
+
+    async def listen_for_invalidations(self):
+        """Background task evicting local entries on writes made by other workers"""
+        if self.shared is not None:
+            await self.shared.listen(self.local.evict, self.local.clear)
+
+    async def close(self):
+        if self.shared is not None:
+            await self.shared.close()
+
+
+def create_cache() -> Cache:
+    """Cache for the configured CACHE_BACKEND"""
+    backend = os.environ.get("CACHE_BACKEND", "none")
+    if backend == "none":
+        return Cache()
+    local = LocalLRU(
+        int(os.environ.get("CACHE_LOCAL_MAX_ENTRIES", "10000")),
+        float(os.environ.get("CACHE_LOCAL_TTL_SECONDS", "30")),
+    )
+    if backend == "local":
+        return Cache(local)
+    if backend != "redis":
+        raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
+    return Cache(local, RedisTier(
+        os.environ.get("CACHE_URL", "redis://localhost:6379/0"),
+        float(os.environ.get("CACHE_SHARED_TTL_SECONDS", "300")),
+    ))
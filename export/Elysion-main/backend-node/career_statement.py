@@ -0,0 +1,194 @@
+"""
+Parsing of career statements (relevé de carrière / RIS) into a year-by-year
+career, used to prefill the simulators and compute a server-side projection.
+
+Parsing runs in the shared process pool and results are cached in the
+``career_statements`` collection by file content hash, so the same PDF is
+never parsed twice, even when uploaded again or by another account.
+"""
+
+import asyncio
+import hashlib
+import logging
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import jobs
+import retirement
+from document_search import extract_pdf_text, read_document_bytes
+from workers import run_cpu_bound
+
+logger = logging.getLogger(__name__)
+
+# Bump when parsing changes so cached results are recomputed
+PARSER_VERSION = 1
+
+_YEAR_RE = re.compile(r"^\s*((?:19|20)\d{2})\b(.*)$")
+_AMOUNT_RE = re.compile(r"(\d{1,3}(?:[ \u00a0\u202f.]\d{3})+|\d+)(?:,(\d{1,2}))?\s*(?:€|EUR|euros?)", re.I)
+_QUARTERS_RE = re.compile(r"\b([0-4])\s*(?:trim(?:estres?)?\.?|T)\b", re.I)
+_POINTS_RE = re.compile(r"total\D{0,40}?points?\D{0,20}?(\d{1,3}(?:[ \u00a0\u202f.]\d{3})*(?:,\d+)?)", re.I)
+
+_REGIMES = [
+    ("agirc_arrco", re.compile(r"agirc|arrco", re.I)),
+    ("ssi", re.compile(r"\bSSI\b|\bRSI\b|ind[ée]pendant|artisan|commer[çc]ant", re.I)),
+    ("public", re.compile(r"fonction publique|\bSRE\b|CNRACL|IRCANTEC", re.I)),
+    ("msa", re.compile(r"\bMSA\b|agricole", re.I)),
+    ("general", re.compile(r"r[ée]gime g[ée]n[ée]ral|CNAV|assurance retraite|salari[ée]", re.I)),
+]
+
+
+def _to_number(raw: str, decimals: Optional[str] = None) -> float:
+    value = float(re.sub(r"[ \u00a0\u202f.]", "", raw))
+    if decimals:
+        value += float(f"0.{decimals}")
+    return value
+
+
+def _detect_regime(line: str, default: str) -> str:
+    for name, pattern in _REGIMES:
+        if pattern.search(line):
+            return name
+    return default
+
+
+def parse_career_text(text: str) -> Dict:
+    """Turn the text of a career statement into a structured career"""
+    entries: Dict[tuple, Dict] = {}
+    current_regime = "general"
+
+    for line in text.splitlines():
+        # Section headers ("Régime général", "SSI", ...) set the regime for
+        # the rows that follow them.
+        if not _YEAR_RE.match(line):
+            current_regime = _detect_regime(line, current_regime)
+            continue
+
+        match = _YEAR_RE.match(line)
+        year = int(match.group(1))
+        rest = match.group(2)
+        regime = _detect_regime(rest, current_regime)
+
+        amount = _AMOUNT_RE.search(rest)
+        income = _to_number(amount.group(1), amount.group(2)) if amount else None
+
+        quarters_match = _QUARTERS_RE.search(rest)
+        quarters = int(quarters_match.group(1)) if quarters_match else None
+
+        if income is None and quarters is None:
+            continue
+
+        entry = entries.setdefault((year, regime), {"year": year, "regime": regime, "income": 0.0, "quarters": 0})
+        entry["income"] += income or 0.0
+        entry["quarters"] = min(4, entry["quarters"] + (quarters or 0))
+
+    rows = sorted(entries.values(), key=lambda e: (e["year"], e["regime"]))
+
+    # One line per year across regimes, as the simulators expect
+    years: Dict[int, Dict] = {}
+    for row in rows:
+        if row["regime"] == "agirc_arrco":
+            continue
+        year = years.setdefault(row["year"], {"year": row["year"], "income": 0.0, "quarters": 0, "regimes": []})
+        year["income"] += row["income"]
+        year["quarters"] = min(4, year["quarters"] + row["quarters"])
+        year["regimes"].append(row["regime"])
+
+    points_match = _POINTS_RE.search(text)
+    career_years = [years[y] for y in sorted(years)]
+    return {
+        "parser_version": PARSER_VERSION,
+        "entries": rows,
+        "years": career_years,
+        "total_quarters": min(sum(y["quarters"] for y in career_years), retirement.MAX_QUARTERS),
+        "first_year": career_years[0]["year"] if career_years else None,
+        "last_year": career_years[-1]["year"] if career_years else None,
+        "agirc_arrco_points": _to_number(points_match.group(1).split(",")[0]) if points_match else None,
+    }
+
+
+def parse_career_pdf(data: bytes) -> Dict:
+    """Worker-process entry point: PDF bytes -> structured career"""
+    return parse_career_text(extract_pdf_text(data))
+
+
+async def ensure_indexes(db):
+    await db.career_statements.create_index("content_hash", unique=True)
+
+
+async def get_career(db, document: dict) -> Dict:
+    """Parsed career for a document, from cache when the same file was seen"""
+    content_hash = document.get("content_hash")
+    if content_hash:
+        cached = await db.career_statements.find_one(
+            {"content_hash": content_hash, "parser_version": PARSER_VERSION},
+            {"_id": 0, "career": 1}
+        )
+        if cached:
+            return cached["career"]
+
+    data = await read_document_bytes(document)
+    if not content_hash:
+        content_hash = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+        await db.documents.update_one({"id": document["id"]}, {"$set": {"content_hash": content_hash}})
+
+    career = await run_cpu_bound(parse_career_pdf, data)
+    await db.career_statements.update_one(
+        {"content_hash": content_hash},
+        {"$set": {
+            "content_hash": content_hash,
+            "parser_version": PARSER_VERSION,
+            "career": career,
+            "parsed_at": datetime.utcnow(),
+        }},
+        upsert=True
+    )
+    return career
+
+
+@jobs.job("career.parse", queue="documents", max_attempts=3)
+async def _parse_job(db, payload: dict):
+    document = await db.documents.find_one({"id": payload["document_id"]}, {"_id": 0})
+    if document is not None:
+        await get_career(db, document)
+
+
+async def warm_cache(db, document: dict):
+    """Queue a parse right after upload so the first read is instant"""
+    await jobs.enqueue(db, "career.parse", {"document_id": document["id"]},
+                       dedupe_key=f"career:{document['id']}")
+
+
+def simulator_prefill(career: Dict) -> Dict:
+    """Form fields of the React simulators filled from a parsed career"""
+    years: List[Dict] = career["years"]
+    return {
+        "employee": {
+            "careerStartYear": career["first_year"],
+            "salaryMode": "detailed",
+            "detailedSalaries": [{"year": y["year"], "salary": round(y["income"])} for y in years],
+            "fullTimeYears": sum(1 for y in years if y["quarters"] >= 4),
+            "partTimeYears": sum(1 for y in years if 0 < y["quarters"] < 4),
+            "knowsPoints": career.get("agirc_arrco_points") is not None,
+            "agircArrcoPoints": career.get("agirc_arrco_points") or 0,
+        },
+        "freelance": {
+            "revenueHistory": [
+                {"year": y["year"], "professionalRevenue": round(y["income"])}
+                for y in years
+            ],
+        },
+    }
+
+
+def projection(career: Dict, birth_year: Optional[int], freelance: bool) -> Optional[List[Dict]]:
+    """Scenarios at 62/64/67 computed from the parsed career"""
+    if not birth_year or not career["years"]:
+        return None
+    current_age = datetime.utcnow().year - birth_year
+    incomes = [y["income"] for y in career["years"]]
+    if freelance:
+        return retirement.freelance_scenarios(current_age, birth_year, incomes, career["total_quarters"])
+    return retirement.employee_scenarios(
+        current_age, birth_year, incomes, career["total_quarters"], career.get("agirc_arrco_points")
+    )
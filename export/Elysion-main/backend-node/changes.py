@@ -0,0 +1,276 @@
+"""
+Per-user change events pushed to the browser over server-sent events.
+
+Handlers that change what the dashboard or the document list show call
+``await changes.publish(user_id, "document.added", ids=[...])`` next to
+``cache.invalidate``. Events are compact (a type, the ids involved, a
+timestamp): the client refetches what it displays, so an event carries no
+data that could go stale and receiving one twice is harmless.
+
+Each worker has one ``ChangeFeed`` fanning events out to its open
+``GET /api/changes`` streams. Two modes, picked at startup:
+
+* ``stream`` when Mongo runs as a replica set (or behind mongos): events
+  are inserted in the ``user_changes`` collection and every worker follows
+  it with a single change stream, so events from any worker reach every
+  stream. The collection keeps events ``CHANGES_RETENTION_SECONDS``, which
+  lets a reconnecting client (``Last-Event-ID``) catch up on what it
+  missed;
+* ``local`` otherwise (standalone Mongo, other DATABASE_BACKENDs): events
+  go straight to the streams of this worker, through an in-process bus.
+  Nothing is kept, so a reconnecting client gets a ``resync`` event
+  (refetch everything) instead of a replay.
+
+Idle streams cost a small ``Subscription`` object and a suspended
+coroutine each: there is no per-stream timer or polling. One heartbeat
+task per worker sends a comment to the streams that were idle for a whole
+``CHANGES_HEARTBEAT_SECONDS`` (proxies drop silent connections) and closes
+the streams whose access token expired; the browser then reconnects with a
+fresh one. A client that does not read fast enough gets a single
+``resync`` instead of an unbounded backlog (``CHANGES_MAX_PENDING``).
+
+Streams never end on their own: run uvicorn with
+``--timeout-graceful-shutdown`` so a restart does not wait on them.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import OperationFailure
+
+import metrics
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT = float(os.environ.get("CHANGES_HEARTBEAT_SECONDS", "25"))
+MAX_PENDING = int(os.environ.get("CHANGES_MAX_PENDING", "100"))
+RETENTION = int(os.environ.get("CHANGES_RETENTION_SECONDS", "3600"))
+REPLAY_LIMIT = int(os.environ.get("CHANGES_REPLAY_LIMIT", "100"))
+# Event ids are ObjectIds made by several processes: replay a little before
+# the last one seen rather than miss an event from a slightly late clock
+REPLAY_MARGIN = timedelta(seconds=5)
+# Code of ChangeStreamHistoryLost: the resume token fell off the oplog
+HISTORY_LOST = 286
+
+RETRY_FRAME = b"retry: 5000\n\n"
+PING_FRAME = b": ping\n\n"
+RESYNC_FRAME = b'event: change\ndata: {"type":"resync"}\n\n'
+
+_PIPELINE = [{"$match": {"operationType": "insert"}}, {"$project": {"fullDocument": 1}}]
+
+
+def frame(event_id: str, event: dict) -> bytes:
+    return b"id: " + event_id.encode() + b"\nevent: change\ndata: " + dumps(event) + b"\n\n"
+
+
+def _event(row: dict) -> dict:
+    event = {k: v for k, v in row.items() if k not in ("_id", "user_id", "created_at")}
+    event["at"] = row["created_at"]
+    return event
+
+
+class Subscription:
+    """One open stream: frames waiting to be written and the writer's wake-up"""
+
+    __slots__ = ("user_id", "expires", "pending", "waiter", "idle", "closed")
+
+    def __init__(self, user_id: str, expires: Optional[float] = None):
+        self.user_id = user_id
+        # Access token expiry (epoch seconds)
+        self.expires = expires
+        self.pending: Optional[list] = None
+        self.waiter: Optional[asyncio.Future] = None
+        self.idle = True
+        self.closed = False
+
+    def push(self, data: bytes):
+        if self.closed:
+            return
+        if self.pending is None:
+            self.pending = [data]
+        elif len(self.pending) >= MAX_PENDING:
+            # Slow reader: the client refetches rather than replays a backlog
+            self.pending = [RESYNC_FRAME]
+        else:
+            self.pending.append(data)
+        self.idle = False
+        self._wake()
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def frames(self):
+        """Bytes to write, batched when several frames arrived meanwhile, until closed"""
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.pending:
+                data, self.pending = b"".join(self.pending), None
+                yield data
+            elif self.closed:
+                return
+            else:
+                self.waiter = loop.create_future()
+                try:
+                    await self.waiter
+                finally:
+                    self.waiter = None
+
+
+class ChangeFeed:
+    def __init__(self, db=None):
+        self.db = db
+        self.streaming = False
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._boot = uuid.uuid4().hex[:8]
+        self._ids = itertools.count(1)
+
+    @property
+    def mode(self) -> str:
+        return "stream" if self.streaming else "local"
+
+    async def start(self):
+        """Pick the mode: change streams need a replica set or mongos"""
+        if self.db is None:
+            return
+        try:
+            hello = await self.db.command("hello")
+            self.streaming = "setName" in hello or hello.get("msg") == "isdbgrid"
+            if self.streaming:
+                await ensure_indexes(self.db)
+        except Exception as e:
+            logger.error(f"Change feed falls back to local delivery: {e}")
+            self.streaming = False
+
+    def connections(self, user_id: str) -> int:
+        return len(self._subscribers.get(user_id, ()))
+
+    def subscribe(self, user_id: str, expires: Optional[float] = None) -> Subscription:
+        subscription = Subscription(user_id, expires)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        metrics.SSE_CONNECTIONS.inc()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.close()
+        subscriptions = self._subscribers.get(subscription.user_id)
+        if subscriptions is not None and subscription in subscriptions:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.user_id]
+            metrics.SSE_CONNECTIONS.dec()
+
+    async def publish(self, user_id: str, kind: str, **fields):
+        """Tell the user's open streams about a change; never fails the caller"""
+        row = {"user_id": user_id, "type": kind, **fields, "created_at": datetime.utcnow()}
+        metrics.CHANGE_EVENTS.inc(kind)
+        if self.streaming:
+            try:
+                # Delivered by follow(), in this worker and the others
+                await self.db.user_changes.insert_one(row)
+                return
+            except Exception as e:
+                logger.error(f"Change event not stored, delivered locally only: {e}")
+        self._deliver(user_id, f"{self._boot}-{next(self._ids)}", _event(row))
+
+    def _deliver(self, user_id: str, event_id: str, event: dict):
+        subscriptions = self._subscribers.get(user_id)
+        if subscriptions:
+            # Encoded once for every stream of the user
+            data = frame(event_id, event)
+            for subscription in subscriptions:
+                subscription.push(data)
+
+    def resync_all(self):
+        for subscriptions in self._subscribers.values():
+            for subscription in subscriptions:
+                subscription.push(RESYNC_FRAME)
+
+    async def replay(self, subscription: Subscription, last_event_id: Optional[str]):
+        """Events the client missed since ``last_event_id`` (the Last-Event-ID header)"""
+        if not last_event_id:
+            return
+        if not self.streaming:
+            subscription.push(RESYNC_FRAME)
+            return
+        try:
+            since = ObjectId(last_event_id).generation_time.replace(tzinfo=None) - REPLAY_MARGIN
+        except (InvalidId, TypeError):
+            # An id from local mode, or from before a restart
+            subscription.push(RESYNC_FRAME)
+            return
+        if since < datetime.utcnow() - timedelta(seconds=RETENTION):
+            subscription.push(RESYNC_FRAME)
+            return
+        try:
+            rows = await self.db.user_changes.find(
+                {"user_id": subscription.user_id, "_id": {"$gt": ObjectId.from_datetime(since)}}
+            ).sort("_id", 1).limit(REPLAY_LIMIT + 1).to_list(REPLAY_LIMIT + 1)
+        except Exception as e:
+            logger.error(f"Change replay failed: {e}")
+            subscription.push(RESYNC_FRAME)
+            return
+        if len(rows) > REPLAY_LIMIT:
+            subscription.push(RESYNC_FRAME)
+            return
+        for row in rows:
+            subscription.push(frame(str(row["_id"]), _event(row)))
+
+    async def follow(self):
+        """Background task delivering the events of every worker (stream mode)"""
+        if not self.streaming:
+            return
+        token = None
+        while True:
+            try:
+                async with self.db.user_changes.watch(_PIPELINE, resume_after=token) as stream:
+                    async for change in stream:
+                        token = stream.resume_token
+                        row = change["fullDocument"]
+                        self._deliver(row["user_id"], str(row["_id"]), _event(row))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Change stream error: {e}")
+                if isinstance(e, OperationFailure) and e.code == HISTORY_LOST:
+                    # Events were missed: every open stream refetches
+                    token = None
+                    self.resync_all()
+                await asyncio.sleep(1)
+
+    async def heartbeat(self, interval: float = HEARTBEAT):
+        """Background task keeping idle streams open and closing expired ones"""
+        while True:
+            await asyncio.sleep(interval)
+            now = time.time()
+            for subscriptions in list(self._subscribers.values()):
+                for subscription in list(subscriptions):
+                    if subscription.expires is not None and subscription.expires <= now:
+                        subscription.close()
+                    elif subscription.idle:
+                        subscription.push(PING_FRAME)
+                    subscription.idle = True
+
+    def close(self):
+        """End every open stream (shutdown)"""
+        for subscriptions in list(self._subscribers.values()):
+            for subscription in list(subscriptions):
+                subscription.close()
+
+
+async def ensure_indexes(db):
+    await db.user_changes.create_index([("user_id", 1), ("_id", 1)])
+    await db.user_changes.create_index("created_at", expireAfterSeconds=RETENTION)
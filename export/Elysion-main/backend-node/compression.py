@@ -0,0 +1,201 @@
+"""
+Negotiated response compression.
+
+Pure ASGI middleware, like metrics.MetricsMiddleware, so streamed bodies
+are compressed chunk by chunk (each chunk is flushed) instead of being
+buffered. Encodings, in server preference order
+(``COMPRESSION_ENCODINGS``, default ``zstd,br,gzip``):
+
+* ``zstd`` when the ``zstandard`` package is installed;
+* ``br`` when the ``brotli`` package is installed;
+* ``gzip`` (always available).
+
+Only textual content types are compressed (JSON, text, XML, JavaScript,
+CSV); PDFs, ZIPs and images are already compressed and go through as they
+are, as do ranged (206) and empty responses. Event streams
+(``text/event-stream``) are not compressed either: each open stream would
+hold a compressor's state for tiny, rare events. Single-message bodies smaller
+than ``COMPRESSION_MIN_SIZE`` bytes are sent uncompressed. Levels:
+``COMPRESSION_GZIP_LEVEL`` (6), ``COMPRESSION_BROTLI_QUALITY`` (4) and
+``COMPRESSION_ZSTD_LEVEL`` (3), tuned for per-request dynamic content.
+"""
+
+import os
+import zlib
+from typing import Callable, Dict, List, Optional
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/problem+json", "application/x-ndjson",
+    "application/javascript", "application/xml", "image/svg+xml", "text/",
+)
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._compressor.process(data)
+        return out + self._compressor.flush() if flush else out
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK) if flush else out
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+def _available_encodings() -> Dict[str, Callable]:
+    factories = {"gzip": lambda: _Gzip(int(os.environ.get("COMPRESSION_GZIP_LEVEL", "6")))}
+    if brotli is not None:
+        factories["br"] = lambda: _Brotli(int(os.environ.get("COMPRESSION_BROTLI_QUALITY", "4")))
+    if zstandard is not None:
+        factories["zstd"] = lambda: _Zstd(int(os.environ.get("COMPRESSION_ZSTD_LEVEL", "3")))
+    return factories
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """``{coding: q}``, without the codings the client refused (q=0)"""
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return {coding: q for coding, q in accepted.items() if q > 0}
+
+
+def choose_encoding(header: str, preference: List[str]) -> Optional[str]:
+    accepted = parse_accept_encoding(header)
+    candidates = [c for c in preference if c in accepted or "*" in accepted]
+    if not candidates:
+        return None
+    # Highest q first, then the server's preference order
+    return max(candidates, key=lambda c: (accepted.get(c, accepted.get("*", 0)), -preference.index(c)))
+
+
+def _is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    if content_type.startswith("text/event-stream"):
+        return False
+    return any(content_type.startswith(t) for t in COMPRESSIBLE_TYPES) or "+json" in content_type
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.min_size = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+        self.factories = _available_encodings()
+        self.preference = [
+            c.strip() for c in os.environ.get("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",")
+            if c.strip() in self.factories
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+        accept = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept, self.preference) if accept else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # Decided with the first body message
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+
+            if compressor is None:
+                headers = {k.lower(): v for k, v in start.get("headers", [])}
+                declared = headers.get(b"content-length")
+                if (
+                    start["status"] in (204, 206, 304)
+                    or b"content-encoding" in headers
+                    or not _is_compressible(headers.get(b"content-type", b"").decode("latin-1"))
+                    or (not more and len(body) < self.min_size)
+                    or (declared is not None and int(declared) < self.min_size)
+                ):
+                    passthrough = True
+                    await send(start)
+                    return await send(message)
+
+                compressor = self.factories[encoding]()
+                raw_headers = [
+                    (k, v) for k, v in start.get("headers", [])
+                    if k.lower() not in (b"content-length", b"etag", b"vary")
+                ]
+                raw_headers.append((b"content-encoding", encoding.encode()))
+                vary = headers.get(b"vary")
+                raw_headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+                etag = headers.get(b"etag")
+                if etag is not None:
+                    # Another representation: a strong validator would be wrong
+                    raw_headers.append((b"etag", etag if etag.startswith(b"W/") else b"W/" + etag))
+                if not more:
+                    # Whole body at once: compress it and send its length
+                    compressed = compressor.finish(body)
+                    raw_headers.append((b"content-length", str(len(compressed)).encode()))
+                    await send({**start, "headers": raw_headers})
+                    return await send({"type": "http.response.body", "body": compressed})
+                await send({**start, "headers": raw_headers})
+
+            # Streaming: flush each chunk so the client receives it now
+            data = compressor.compress(body, flush=True) if more else compressor.finish(body)
+            if data or not more:
+                await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, compressing_send)
@@ -0,0 +1,55 @@
+"""
+Conditional GET for JSON resources.
+
+Each resource has a cheap *version* (``updated_at``-like fields read with a
+projection, document count and latest change...) from which a weak ETag is
+derived. When the client's ``If-None-Match`` matches, the handler answers
+304 before loading or serializing the body.
+
+Responses carry ``Cache-Control: private, no-cache`` so browsers keep them
+but revalidate on every use, which is what makes them send
+``If-None-Match``.
+"""
+
+import hashlib
+from typing import Awaitable, Callable, Iterable, Optional
+
+from fastapi import Response
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(parts: Iterable) -> str:
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return f'W/"{digest.hexdigest()[:24]}"'
+
+
+async def version_etag(version: Callable[[], Awaitable[Iterable]]) -> str:
+    return make_etag(await version())
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as RFC 9110 requires for If-None-Match"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def with_etag(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
@@ -0,0 +1,247 @@
+"""
+PDF text extraction and per-user full-text search over documents.
+
+Extraction is CPU bound and runs in the shared process pool. The extracted text lives
+in the ``document_texts`` collection behind a compound ``{user_id, text}``
+Mongo text index, so every search is an equality match on the user followed
+by a lookup in that user's slice of the inverted index.
+"""
+
+import asyncio
+import hashlib
+import logging
+import re
+import unicodedata
+import zlib
+from datetime import datetime
+from typing import List, Optional
+
+import jobs
+from encryption import open_document
+from workers import run_cpu_bound
+
+logger = logging.getLogger(__name__)
+
+# Bump when extraction changes so the backfill re-indexes everything
+EXTRACTOR_VERSION = 1
+MAX_INDEXED_CHARS = 200_000
+SNIPPET_RADIUS = 80
+
+
+# ----------------------------------------------------------------------------
+# Extraction (runs in worker processes)
+# ----------------------------------------------------------------------------
+
+_STREAM_RE = re.compile(rb"stream\r?\n(.*?)\r?\nendstream", re.S)
+_TEXT_OP_RE = re.compile(rb"\((?:\\.|[^\\)])*\)\s*Tj|\[(?:\\.|[^\]])*\]\s*TJ|T\*|Td|TD|ET", re.S)
+_STRING_RE = re.compile(rb"\(((?:\\.|[^\\)])*)\)", re.S)
+_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f",
+            b"(": b"(", b")": b")", b"\\": b"\\"}
+
+
+def _unescape_pdf_string(raw: bytes) -> bytes:
+    out = bytearray()
+    i = 0
+    while i < len(raw):
+        c = raw[i:i + 1]
+        if c == b"\\" and i + 1 < len(raw):
+            nxt = raw[i + 1:i + 2]
+            if nxt in _ESCAPES:
+                out += _ESCAPES[nxt]
+                i += 2
+                continue
+            octal = re.match(rb"[0-7]{1,3}", raw[i + 1:i + 4])
+            if octal:
+                out.append(int(octal.group(), 8) & 0xFF)
+                i += 1 + len(octal.group())
+                continue
+            i += 1
+            continue
+        out += c
+        i += 1
+    return bytes(out)
+
+
+def _fallback_extract(data: bytes) -> str:
+    """Minimal extractor for simple PDFs when pypdf is not installed"""
+    parts = []
+    for match in _STREAM_RE.finditer(data):
+        stream = match.group(1)
+        try:
+            stream = zlib.decompress(stream)
+        except zlib.error:
+            pass
+        for op in _TEXT_OP_RE.finditer(stream):
+            token = op.group()
+            if token.endswith(b"Tj") or token.endswith(b"TJ"):
+                for s in _STRING_RE.finditer(token):
+                    parts.append(_unescape_pdf_string(s.group(1)).decode("latin-1"))
+            else:
+                parts.append("\n" if token in (b"ET", b"T*") else " ")
+    return "".join(parts)
+
+
+def extract_pdf_text(data: bytes) -> str:
+    """Return the text content of a PDF (executed in a worker process)"""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return _fallback_extract(data)
+    import io
+    try:
+        reader = PdfReader(io.BytesIO(data))
+        return "\n".join((page.extract_text() or "") for page in reader.pages)
+    except Exception:
+        return _fallback_extract(data)
+
+
+# ----------------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------------
+
+def normalize(text: str) -> str:
+    """Lowercase and strip accents so "déclaration" matches "declaration" """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in re.split(r"\W+", normalize(text)) if len(t) > 1]
+
+
+def make_snippet(text: str, query: str, radius: int = SNIPPET_RADIUS) -> str:
+    """Excerpt of ``text`` around the first query term it contains"""
+    if not text:
+        return ""
+    # Offsets line up with ``text`` for accented Latin characters, which is
+    # what French documents contain.
+    haystack = normalize(text)
+    positions = [haystack.find(t) for t in tokenize(query)]
+    positions = [p for p in positions if p >= 0]
+    if not positions:
+        return " ".join(text[:2 * radius].split())
+    start = max(0, min(positions) - radius)
+    end = min(len(text), min(positions) + radius)
+    snippet = " ".join(text[start:end].split())
+    return f"{'…' if start > 0 else ''}{snippet}{'…' if end < len(text) else ''}"
+
+
+async def read_document_bytes(document: dict) -> bytes:
+    return b"".join([chunk async for chunk in open_document(document)])
+
+
+# ----------------------------------------------------------------------------
+# Indexing
+# ----------------------------------------------------------------------------
+
+async def ensure_indexes(db):
+    await db.document_texts.create_index("document_id", unique=True)
+    await db.document_texts.create_index(
+        [("user_id", 1), ("text", "text"), ("filename", "text")],
+        weights={"filename": 5, "text": 1},
+        default_language="french",
+        name="user_text_search",
+    )
+
+
+async def index_document(db, document: dict, force: bool = False) -> bool:
+    """Extract and index one document. Returns False if it was already current.
+
+    Idempotent: a document whose content hash and extractor version match
+    the stored entry is skipped without reading the file.
+    """
+    existing = await db.document_texts.find_one(
+        {"document_id": document["id"]},
+        {"_id": 0, "content_hash": 1, "extractor_version": 1}
+    )
+    content_hash = document.get("content_hash")
+    if (not force and existing and content_hash
+            and existing.get("content_hash") == content_hash
+            and existing.get("extractor_version") == EXTRACTOR_VERSION):
+        return False
+
+    data = await read_document_bytes(document)
+    if not content_hash:
+        content_hash = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+        await db.documents.update_one({"id": document["id"]}, {"$set": {"content_hash": content_hash}})
+        if (not force and existing
+                and existing.get("content_hash") == content_hash
+                and existing.get("extractor_version") == EXTRACTOR_VERSION):
+            return False
+
+    text = await run_cpu_bound(extract_pdf_text, data)
+    text = text[:MAX_INDEXED_CHARS]
+
+    await db.document_texts.update_one(
+        {"document_id": document["id"]},
+        {"$set": {
+            "document_id": document["id"],
+            "user_id": document["user_id"],
+            "filename": document["filename"],
+            "category": document["category"],
+            "text": text,
+            "content_hash": content_hash,
+            "extractor_version": EXTRACTOR_VERSION,
+            "indexed_at": datetime.utcnow(),
+        }},
+        upsert=True
+    )
+    result = await db.documents.update_one(
+        {"id": document["id"]},
+        {"$set": {"text_status": "indexed", "text_indexed_version": EXTRACTOR_VERSION}}
+    )
+    if result.matched_count == 0:
+        # Document was deleted while we were extracting
+        await remove_document(db, document["id"])
+    return True
+
+
+async def _indexing_failed(db, payload: dict, error: Exception):
+    await db.documents.update_one({"id": payload["document_id"]}, {"$set": {"text_status": "failed"}})
+
+
+# Concurrency is that of the "documents" queue (JOB_QUEUES)
+@jobs.job("document.index", queue="documents", on_failure=_indexing_failed)
+async def _index_job(db, payload: dict):
+    document = await db.documents.find_one({"id": payload["document_id"]}, {"_id": 0})
+    if document is None:
+        # Deleted before its turn came
+        return
+    await index_document(db, document)
+
+
+async def schedule_indexing(db, document: dict):
+    """Queue text extraction for a freshly uploaded document"""
+    await jobs.enqueue(db, "document.index", {"document_id": document["id"]},
+                       dedupe_key=f"index:{document['id']}")
+
+
+async def remove_document(db, document_id: str):
+    await db.document_texts.delete_one({"document_id": document_id})
+
+
+async def remove_documents(db, document_ids: List[str]):
+    await db.document_texts.delete_many({"document_id": {"$in": document_ids}})
+
+
+async def update_document_fields(db, document_id: str, values: dict):
+    """Mirror a rename or category change onto the indexed text"""
+    fields = {k: v for k, v in values.items() if k in ("filename", "category")}
+    if fields:
+        await db.document_texts.update_one({"document_id": document_id}, {"$set": fields})
+
+
+async def search(db, user_id: str, query: str, category: Optional[str] = None, limit: int = 20):
+    """Ranked hits for ``query`` within one user's documents"""
+    text_filter = {"user_id": user_id, "$text": {"$search": query}}
+    if category:
+        text_filter["category"] = category
+    cursor = db.document_texts.find(
+        text_filter,
+        {"_id": 0, "document_id": 1, "text": 1, "score": {"$meta": "textScore"}}
+    ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+    hits = await cursor.to_list(length=limit)
+    return [
+        {"document_id": h["document_id"], "score": h["score"], "snippet": make_snippet(h.get("text", ""), query)}
+        for h in hits
+    ]
@@ -0,0 +1,183 @@
+"""
+Streaming authenticated encryption of stored documents.
+
+Each document gets its own random data key, wrapped (AES-GCM) by the master
+key from ``DOCUMENT_MASTER_KEY``. The file is cut into fixed-size plaintext
+chunks, each sealed independently with AES-256-GCM:
+
+    nonce(i) = nonce_prefix (8 bytes) || i (4 bytes, big endian)
+    aad(i)   = i (4 bytes) || is_last (1 byte)
+
+so chunks cannot be reordered, and the file cannot be truncated or
+extended without failing authentication. Because every ciphertext chunk has
+the same size (chunk_size + 16), a byte range maps to a contiguous run of
+chunks and can be served without decrypting the rest of the file.
+
+Only the metadata below is stored on the document row; the object in
+storage is the bare sequence of sealed chunks.
+"""
+
+import base64
+import os
+import struct
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from storage import document_location
+
+ALGORITHM = "AES-256-GCM-CHUNKED"
+DEFAULT_CHUNK_SIZE = 64 * 1024
+TAG_SIZE = 16
+_WRAP_AAD = b"elysion-document-key"
+
+
+class EncryptionError(Exception):
+    pass
+
+
+def _aesgcm(key: bytes):
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError as e:
+        raise EncryptionError("the cryptography package is required for document encryption") from e
+    return AESGCM(key)
+
+
+def _master_keys() -> Dict[str, bytes]:
+    """``DOCUMENT_MASTER_KEY`` (current) plus ``DOCUMENT_MASTER_KEY_<ID>`` for older ids"""
+    keys = {}
+    current = os.environ.get("DOCUMENT_MASTER_KEY")
+    if current:
+        keys[os.environ.get("DOCUMENT_MASTER_KEY_ID", "k1")] = base64.b64decode(current)
+    for name, value in os.environ.items():
+        if name.startswith("DOCUMENT_MASTER_KEY_") and name != "DOCUMENT_MASTER_KEY_ID":
+            keys.setdefault(name[len("DOCUMENT_MASTER_KEY_"):].lower(), base64.b64decode(value))
+    return keys
+
+
+def is_enabled() -> bool:
+    return bool(os.environ.get("DOCUMENT_MASTER_KEY"))
+
+
+def new_document_key(chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[bytes, dict]:
+    """Generate a data key; returns ``(data_key, metadata_to_store)``"""
+    key_id = os.environ.get("DOCUMENT_MASTER_KEY_ID", "k1")
+    master = _master_keys().get(key_id)
+    if master is None:
+        raise EncryptionError("DOCUMENT_MASTER_KEY is not configured")
+    data_key = os.urandom(32)
+    wrap_nonce = os.urandom(12)
+    wrapped = wrap_nonce + _aesgcm(master).encrypt(wrap_nonce, data_key, _WRAP_AAD)
+    return data_key, {
+        "alg": ALGORITHM,
+        "key_id": key_id,
+        "wrapped_key": base64.b64encode(wrapped).decode(),
+        "nonce_prefix": base64.b64encode(os.urandom(8)).decode(),
+        "chunk_size": chunk_size,
+    }
+
+
+def unwrap_key(metadata: dict) -> bytes:
+    master = _master_keys().get(metadata["key_id"])
+    if master is None:
+        raise EncryptionError(f"Unknown master key id: {metadata['key_id']}")
+    wrapped = base64.b64decode(metadata["wrapped_key"])
+    return _aesgcm(master).decrypt(wrapped[:12], wrapped[12:], _WRAP_AAD)
+
+
+def _nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + struct.pack(">I", index)
+
+
+def _aad(index: int, last: bool) -> bytes:
+    return struct.pack(">I?", index, last)
+
+
+def encrypted_size(plaintext_size: int, chunk_size: int) -> int:
+    chunks = max(1, -(-plaintext_size // chunk_size))
+    return plaintext_size + chunks * TAG_SIZE
+
+
+def plaintext_size(stored_size: int, chunk_size: int) -> int:
+    """Inverse of ``encrypted_size``"""
+    chunks = max(1, -(-stored_size // (chunk_size + TAG_SIZE)))
+    return stored_size - chunks * TAG_SIZE
+
+
+async def encrypt_stream(chunks: AsyncIterator[bytes], data_key: bytes, metadata: dict) -> AsyncIterator[bytes]:
+    """Seal an arbitrary chunk stream into fixed-size encrypted chunks"""
+    aead = _aesgcm(data_key)
+    prefix = base64.b64decode(metadata["nonce_prefix"])
+    size = metadata["chunk_size"]
+    buffer = bytearray()
+    index = 0
+    pending: Optional[bytes] = None  # one block of lookahead to know which is last
+
+    async for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            block = bytes(buffer[:size])
+            del buffer[:size]
+            if pending is not None:
+                yield aead.encrypt(_nonce(prefix, index), pending, _aad(index, False))
+                index += 1
+            pending = block
+
+    if buffer or pending is None:
+        if pending is not None:
+            yield aead.encrypt(_nonce(prefix, index), pending, _aad(index, False))
+            index += 1
+        pending = bytes(buffer)
+    yield aead.encrypt(_nonce(prefix, index), pending, _aad(index, True))
+
+
+async def decrypt_range(
+    storage,
+    key: str,
+    data_key: bytes,
+    metadata: dict,
+    plaintext_size: int,
+    start: int = 0,
+    end: Optional[int] = None,
+) -> AsyncIterator[bytes]:
+    """Yield plaintext bytes ``start..end`` (inclusive), reading only the chunks that cover them"""
+    aead = _aesgcm(data_key)
+    prefix = base64.b64decode(metadata["nonce_prefix"])
+    size = metadata["chunk_size"]
+    sealed = size + TAG_SIZE
+    end = plaintext_size - 1 if end is None else min(end, plaintext_size - 1)
+    last_index = max(0, -(-plaintext_size // size) - 1)
+    if end < start:
+        if plaintext_size == 0:
+            # Still authenticate the (empty) final chunk
+            async for _ in storage.open(key):
+                pass
+        return
+
+    first, last = start // size, end // size
+    buffer = bytearray()
+    index = first
+    stop = min((last + 1) * sealed, encrypted_size(plaintext_size, size))
+    async for chunk in storage.open(key, first * sealed, stop - 1):
+        buffer += chunk
+        while index <= last:
+            # Only the final chunk of the file may be shorter than ``sealed``
+            length = sealed if index < last_index else plaintext_size - last_index * size + TAG_SIZE
+            if len(buffer) < length:
+                break
+            block = aead.decrypt(_nonce(prefix, index), bytes(buffer[:length]), _aad(index, index == last_index))
+            del buffer[:length]
+            lo = start - index * size if index == first else 0
+            hi = end - index * size + 1 if index == last else len(block)
+            yield block[lo:hi]
+            index += 1
+    if index <= last:
+        raise EncryptionError("Encrypted document is truncated")
+
+
+def open_document(document: dict, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Plaintext bytes of a stored document, decrypting when it is encrypted"""
+    storage, key = document_location(document)
+    metadata = document.get("encryption")
+    if not metadata:
+        return storage.open(key, start, end)
+    return decrypt_range(storage, key, unwrap_key(metadata), metadata, document["file_size"], start, end)
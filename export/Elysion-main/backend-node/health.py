@@ -0,0 +1,93 @@
+"""
+Liveness and readiness of an API worker, for the orchestrator's probes.
+
+* Liveness only proves the process and its event loop answer: it never
+  touches Mongo, so a slow database does not get healthy workers killed.
+* Readiness says the worker should receive traffic: startup is finished
+  (indexes created, connection pool warmed), Mongo answers a ping within
+  ``READY_MAX_PING_MS`` and less than ``READY_MAX_POOL_SATURATION`` of the
+  pool is checked out (with DATABASE_BACKEND=postgres: Postgres answers a
+  ping within ``READY_MAX_PING_MS``). An overloaded worker therefore reports not ready and
+  drains until its pool frees up; shutdown flips it to not ready before the
+  client is closed.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+import metrics
+from repositories import DEFAULT_MAX_POOL_SIZE, Repositories, mongo_client_options
+
+logger = logging.getLogger(__name__)
+
+READY_MAX_PING_MS = float(os.environ.get("READY_MAX_PING_MS", "250"))
+READY_MAX_POOL_SATURATION = float(os.environ.get("READY_MAX_POOL_SATURATION", "0.9"))
+PING_TIMEOUT = float(os.environ.get("READY_PING_TIMEOUT_MS", "1000")) / 1000
+
+
+async def ping(db, timeout: float = PING_TIMEOUT) -> float:
+    """Round trip of a Mongo ping, in milliseconds"""
+    started = time.perf_counter()
+    await asyncio.wait_for(db.command("ping"), timeout)
+    return (time.perf_counter() - started) * 1000
+
+
+def max_pool_size() -> int:
+    return mongo_client_options().get("maxPoolSize") or DEFAULT_MAX_POOL_SIZE
+
+
+async def warm_pool(repos: Repositories, connections: Optional[int] = None):
+    """Open ``connections`` pooled connections (MONGO_WARM_CONNECTIONS, default
+    the minimum pool size or 1) by running that many pings concurrently, so the
+    first requests do not pay for TCP/TLS handshakes and authentication"""
+    if repos.db is None:
+        return
+    if connections is None:
+        connections = int(os.environ.get("MONGO_WARM_CONNECTIONS", "0")) or \
+            mongo_client_options().get("minPoolSize") or 1
+    connections = max(1, min(connections, max_pool_size()))
+    started = time.perf_counter()
+    await asyncio.gather(*(repos.db.command("ping") for _ in range(connections)))
+    logger.info(f"Mongo pool warmed: {connections} connection(s) in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+async def readiness(repos: Repositories, started: bool) -> Tuple[bool, dict]:
+    """``(ready, details)`` for the readiness probe"""
+    reasons: List[str] = []
+    details = {}
+    if not started:
+        reasons.append("démarrage en cours")
+
+    if repos.db is not None:
+        # Read before pinging: the probe's own checkout must not count
+        checked_out = metrics.MONGO_CHECKED_OUT.value()
+        pool_max = max_pool_size()
+        details["pool_checked_out"] = int(checked_out)
+        details["pool_max"] = pool_max
+        if checked_out >= pool_max * READY_MAX_POOL_SATURATION:
+            reasons.append(f"pool Mongo saturé ({int(checked_out)}/{pool_max})")
+        try:
+            latency = await ping(repos.db)
+            details["mongo_ping_ms"] = round(latency, 1)
+            if latency > READY_MAX_PING_MS:
+                reasons.append(f"ping Mongo lent ({latency:.0f} ms)")
+        except Exception as e:
+            reasons.append(f"Mongo injoignable ({type(e).__name__})")
+
+    if repos.sql is not None:
+        try:
+            started_at = time.perf_counter()
+            await asyncio.wait_for(repos.sql.ping(), PING_TIMEOUT)
+            latency = (time.perf_counter() - started_at) * 1000
+            details["postgres_ping_ms"] = round(latency, 1)
+            if latency > READY_MAX_PING_MS:
+                reasons.append(f"ping Postgres lent ({latency:.0f} ms)")
+        except Exception as e:
+            reasons.append(f"Postgres injoignable ({type(e).__name__})")
+
+    if reasons:
+        return False, {"status": "not_ready", "reasons": reasons, **details}
+    return True, {"status": "ready", **details}
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Standalone background job worker.
+
+Runs the durable job queues (see jobs.py) and the email outbox sender (see
+outbox.py) outside the API processes, so heavy work such as PDF extraction
+scales separately from request handling.
+Start the API with ``JOBS_IN_PROCESS=0`` and as many of these as needed:
+jobs are claimed atomically, so workers never run the same job twice.
+Stopping a worker (Ctrl+C, SIGTERM) hands its in-flight jobs back to the
+queue.
+
+Usage:
+    python job_worker.py
+    python job_worker.py --queues documents:4 --metrics-port 9101
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Importing the modules registers their handlers (document.index, career.parse...)
+import analytics  # noqa: F401
+import career_statement  # noqa: F401
+import document_search  # noqa: F401
+import jobs
+import metrics
+import outbox
+import password_reset  # noqa: F401
+import user_export  # noqa: F401
+import workers
+from repositories import create_repositories
+from storage import close_storages
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+async def serve_metrics(port: int):
+    """Minimal /metrics endpoint for the Prometheus scraper"""
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if request_line.split(b" ")[1:2] == [b"/metrics"]:
+                body = metrics.render()
+                head = f"HTTP/1.1 200 OK\r\nContent-Type: {metrics.CONTENT_TYPE}\r\n"
+            else:
+                body = b"Not Found\n"
+                head = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+            writer.write(f"{head}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "0.0.0.0", port)
+    async with server:
+        await server.serve_forever()
+
+
+async def run(args):
+    repos = create_repositories(event_listeners=[metrics.MongoPoolListener()])
+    if repos.db is None:
+        raise SystemExit("❌ Le worker de tâches nécessite DATABASE_BACKEND=mongo")
+    await jobs.ensure_indexes(repos.db)
+    await outbox.ensure_indexes(repos.db)
+
+    queues = jobs.parse_queues(args.queues)
+    tasks = [asyncio.ensure_future(jobs.JobWorker(repos.db, queues).run())]
+    if not args.no_outbox:
+        tasks.append(asyncio.ensure_future(outbox.OutboxSender(repos.db).run()))
+    if args.metrics_port:
+        tasks.append(asyncio.ensure_future(serve_metrics(args.metrics_port)))
+    tasks.append(asyncio.ensure_future(metrics.monitor_event_loop()))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    print(f"⚙️  Worker démarré sur les files {queues}")
+    try:
+        done, _ = await asyncio.wait([asyncio.ensure_future(stop.wait()), *tasks],
+                                     return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task in tasks and task.exception():
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        # In-flight jobs are released while their tasks unwind
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await workers.cancel_background_tasks()
+        await repos.close()
+        await close_storages()
+        workers.shutdown()
+    print("👋 Worker arrêté")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the background job queues")
+    parser.add_argument("--queues", default=os.environ.get("JOB_QUEUES", jobs.DEFAULT_QUEUES),
+                        help="queue:concurrency list (default JOB_QUEUES or %(default)s)")
+    parser.add_argument("--no-outbox", action="store_true", help="do not send the queued emails")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
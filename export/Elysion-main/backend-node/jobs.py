@@ -0,0 +1,337 @@
+"""
+Durable background jobs, stored in the ``jobs`` Mongo collection.
+
+Handlers are registered by name with ``@job(...)`` in the module that owns
+the work (``document.index`` in document_search.py...), and work is deferred
+with ``await enqueue(db, name, payload)``. A ``JobWorker`` runs the queues,
+either inside the API process (``JOBS_IN_PROCESS``, on by default) or in a
+separate process started with ``job_worker.py``.
+
+Guarantees:
+
+* claiming is a single ``find_one_and_update`` that sets a lease
+  (``JOB_LEASE_SECONDS``), renewed while the handler runs. A job whose
+  worker died is claimed again once its lease expires, so nothing is lost
+  across restarts; on a clean shutdown in-flight async jobs are handed back
+  at once;
+* completion is only recorded by the lease owner, and a worker that loses
+  its lease cancels the handler, so an async job never runs twice
+  concurrently. ``cpu=True`` handlers cannot be stopped once a pool process
+  runs them: on shutdown they keep their lease instead of being handed back
+  (claimed again when it expires, after the pool finished them), but a
+  worker that loses the lease (renewals failing for ``JOB_LEASE_SECONDS``)
+  leaves the old run going while the new owner starts another. Delivery is
+  at-least-once anyway (a crash after the work but before the completion
+  write re-runs it): handlers must be idempotent;
+* failures are retried with exponential backoff and jitter, up to
+  ``max_attempts``; the job is then left ``failed`` (and ``on_failure`` is
+  called) until finished jobs expire after ``JOB_RETENTION_SECONDS``;
+* each queue has its own concurrency (``JOB_QUEUES=default:4,documents:2``),
+  and ``cpu=True`` handlers (plain picklable functions) run in the shared
+  process pool.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import metrics
+import workers
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_QUEUES = "default:4,documents:2"
+LEASE = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+POLL_INTERVAL = float(os.environ.get("JOB_POLL_SECONDS", "1"))
+RETRY_BASE = float(os.environ.get("JOB_RETRY_BASE_SECONDS", "5"))
+RETRY_MAX = float(os.environ.get("JOB_RETRY_MAX_SECONDS", "3600"))
+RETENTION = int(os.environ.get("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+METRICS_INTERVAL = float(os.environ.get("JOB_METRICS_INTERVAL_SECONDS", "15"))
+
+
+class JobHandler:
+    def __init__(self, name: str, fn: Callable, queue: str, cpu: bool, max_attempts: int,
+                 on_failure: Optional[Callable] = None):
+        self.name = name
+        self.fn = fn
+        self.queue = queue
+        self.cpu = cpu
+        self.max_attempts = max_attempts
+        self.on_failure = on_failure
+
+
+_handlers: Dict[str, JobHandler] = {}
+# Wakes the in-process consumers of a queue as soon as a job is enqueued
+_wakeups: Dict[str, asyncio.Event] = {}
+
+
+def job(name: str, queue: str = "default", cpu: bool = False, max_attempts: int = 5,
+        on_failure: Optional[Callable] = None):
+    """Register a handler.
+
+    Async handlers are called as ``await fn(db, payload)``; ``cpu=True``
+    handlers as ``fn(payload)`` in the process pool. ``on_failure(db, payload,
+    error)`` runs once the last attempt failed.
+    """
+    def register(fn):
+        if name in _handlers:
+            raise ValueError(f"Job handler already registered: {name}")
+        _handlers[name] = JobHandler(name, fn, queue, cpu, max_attempts, on_failure)
+        return fn
+    return register
+
+
+def _wakeup(queue: str) -> asyncio.Event:
+    event = _wakeups.get(queue)
+    if event is None:
+        event = _wakeups[queue] = asyncio.Event()
+    return event
+
+
+async def ensure_indexes(db):
+    await db.jobs.create_index([("queue", 1), ("status", 1), ("run_at", 1)])
+    await db.jobs.create_index([("status", 1), ("lease_expires_at", 1)])
+    # One pending job per key; the key is removed when the job is claimed, so
+    # a change made while the job runs queues another run
+    await db.jobs.create_index("dedupe_key", unique=True, sparse=True)
+    await db.jobs.create_index("finished_at", expireAfterSeconds=RETENTION)
+
+
+async def enqueue(db, name: str, payload: Dict[str, Any], delay: float = 0,
+                  dedupe_key: Optional[str] = None) -> Optional[str]:
+    """Persist a job; returns its id, or None if a job with ``dedupe_key`` is still pending"""
+    handler = _handlers.get(name)
+    if handler is None:
+        raise ValueError(f"Unknown job: {name}")
+    now = datetime.utcnow()
+    document = {
+        "_id": uuid.uuid4().hex,
+        "name": name,
+        "queue": handler.queue,
+        "payload": payload,
+        "status": PENDING,
+        "attempts": 0,
+        "max_attempts": handler.max_attempts,
+        "created_at": now,
+        "run_at": now + timedelta(seconds=delay),
+    }
+    if dedupe_key:
+        document["dedupe_key"] = dedupe_key
+    try:
+        await db.jobs.insert_one(document)
+    except DuplicateKeyError:
+        return None
+    if not delay:
+        _wakeup(handler.queue).set()
+    return document["_id"]
+
+
+def parse_queues(spec: str) -> Dict[str, int]:
+    """``"default:4,documents:2"`` -> ``{"default": 4, "documents": 2}``"""
+    queues = {}
+    for item in spec.split(","):
+        name, _, concurrency = item.strip().partition(":")
+        if name:
+            queues[name] = max(1, int(concurrency or 1))
+    return queues
+
+
+def retry_delay(attempts: int) -> float:
+    delay = min(RETRY_BASE * 2 ** max(0, attempts - 1), RETRY_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class JobWorker:
+    def __init__(self, db, queues: Dict[str, int]):
+        self.db = db
+        self.queues = queues
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def run(self):
+        """Consume the queues until cancelled"""
+        tasks = [self._report_depth()]
+        for queue, concurrency in self.queues.items():
+            tasks.extend(self._consume(queue) for _ in range(concurrency))
+        logger.info(f"Job worker {self.owner} started: {self.queues}")
+        await asyncio.gather(*tasks)
+
+    async def _consume(self, queue: str):
+        wakeup = _wakeup(queue)
+        while True:
+            try:
+                job = await self._claim(queue)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job claim failed on {queue}: {e}")
+                job = None
+            if job is None:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._execute(job)
+
+    async def _claim(self, queue: str) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await self.db.jobs.find_one_and_update(
+            {"queue": queue, "$or": [
+                {"status": PENDING, "run_at": {"$lte": now}},
+                # Lease of a dead worker
+                {"status": RUNNING, "lease_expires_at": {"$lt": now}},
+            ]},
+            {
+                "$set": {
+                    "status": RUNNING,
+                    "lease_owner": self.owner,
+                    "lease_expires_at": now + timedelta(seconds=LEASE),
+                    "started_at": now,
+                },
+                "$inc": {"attempts": 1},
+                "$unset": {"dedupe_key": ""},
+            },
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _execute(self, job: dict):
+        handler = _handlers.get(job["name"])
+        queue = job["queue"]
+        metrics.JOB_WAIT.observe(queue, value=max(0.0, (job["started_at"] - job["run_at"]).total_seconds()))
+
+        if handler is None:
+            await self._finish(job, FAILED, f"Unknown job: {job['name']}")
+            return
+        if job["attempts"] > job["max_attempts"]:
+            # Its workers kept dying while running it
+            await self._finish(job, FAILED, "Lease expired on the last attempt")
+            metrics.JOBS.inc(queue, job["name"], FAILED)
+            return
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        task = asyncio.ensure_future(self._call(handler, job["payload"]))
+        heartbeat = asyncio.ensure_future(self._heartbeat(job, task))
+        try:
+            await task
+        except asyncio.CancelledError:
+            if heartbeat.done():
+                # The heartbeat lost the lease and cancelled the handler: the new owner runs it
+                return
+            if not handler.cpu:
+                # Shutdown: hand the job back right away. A pool process keeps
+                # running a cpu job though: it is left to its lease instead.
+                await asyncio.shield(self._release(job))
+            raise
+        except Exception as e:
+            metrics.JOB_DURATION.observe(queue, job["name"], value=loop.time() - started)
+            await self._failed(handler, job, e)
+            return
+        finally:
+            heartbeat.cancel()
+
+        metrics.JOB_DURATION.observe(queue, job["name"], value=loop.time() - started)
+        metrics.JOBS.inc(queue, job["name"], DONE)
+        await self._finish(job, DONE)
+
+    async def _call(self, handler: JobHandler, payload: dict):
+        if handler.cpu:
+            return await workers.run_cpu_bound(handler.fn, payload)
+        return await handler.fn(self.db, payload)
+
+    async def _heartbeat(self, job: dict, task: asyncio.Future):
+        while True:
+            await asyncio.sleep(LEASE / 3)
+            try:
+                result = await self.db.jobs.update_one(
+                    {"_id": job["_id"], "lease_owner": self.owner},
+                    {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=LEASE)}}
+                )
+            except Exception as e:
+                # Retried on the next beat, well before the lease expires
+                logger.error(f"Lease renewal of job {job['_id']} failed: {e}")
+                continue
+            if result.matched_count == 0:
+                # Only stops waiting for a cpu job: its pool process runs on
+                logger.warning(f"Lost the lease of job {job['_id']} ({job['name']}), cancelling it")
+                task.cancel()
+                return
+
+    async def _failed(self, handler: JobHandler, job: dict, error: Exception):
+        message = f"{type(error).__name__}: {error}"
+        if job["attempts"] < job["max_attempts"]:
+            delay = retry_delay(job["attempts"])
+            logger.warning(f"Job {job['name']} failed (attempt {job['attempts']}), retry in {delay:.0f}s: {message}")
+            metrics.JOBS.inc(job["queue"], job["name"], "retry")
+            await self.db.jobs.update_one(
+                {"_id": job["_id"], "lease_owner": self.owner},
+                {"$set": {
+                    "status": PENDING,
+                    "run_at": datetime.utcnow() + timedelta(seconds=delay),
+                    "last_error": message,
+                    "lease_owner": None,
+                    "lease_expires_at": None,
+                }}
+            )
+            return
+        logger.error(f"Job {job['name']} failed for good after {job['attempts']} attempts: {message}")
+        metrics.JOBS.inc(job["queue"], job["name"], FAILED)
+        await self._finish(job, FAILED, message)
+        if handler.on_failure is not None:
+            try:
+                await handler.on_failure(self.db, job["payload"], error)
+            except Exception as e:
+                logger.error(f"on_failure of {job['name']} failed: {e}")
+
+    async def _finish(self, job: dict, status: str, error: Optional[str] = None):
+        values = {"status": status, "finished_at": datetime.utcnow(), "lease_owner": None, "lease_expires_at": None}
+        if error:
+            values["last_error"] = error
+        await self.db.jobs.update_one(
+            {"_id": job["_id"], "lease_owner": self.owner},
+            {"$set": values}
+        )
+
+    async def _release(self, job: dict):
+        """Give an interrupted job back without counting the attempt"""
+        try:
+            await self.db.jobs.update_one(
+                {"_id": job["_id"], "lease_owner": self.owner},
+                {"$set": {"status": PENDING, "run_at": datetime.utcnow(),
+                          "lease_owner": None, "lease_expires_at": None},
+                 "$inc": {"attempts": -1}}
+            )
+        except Exception as e:
+            logger.error(f"Could not release job {job['_id']}: {e}")
+
+    async def _report_depth(self):
+        while True:
+            try:
+                groups = await self.db.jobs.aggregate([
+                    {"$match": {"status": {"$in": [PENDING, RUNNING]}}},
+                    {"$group": {"_id": {"queue": "$queue", "status": "$status"}, "count": {"$sum": 1}}},
+                ]).to_list(length=None)
+                counts = {(g["_id"]["queue"], g["_id"]["status"]): g["count"] for g in groups}
+                for queue in set(self.queues) | {q for q, _ in counts}:
+                    for status in (PENDING, RUNNING):
+                        metrics.JOB_QUEUE_DEPTH.set(queue, status, value=counts.get((queue, status), 0))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job queue depth query failed: {e}")
+            await asyncio.sleep(METRICS_INTERVAL)
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Bulk deletions on a live database, in throttled and resumable batches.
+
+    purge   the users matching a filter (test accounts, inactive accounts...)
+            and everything they own: questionnaire, simulation, documents
+            and their files, search texts, exports, quota usage, reset
+            tokens, unsent emails, queued reset and invite jobs (they hold
+            tokens) and change events
+    wipe    every user data collection (what clean_database.py did), files
+            included, and the email outbox and job queue
+
+Rows are deleted in ``_id`` order, ``--batch-size`` at a time, and never
+more than ``--rate`` rows per second overall, so a large deletion does not
+swamp the primary. The position reached is checkpointed in
+``maintenance_checkpoints`` after every batch: starting an interrupted run
+again with the same arguments resumes it (``--restart`` starts over).
+Collections are processed concurrently (``--concurrency``).
+
+Rows go before files, as in the API: a file left behind by an interruption
+is collected by the storage reconciliation. A purged user's own row goes
+last, so a resumed run still finds what was left of its data.
+
+Usage:
+    python maintenance.py purge --email '@test\\.elysion\\.fr$' --dry-run
+    python maintenance.py purge --inactive-days 730 --rate 500
+    python maintenance.py purge --user-type freelancer --created-before 2024-01-01
+    python maintenance.py wipe --yes
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import analytics
+from cache import Cache, create_cache
+from reconciliation import RateLimiter
+from storage import close_storages, document_location, get_storage
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# Collections holding a user's data: the field pointing at the user, and
+# whether it holds the user's id or email
+OWNED = [
+    ("user_profiles", "user_id", "user_id"),
+    ("retirement_profiles", "user_id", "user_id"),
+    ("documents", "user_id", "user_id"),
+    ("user_usage", "user_id", "user_id"),
+    ("user_exports", "user_id", "user_id"),
+    ("password_resets", "email", "email"),
+    # Unsent emails carry reset links, queued resets their token
+    ("email_outbox", "to", "email"),
+    ("jobs", "payload.email", "email"),
+    ("user_changes", "user_id", "user_id"),
+]
+# Everything wiped (the search texts follow their documents when purging)
+WIPED = ["users", *(name for name, _, _ in OWNED), "document_texts",
+         "analytics_users", "analytics_rollups", "career_statements"]
+# Rows whose stored file is deleted with them
+FILE_FIELDS = {
+    "documents": {"id": 1, "storage_backend": 1, "storage_key": 1, "file_path": 1},
+    "user_exports": {"storage_backend": 1, "storage_key": 1},
+}
+
+
+class Progress:
+    """Deleted rows per collection, reported with the throughput of this run"""
+
+    def __init__(self, counts: Optional[Dict[str, int]] = None):
+        self.counts = Counter(counts or {})
+        self.done = 0
+        self.started = time.monotonic()
+
+    def add(self, name: str, count: int):
+        self.counts[name] += count
+        self.done += count
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed else 0
+        detail = ", ".join(f"{name} {count}" for name, count in sorted(self.counts.items()) if count)
+        print(f"   {sum(self.counts.values())} ligne(s) ({rate:.0f}/s) : {detail or 'rien'}")
+
+
+# ----------------------------------------------------------------------------
+# Checkpoints
+# ----------------------------------------------------------------------------
+
+async def load_checkpoint(db, key: str, restart: bool) -> Optional[dict]:
+    """Position of the unfinished run ``key``, if any"""
+    if restart:
+        await db.maintenance_checkpoints.delete_one({"_id": key})
+        return None
+    checkpoint = await db.maintenance_checkpoints.find_one({"_id": key})
+    if checkpoint is None or checkpoint.get("finished_at"):
+        return None
+    return checkpoint
+
+
+async def save_checkpoint(db, key: str, last_id, counts: Dict[str, int], finished: bool = False):
+    now = datetime.utcnow()
+    checkpoint = {"_id": key, "last_id": last_id, "counts": dict(counts), "updated_at": now}
+    if finished:
+        checkpoint["finished_at"] = now
+    await db.maintenance_checkpoints.replace_one({"_id": key}, checkpoint, upsert=True)
+
+
+# ----------------------------------------------------------------------------
+# Deletion
+# ----------------------------------------------------------------------------
+
+def _stored_file(collection: str, row: dict):
+    if collection == "documents":
+        return document_location(row)
+    if row.get("storage_key"):
+        return get_storage(row["storage_backend"]), row["storage_key"]
+    return None
+
+
+async def delete_files(collection: str, rows: List[dict], concurrency: int, progress: Progress):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def delete(storage, key):
+        async with semaphore:
+            try:
+                await storage.delete(key)
+                progress.add("files", 1)
+            except Exception as e:
+                print(f"⚠️  Impossible de supprimer {storage.name}:{key} : {e}")
+
+    locations = [location for location in (_stored_file(collection, row) for row in rows) if location]
+    await asyncio.gather(*(delete(storage, key) for storage, key in locations))
+
+
+async def delete_rows(db, collection: str, rows: List[dict], args, limiter: RateLimiter, progress: Progress,
+                      query: Optional[dict] = None):
+    """Delete ``rows`` (by ``_id``, or by ``query`` when given), then their files and search texts"""
+    await limiter.wait(len(rows))
+    result = await db[collection].delete_many(query or {"_id": {"$in": [row["_id"] for row in rows]}})
+    progress.add(collection, result.deleted_count)
+    if collection == "documents":
+        texts = await db.document_texts.delete_many({"document_id": {"$in": [row["id"] for row in rows]}})
+        progress.add("document_texts", texts.deleted_count)
+    if collection in FILE_FIELDS:
+        await delete_files(collection, rows, args.concurrency, progress)
+
+
+async def purge_owned(db, collection: str, field: str, owners: List[str], args, limiter: RateLimiter,
+                      progress: Progress, semaphore: asyncio.Semaphore):
+    query = {field: {"$in": owners}}
+    async with semaphore:
+        if args.dry_run:
+            progress.add(collection, await db[collection].count_documents(query))
+            return
+        while True:
+            rows = await db[collection].find(
+                query, {"_id": 1, **FILE_FIELDS.get(collection, {})}
+            ).sort("_id", 1).limit(args.batch_size).to_list(length=None)
+            if not rows:
+                return
+            await delete_rows(db, collection, rows, args, limiter, progress)
+
+
+async def purge_invites(db, emails: List[str], args, progress: Progress):
+    """Remove the users' invitations (and tokens) from queued invite batches,
+    which may also invite users that are kept"""
+    query = {"name": "auth.invite", "payload.invites.email": {"$in": emails}}
+    if args.dry_run:
+        progress.add("invites", await db.jobs.count_documents(query))
+        return
+    result = await db.jobs.update_many(query, {"$pull": {"payload.invites": {"email": {"$in": emails}}}})
+    progress.add("invites", result.modified_count)
+
+
+def user_query(args) -> dict:
+    query = {}
+    if args.email:
+        query["email"] = {"$regex": args.email}
+    if args.user_type:
+        query["user_type"] = args.user_type
+    if args.created_before:
+        query["created_at"] = {"$lt": datetime.fromisoformat(args.created_before)}
+    if args.inactive_days is not None:
+        cutoff = datetime.utcnow() - timedelta(days=args.inactive_days)
+        # Accounts that never logged in since last_login_at exists count from their creation
+        query["$or"] = [
+            {"last_login_at": {"$lt": cutoff}},
+            {"last_login_at": {"$exists": False}, "created_at": {"$lt": cutoff}},
+        ]
+    return query
+
+
+def purge_key(args) -> str:
+    """Same filter arguments, same checkpoint"""
+    options = {name: getattr(args, name) for name in ("email", "user_type", "created_before", "inactive_days")}
+    return "purge:" + hashlib.sha1(json.dumps(options, sort_keys=True).encode()).hexdigest()[:16]
+
+
+async def purge(db, cache: Cache, args):
+    query = user_query(args)
+    key = purge_key(args)
+    checkpoint = None if args.dry_run else await load_checkpoint(db, key, args.restart)
+    progress = Progress(checkpoint and checkpoint["counts"])
+    last_id = checkpoint and checkpoint["last_id"]
+    if checkpoint:
+        print(f"↩️  Reprise après {sum(progress.counts.values())} ligne(s) supprimée(s)")
+    limiter = RateLimiter(args.rate)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    while True:
+        batch_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+        users = await db.users.find(
+            batch_query, {"_id": 1, "id": 1, "email": 1}
+        ).sort("_id", 1).limit(args.batch_size).to_list(length=None)
+        if not users:
+            break
+        owners = {"user_id": [user["id"] for user in users], "email": [user["email"] for user in users]}
+        await asyncio.gather(*(
+            purge_owned(db, collection, field, owners[owner], args, limiter, progress, semaphore)
+            for collection, field, owner in OWNED
+        ))
+        await purge_invites(db, owners["email"], args, progress)
+        if args.dry_run:
+            progress.add("users", len(users))
+        else:
+            await delete_rows(db, "users", users, args, limiter, progress)
+            await asyncio.gather(*(cache.invalidate(user_id) for user_id in owners["user_id"]))
+            await analytics.users_changed(db, owners["user_id"])
+        last_id = users[-1]["_id"]
+        if not args.dry_run:
+            await save_checkpoint(db, key, last_id, progress.counts)
+        progress.report()
+
+    if not args.dry_run:
+        await save_checkpoint(db, key, last_id, progress.counts, finished=True)
+    return progress
+
+
+async def wipe_collection(db, cache: Cache, collection: str, args, limiter: RateLimiter, progress: Progress):
+    key = f"wipe:{collection}"
+    checkpoint = await load_checkpoint(db, key, args.restart)
+    last_id = checkpoint and checkpoint["last_id"]
+    if checkpoint:
+        progress.counts[collection] += checkpoint["counts"].get(collection, 0)
+    fields = {"_id": 1, "id": 1} if collection == "users" else {"_id": 1, **FILE_FIELDS.get(collection, {})}
+    while True:
+        rows = await db[collection].find(
+            {} if last_id is None else {"_id": {"$gt": last_id}}, fields
+        ).sort("_id", 1).limit(args.batch_size).to_list(length=None)
+        if not rows:
+            break
+        await delete_rows(db, collection, rows, args, limiter, progress,
+                          query={"_id": {"$gte": rows[0]["_id"], "$lte": rows[-1]["_id"]}})
+        if collection == "users":
+            await asyncio.gather(*(cache.invalidate(row["id"]) for row in rows if "id" in row))
+        last_id = rows[-1]["_id"]
+        await save_checkpoint(db, key, last_id, {collection: progress.counts[collection]})
+        progress.report()
+    await save_checkpoint(db, key, last_id, {collection: progress.counts[collection]}, finished=True)
+
+
+async def wipe(db, cache: Cache, args):
+    progress = Progress()
+    if args.dry_run:
+        for collection in WIPED:
+            progress.add(collection, await db[collection].estimated_document_count())
+        return progress
+    limiter = RateLimiter(args.rate)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run(collection):
+        async with semaphore:
+            await wipe_collection(db, cache, collection, args, limiter, progress)
+
+    await asyncio.gather(*(run(collection) for collection in WIPED))
+    return progress
+
+
+# ----------------------------------------------------------------------------
+# CLI
+# ----------------------------------------------------------------------------
+
+def confirm(message: str) -> bool:
+    return input(f"⚠️  {message}. Continuer ? (oui/non) ").strip().lower() in ("o", "oui", "y", "yes")
+
+
+async def run(args):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    cache = create_cache()
+    mode = " (simulation)" if args.dry_run else ""
+
+    try:
+        if args.command == "purge":
+            matching = await db.users.count_documents(user_query(args))
+            if not args.dry_run and not args.yes and not confirm(f"{matching} compte(s) et toutes leurs données vont être supprimés"):
+                print("Annulé")
+                return
+            print(f"🧹 Suppression de {matching} compte(s){mode}...")
+            progress = await purge(db, cache, args)
+        else:
+            if not args.dry_run and not args.yes and not confirm("Toutes les données utilisateurs vont être supprimées"):
+                print("Annulé")
+                return
+            print(f"🧹 Nettoyage de la base de données{mode}...")
+            progress = await wipe(db, cache, args)
+
+        elapsed = time.monotonic() - progress.started
+        print(f"\n📊 Résultat{mode} ({elapsed:.1f}s) :")
+        for name, count in sorted(progress.counts.items()):
+            print(f"   - {name} : {count}")
+    finally:
+        client.close()
+        await cache.close()
+        await close_storages()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Throttled, resumable bulk deletions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    purge_parser = commands.add_parser("purge", help="delete matching users and everything they own")
+    purge_parser.add_argument("--email", help="regular expression on the email (e.g. '@test\\.elysion\\.fr$')")
+    purge_parser.add_argument("--user-type", choices=["employee", "freelancer", "business_owner"])
+    purge_parser.add_argument("--created-before", help="ISO date, e.g. 2024-01-01")
+    purge_parser.add_argument("--inactive-days", type=float, help="no login for this many days")
+    purge_parser.add_argument("--all", action="store_true", help="every user (no filter)")
+    commands.add_parser("wipe", help="empty every user data collection")
+
+    for command in commands.choices.values():
+        command.add_argument("--dry-run", action="store_true", help="count only, delete nothing")
+        command.add_argument("--batch-size", type=int, default=500)
+        command.add_argument("--rate", type=float, default=1000.0, help="max rows deleted per second (0 = unlimited)")
+        command.add_argument("--concurrency", type=int, default=4, help="collections processed at once")
+        command.add_argument("--restart", action="store_true", help="ignore the checkpoint of an interrupted run")
+        command.add_argument("--yes", action="store_true", help="do not ask for confirmation")
+
+    args = parser.parse_args(argv)
+    if args.command == "purge" and not args.all and not user_query(args):
+        parser.error("purge needs a filter (--email, --user-type, --created-before, --inactive-days) or --all")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
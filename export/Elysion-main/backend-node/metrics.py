@@ -0,0 +1,347 @@
+"""
+Prometheus-compatible metrics, rendered in the text exposition format.
+
+A tiny in-process registry (counters, gauges, histograms) rather than a
+client library: the metric set is small and fixed. Values are per process;
+with several uvicorn workers, scrape each one (or put them behind a
+collector) as usual.
+
+HTTP metrics are labelled with the route *template* (``/api/documents/
+{document_id}``), never the raw path, so cardinality stays bounded by the
+number of routes. Requests that match no route share the ``unmatched``
+label.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def _key(self, labels: Tuple) -> Tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        return tuple(str(v) for v in labels)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, *labels) -> float:
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # labels -> [bucket counts..., sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, *labels, value: float):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{_format_labels(self.label_names, labels)} {series[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+REGISTRY = Registry()
+
+# HTTP
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by route template, method and status", ("method", "route", "status"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time until the response body was fully sent", ("method", "route"))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "Requests currently being handled", ("method",))
+HTTP_REQUEST_BYTES = REGISTRY.counter(
+    "http_request_body_bytes_total", "Request body bytes received (uploads)", ("route",))
+HTTP_RESPONSE_BYTES = REGISTRY.counter(
+    "http_response_body_bytes_total", "Response body bytes sent (downloads)", ("route",))
+
+# Mongo connection pool
+MONGO_CHECKOUTS = REGISTRY.counter(
+    "mongo_pool_checkouts_total", "Connection checkouts from the Mongo pool", ("result",))
+MONGO_CHECKOUT_WAIT = REGISTRY.histogram(
+    "mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled Mongo connection",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+MONGO_CHECKED_OUT = REGISTRY.gauge(
+    "mongo_pool_checked_out_connections", "Mongo connections currently checked out")
+MONGO_CONNECTIONS = REGISTRY.gauge(
+    "mongo_pool_open_connections", "Open Mongo connections")
+
+# Cache
+CACHE_REQUESTS = REGISTRY.counter(
+    "cache_requests_total", "Cache lookups by kind and result (local_hit, shared_hit, miss)", ("kind", "result"))
+
+# Background jobs
+JOB_QUEUE_DEPTH = REGISTRY.gauge(
+    "job_queue_depth", "Jobs pending or running, by queue", ("queue", "status"))
+JOB_WAIT = REGISTRY.histogram(
+    "job_wait_seconds", "Time between when a job was due and when a worker claimed it", ("queue",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0))
+JOB_DURATION = REGISTRY.histogram(
+    "job_duration_seconds", "Job handler run time", ("queue", "name"),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0))
+JOBS = REGISTRY.counter(
+    "jobs_total", "Job runs by queue, name and result (done, retry, failed)", ("queue", "name", "result"))
+
+# Email outbox
+EMAILS = REGISTRY.counter(
+    "emails_total", "Outbox emails by kind and result (sent, retry, failed, collapsed)", ("kind", "result"))
+
+# Change events (server-sent events)
+SSE_CONNECTIONS = REGISTRY.gauge(
+    "sse_connections", "Open change event streams")
+CHANGE_EVENTS = REGISTRY.counter(
+    "change_events_total", "Change events published, by type", ("type",))
+
+# Event loop
+LOOP_LAG = REGISTRY.histogram(
+    "event_loop_lag_seconds", "Delay between when a loop callback was due and when it ran",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+LOOP_LAG_LAST = REGISTRY.gauge(
+    "event_loop_lag_last_seconds", "Most recent event loop lag measurement")
+
+
+# ----------------------------------------------------------------------------
+# HTTP middleware
+# ----------------------------------------------------------------------------
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware) so streamed bodies are not buffered"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        started = time.perf_counter()
+        status = 500
+        received = 0
+        sent = 0
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(method)
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            HTTP_IN_FLIGHT.dec(method)
+            # The router stores the matched route in the (shared) scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(method, route, status)
+            HTTP_LATENCY.observe(method, route, value=time.perf_counter() - started)
+            if received:
+                HTTP_REQUEST_BYTES.inc(route, amount=received)
+            if sent:
+                HTTP_RESPONSE_BYTES.inc(route, amount=sent)
+
+
+# ----------------------------------------------------------------------------
+# Mongo pool
+# ----------------------------------------------------------------------------
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Pool events are emitted from driver threads: only cheap, locked updates here"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        MONGO_CONNECTIONS.inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_CONNECTIONS.dec()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def _waited(self, event) -> Optional[float]:
+        # pymongo >= 4.7 reports the duration itself
+        duration = getattr(event, "duration", None)
+        if duration is not None:
+            return duration
+        started = getattr(self._local, "started", None)
+        return time.perf_counter() - started if started is not None else None
+
+    def connection_check_out_failed(self, event):
+        MONGO_CHECKOUTS.inc("failed")
+        waited = self._waited(event)
+        if waited is not None:
+            MONGO_CHECKOUT_WAIT.observe(value=waited)
+
+    def connection_checked_out(self, event):
+        MONGO_CHECKOUTS.inc("ok")
+        MONGO_CHECKED_OUT.inc()
+        waited = self._waited(event)
+        if waited is not None:
+            MONGO_CHECKOUT_WAIT.observe(value=waited)
+
+    def connection_checked_in(self, event):
+        MONGO_CHECKED_OUT.dec()
+
+
+# ----------------------------------------------------------------------------
+# Event loop lag
+# ----------------------------------------------------------------------------
+
+async def monitor_event_loop(interval: float = 0.5):
+    """Sleep ``interval`` in a loop and record how late each wake-up is"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        LOOP_LAG.observe(value=lag)
+        LOOP_LAG_LAST.set(value=lag)
+
+
+def render() -> bytes:
+    return REGISTRY.render()
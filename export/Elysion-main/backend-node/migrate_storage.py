@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Move stored documents to the sharded layout and/or another storage backend.
+
+The migration runs against a live server:
+  1. the file is copied to its new location (the old one is untouched),
+  2. the document row is switched with a conditional update, so a row that
+     was deleted or moved concurrently is left alone and the copy dropped,
+  3. old files are removed only after a grace period, so downloads that
+     resolved the old location just before the switch still complete.
+
+Usage:
+    python migrate_storage.py --to local            # flat UPLOAD_DIR -> sharded
+    python migrate_storage.py --to s3 --concurrency 8
+    python migrate_storage.py --to s3 --dry-run
+"""
+
+import argparse
+import asyncio
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from storage import get_storage, document_location, sharded_key, close_storages
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+async def migrate_document(db, document, target, dry_run, stats):
+    source, source_key = document_location(document)
+    target_key = sharded_key(Path(source_key).name)
+
+    if source.name == target.name and source_key == target_key:
+        stats["skipped"] += 1
+        return None
+
+    if dry_run:
+        print(f"   {document['id']}: {source.name}:{source_key} -> {target.name}:{target_key}")
+        stats["migrated"] += 1
+        return None
+
+    if not await source.exists(source_key):
+        print(f"⚠️  Fichier manquant pour le document {document['id']} ({source.name}:{source_key})")
+        stats["missing"] += 1
+        return None
+
+    await target.save(target_key, source.open(source_key))
+
+    # Only switch the row if it still points at the location we copied from
+    row_filter = {"id": document["id"]}
+    if document.get("storage_key"):
+        row_filter["storage_key"] = document["storage_key"]
+    else:
+        row_filter["storage_key"] = {"$exists": False}
+    result = await db.documents.update_one(
+        row_filter,
+        {"$set": {"storage_backend": target.name, "storage_key": target_key}}
+    )
+    if result.modified_count == 0:
+        await target.delete(target_key)
+        stats["conflicts"] += 1
+        return None
+
+    stats["migrated"] += 1
+    return source, source_key
+
+
+async def migrate(args):
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[os.environ['DB_NAME']]
+    target = get_storage(args.to)
+
+    stats = {"migrated": 0, "skipped": 0, "missing": 0, "conflicts": 0, "errors": 0}
+    stale = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run(document):
+        async with semaphore:
+            try:
+                moved = await migrate_document(db, document, target, args.dry_run, stats)
+            except Exception as e:
+                print(f"❌ Erreur pour le document {document['id']} : {e}")
+                stats["errors"] += 1
+                return
+            if moved:
+                stale.append(moved)
+
+    print(f"🚚 Migration des documents vers le stockage '{target.name}'...")
+    try:
+        cursor = db.documents.find(
+            {},
+            {"_id": 0, "id": 1, "storage_backend": 1, "storage_key": 1, "file_path": 1}
+        ).batch_size(args.batch_size)
+        pending = set()
+        async for document in cursor:
+            task = asyncio.ensure_future(run(document))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            if len(pending) >= args.concurrency * 2:
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if pending:
+            await asyncio.wait(pending)
+
+        if stale and not args.keep_source:
+            print(f"⏳ Attente de {args.grace_seconds}s avant suppression des anciens fichiers...")
+            await asyncio.sleep(args.grace_seconds)
+            for source, key in stale:
+                try:
+                    await source.delete(key)
+                except Exception as e:
+                    print(f"⚠️  Impossible de supprimer {source.name}:{key} : {e}")
+
+        print("\n📊 Résultat :")
+        for name, count in stats.items():
+            print(f"   - {name} : {count}")
+    finally:
+        client.close()
+        await close_storages()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate stored documents between storage layouts/backends")
+    parser.add_argument("--to", default=os.environ.get("STORAGE_BACKEND", "local"), choices=["local", "s3"])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--grace-seconds", type=float, default=60.0)
+    parser.add_argument("--keep-source", action="store_true", help="do not delete the original files")
+    parser.add_argument("--dry-run", action="store_true")
+    asyncio.run(migrate(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Copy the Mongo collections behind the repositories to PostgreSQL, before
+switching the API to DATABASE_BACKEND=postgres.
+
+Each collection is streamed with one cursor in ``_id`` order and written
+``--batch-size`` rows at a time with a single ``INSERT ... SELECT FROM
+unnest(...)``, the statement bulk imports use, so memory stays flat and a
+batch is one round trip. Users are copied first (the other tables reference
+them), then the other collections concurrently.
+
+Rows already in Postgres are skipped (``ON CONFLICT DO NOTHING``): an
+interrupted copy is resumed by running it again. Rows of users that no
+longer exist, and rows whose ids are not UUIDs, are skipped too. A batch
+that Postgres rejects is retried row by row so one bad row (a missing
+required field...) is reported instead of failing the batch.
+
+The Mongo-only collections (jobs, outbox, text index, analytics, exports)
+are not copied: those features need DATABASE_BACKEND=mongo.
+
+Stop the API (or keep it read-only) during the copy, so no write is lost
+between the copy and the switch.
+
+Usage:
+    python migrate_to_postgres.py
+    python migrate_to_postgres.py --only documents --batch-size 2000
+    python migrate_to_postgres.py --dry-run
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional
+
+import asyncpg
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from postgres_repositories import (
+    DOCUMENTS, PROFILES, RESETS, RETIREMENT_PROFILES, USAGE, USERS,
+    PostgresDatabase, Table, postgres_pool_options,
+)
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# Collection -> (table, field pointing at the user)
+COLLECTIONS = {
+    "users": (USERS, None),
+    "user_profiles": (PROFILES, "user_id"),
+    "retirement_profiles": (RETIREMENT_PROFILES, "user_id"),
+    "documents": (DOCUMENTS, "user_id"),
+    "password_resets": (RESETS, None),
+    "user_usage": (USAGE, "user_id"),
+}
+
+
+def valid(row: dict, table: Table) -> bool:
+    """UUID columns must hold UUIDs (or be absent)"""
+    try:
+        for name, kind in table.columns.items():
+            if kind == "uuid" and row.get(name) is not None:
+                uuid.UUID(row[name])
+    except (TypeError, ValueError, AttributeError):
+        return False
+    return True
+
+
+def insert_statement(table: Table, owner: Optional[str], rows: List[dict]):
+    suffix = " ON CONFLICT DO NOTHING RETURNING 1"
+    if owner:
+        # Rows of deleted users are left behind
+        suffix = f" WHERE EXISTS (SELECT 1 FROM users WHERE users.id = u.{owner}::uuid){suffix}"
+    return table.insert_many(rows, suffix)
+
+
+async def write_batch(sql: PostgresDatabase, name: str, rows: List[dict], stats: Counter):
+    table, owner = COLLECTIONS[name]
+    inserted, errors = 0, 0
+    try:
+        inserted = len(await sql.fetch(*insert_statement(table, owner, rows)))
+    except asyncpg.PostgresError as e:
+        print(f"⚠️  {name} : lot refusé ({e}), nouvel essai ligne par ligne")
+        for row in rows:
+            try:
+                inserted += len(await sql.fetch(*insert_statement(table, owner, [row])))
+            except asyncpg.PostgresError as e:
+                print(f"❌ {name} : ligne {row.get('id') or row.get(owner or 'email')} refusée : {e}")
+                errors += 1
+    stats[f"{name}.copied"] += inserted
+    stats[f"{name}.skipped"] += len(rows) - inserted - errors
+    stats[f"{name}.errors"] += errors
+
+
+async def copy_collection(db, sql: Optional[PostgresDatabase], name: str, batch_size: int, stats: Counter):
+    table, _ = COLLECTIONS[name]
+    started = time.monotonic()
+    batch: List[dict] = []
+    pending: Optional[asyncio.Future] = None
+    cursor = db[name].find({}).sort("_id", 1).batch_size(batch_size)
+    async for row in cursor:
+        row.pop("_id", None)
+        stats[f"{name}.read"] += 1
+        if not valid(row, table):
+            stats[f"{name}.invalid"] += 1
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size and sql is not None:
+            # The next batch is read while this one is written
+            if pending is not None:
+                await pending
+            pending = asyncio.ensure_future(write_batch(sql, name, batch, stats))
+            batch = []
+    if pending is not None:
+        await pending
+    if batch and sql is not None:
+        await write_batch(sql, name, batch, stats)
+
+    elapsed = time.monotonic() - started
+    rate = stats[f"{name}.read"] / elapsed if elapsed else 0.0
+    print(f"   - {name} : {stats[f'{name}.read']} lus, {stats[f'{name}.copied']} copiés, "
+          f"{stats[f'{name}.skipped']} déjà présents ou orphelins, {stats[f'{name}.invalid']} invalides "
+          f"({elapsed:.1f} s, {rate:.0f} lignes/s)")
+
+
+async def migrate(args):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    sql = None
+    if not args.dry_run:
+        sql = PostgresDatabase(os.environ['POSTGRES_URL'], os.environ.get('POSTGRES_SCHEMA'), **postgres_pool_options())
+    names = args.only or list(COLLECTIONS)
+    stats: Counter = Counter()
+
+    print(f"🐘 Copie vers PostgreSQL : {', '.join(names)}{' (simulation)' if args.dry_run else ''}")
+    try:
+        if sql is not None:
+            await sql.ensure_schema()
+        if "users" in names:
+            await copy_collection(db, sql, "users", args.batch_size, stats)
+        await asyncio.gather(*(
+            copy_collection(db, sql, name, args.batch_size, stats) for name in names if name != "users"
+        ))
+    finally:
+        client.close()
+        if sql is not None:
+            await sql.close()
+
+    errors = sum(count for key, count in stats.items() if key.endswith(".errors"))
+    if errors:
+        print(f"\n⚠️  Copie terminée avec {errors} ligne(s) refusée(s), voir ci-dessus")
+    else:
+        print("\n✅ Copie terminée")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the Mongo collections to PostgreSQL")
+    parser.add_argument("--only", nargs="+", choices=list(COLLECTIONS), help="collections to copy (default: all)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="read and validate only")
+    asyncio.run(migrate(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
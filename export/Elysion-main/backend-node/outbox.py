@@ -0,0 +1,395 @@
+"""
+Outbound email through an outbox.
+
+Code that decides to send an email only inserts a row in the
+``email_outbox`` collection (``queue_email``), in the same job step as the
+state it talks about (the ``password_resets`` record...), so requests never
+wait on SMTP. An ``OutboxSender`` drains the collection:
+
+* rows are claimed in batches (``OUTBOX_BATCH_SIZE``) under a lease, so
+  several senders (API workers, job_worker.py) never send the same row;
+* a batch is spread over a small pool of persistent SMTP connections
+  (``SMTP_POOL_SIZE``), reused across batches and reopened when the server
+  drops them;
+* temporary failures (4xx, network) are retried with backoff up to
+  ``OUTBOX_MAX_ATTEMPTS``, and so are connection, login and sender errors
+  (a wrong ``SMTP_PASSWORD`` must not drop the queue); permanent ones (a
+  refused recipient, a 5xx reply to the message) are not;
+* ``collapse_key`` + ``window`` drop a message when one with the same key
+  was queued within the window (repeated reset requests for an address).
+
+SMTP settings: ``SMTP_HOST``, ``SMTP_PORT``, ``SMTP_SECURITY``
+(``starttls``, ``ssl`` or ``none``), ``SMTP_USERNAME``, ``SMTP_PASSWORD``
+and ``EMAIL_FROM``. Without ``SMTP_HOST`` messages are dropped and only
+their recipient and Message-ID are logged (bodies hold reset links), with a
+warning at startup; outside development (``APP_ENV`` other than
+``development``) a missing ``SMTP_HOST`` is a startup error instead. Any
+local SMTP stand-in works for tests, e.g. ``python -m aiosmtpd -n -l
+localhost:1025`` with ``SMTP_HOST=localhost SMTP_PORT=1025
+SMTP_SECURITY=none``.
+"""
+
+import asyncio
+import logging
+import os
+import smtplib
+import socket
+import ssl
+import uuid
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import make_msgid
+from typing import List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "50"))
+MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_SECONDS", "2"))
+LEASE = float(os.environ.get("OUTBOX_LEASE_SECONDS", "120"))
+RETRY_BASE = float(os.environ.get("OUTBOX_RETRY_BASE_SECONDS", "30"))
+RETENTION = int(os.environ.get("OUTBOX_RETENTION_SECONDS", str(30 * 24 * 3600)))
+
+_wakeup: Optional[asyncio.Event] = None
+
+
+def _get_wakeup() -> asyncio.Event:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    return _wakeup
+
+
+async def ensure_indexes(db):
+    await db.email_outbox.create_index([("status", 1), ("send_after", 1)])
+    await db.email_outbox.create_index([("collapse_key", 1), ("created_at", -1)], sparse=True)
+    await db.email_outbox.create_index("finished_at", expireAfterSeconds=RETENTION)
+
+
+async def recently_queued(db, collapse_key: str, window: float) -> bool:
+    since = datetime.utcnow() - timedelta(seconds=window)
+    return await db.email_outbox.find_one(
+        {"collapse_key": collapse_key, "created_at": {"$gte": since}}, {"_id": 1}
+    ) is not None
+
+
+async def queue_email(db, to: str, subject: str, body: str, kind: str,
+                      collapse_key: Optional[str] = None, window: float = 0) -> Optional[str]:
+    """Queue a plain-text email; returns its id, or None when collapsed"""
+    if collapse_key and window and await recently_queued(db, collapse_key, window):
+        metrics.EMAILS.inc(kind, "collapsed")
+        return None
+    now = datetime.utcnow()
+    row = {
+        "_id": uuid.uuid4().hex,
+        "kind": kind,
+        "to": to,
+        "subject": subject,
+        "body": body,
+        "status": PENDING,
+        "attempts": 0,
+        "created_at": now,
+        "send_after": now,
+    }
+    if collapse_key:
+        row["collapse_key"] = collapse_key
+    await db.email_outbox.insert_one(row)
+    _get_wakeup().set()
+    return row["_id"]
+
+
+def build_message(row: dict, sender: str) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = row["to"]
+    message["Subject"] = row["subject"]
+    # Stable across retries, so receivers can drop duplicates
+    message["Message-ID"] = make_msgid(idstring=row["_id"], domain=sender.rpartition("@")[2] or None)
+    message.set_content(row["body"])
+    return message
+
+
+class SMTPUnavailable(Exception):
+    """Connecting, TLS or login failed: not the message's fault, whatever the reply code"""
+
+
+def is_permanent(error: Exception) -> bool:
+    """Only errors about the message itself. Connection, login and sender
+    errors would hit every message alike: they are retried until fixed."""
+    if isinstance(error, (SMTPUnavailable, smtplib.SMTPSenderRefused)):
+        return False
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+# ----------------------------------------------------------------------------
+# Transports
+# ----------------------------------------------------------------------------
+
+class LogTransport:
+    """Used without SMTP_HOST in development: messages are dropped, never sent"""
+
+    async def send(self, messages: List[EmailMessage]) -> List[Optional[Exception]]:
+        for message in messages:
+            # Never the body: it holds live reset and invitation links
+            logger.info(f"Email {message['Message-ID']} to {message['To']} not sent (SMTP_HOST is not set)")
+        return [None] * len(messages)
+
+    async def close(self):
+        pass
+
+
+class SMTPPool:
+    """Persistent SMTP connections, each used by one thread at a time"""
+
+    def __init__(self, host: str, port: int, security: str = "starttls", username: Optional[str] = None,
+                 password: Optional[str] = None, size: int = 2, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.security = security
+        self.username = username
+        self.password = password
+        self.size = size
+        self.timeout = timeout
+        self._idle: Optional[asyncio.Queue] = None
+
+    def _get_idle(self) -> asyncio.Queue:
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.size):
+                # None: not connected yet
+                self._idle.put_nowait(None)
+        return self._idle
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.security == "ssl":
+            connection = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout,
+                                          context=ssl.create_default_context())
+        else:
+            connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.security == "starttls":
+                connection.starttls(context=ssl.create_default_context())
+            if self.username:
+                connection.login(self.username, self.password or "")
+        except BaseException:
+            self._discard(connection)
+            raise
+        return connection
+
+    def _send_all(self, connection: Optional[smtplib.SMTP], messages: List[EmailMessage]):
+        """Runs in a thread: send over one connection, reconnecting when dropped"""
+        results: List[Optional[Exception]] = []
+        for message in messages:
+            for attempt in range(2):
+                if connection is None:
+                    try:
+                        connection = self._connect()
+                    except (smtplib.SMTPException, OSError) as e:
+                        # The rest of this slice would fail the same way
+                        error = SMTPUnavailable(f"{type(e).__name__}: {e}")
+                        results.extend([error] * (len(messages) - len(results)))
+                        return None, results
+                try:
+                    connection.send_message(message)
+                    results.append(None)
+                    break
+                except (smtplib.SMTPServerDisconnected, OSError) as e:
+                    # Idle connections get closed by servers: retry once on a fresh one
+                    self._discard(connection)
+                    connection = None
+                    if attempt:
+                        results.append(e)
+                except smtplib.SMTPRecipientsRefused as e:
+                    results.append(e)
+                    break
+                except smtplib.SMTPException as e:
+                    results.append(e)
+                    # The session state is unknown after an error: start again
+                    try:
+                        connection.rset()
+                    except Exception:
+                        self._discard(connection)
+                        connection = None
+                    break
+        return connection, results
+
+    @staticmethod
+    def _discard(connection: Optional[smtplib.SMTP]):
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    async def _send_slice(self, messages: List[EmailMessage]) -> List[Optional[Exception]]:
+        idle = self._get_idle()
+        connection = await idle.get()
+        try:
+            connection, results = await asyncio.to_thread(self._send_all, connection, messages)
+        except BaseException:
+            connection = None
+            raise
+        finally:
+            idle.put_nowait(connection)
+        return results
+
+    async def send(self, messages: List[EmailMessage]) -> List[Optional[Exception]]:
+        """One result per message: None when sent, else the error"""
+        if not messages:
+            return []
+        step = -(-len(messages) // self.size)
+        slices = [messages[i:i + step] for i in range(0, len(messages), step)]
+        results = await asyncio.gather(*(self._send_slice(s) for s in slices))
+        return [result for part in results for result in part]
+
+    async def close(self):
+        if self._idle is None:
+            return
+        while not self._idle.empty():
+            connection = self._idle.get_nowait()
+            if connection is not None:
+                try:
+                    await asyncio.to_thread(connection.quit)
+                except Exception:
+                    self._discard(connection)
+
+
+def create_transport():
+    host = os.environ.get("SMTP_HOST")
+    if not host:
+        if os.environ.get("APP_ENV", "development") != "development":
+            raise ValueError("SMTP_HOST is required outside development (APP_ENV)")
+        logger.warning("SMTP_HOST is not set: emails (password resets, invitations...) are NOT sent")
+        return LogTransport()
+    security = os.environ.get("SMTP_SECURITY", "starttls")
+    if security not in ("starttls", "ssl", "none"):
+        raise ValueError(f"Unknown SMTP_SECURITY: {security}")
+    default_port = {"ssl": "465", "starttls": "587", "none": "25"}[security]
+    return SMTPPool(
+        host,
+        int(os.environ.get("SMTP_PORT", default_port)),
+        security=security,
+        username=os.environ.get("SMTP_USERNAME"),
+        password=os.environ.get("SMTP_PASSWORD"),
+        size=int(os.environ.get("SMTP_POOL_SIZE", "2")),
+        timeout=float(os.environ.get("SMTP_TIMEOUT_SECONDS", "30")),
+    )
+
+
+# ----------------------------------------------------------------------------
+# Sender
+# ----------------------------------------------------------------------------
+
+def default_sender() -> str:
+    return os.environ.get("EMAIL_FROM", "Elysion <no-reply@elysion.fr>")
+
+
+async def send_now(to: str, subject: str, body: str, kind: str) -> bool:
+    """Send one email right away, for backends without the outbox: no retry
+    and nothing persisted, so the caller should run it in the background"""
+    transport = create_transport()
+    row = {"_id": uuid.uuid4().hex, "to": to, "subject": subject, "body": body}
+    try:
+        [error] = await transport.send([build_message(row, default_sender())])
+    finally:
+        await transport.close()
+    if error is not None:
+        logger.error(f"Email {row['_id']} ({kind}) failed: {type(error).__name__}: {error}")
+        metrics.EMAILS.inc(kind, FAILED)
+        return False
+    metrics.EMAILS.inc(kind, SENT)
+    return True
+
+
+class OutboxSender:
+    def __init__(self, db, transport=None, sender: Optional[str] = None):
+        self.db = db
+        self.transport = transport or create_transport()
+        self.sender = sender or default_sender()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def run(self):
+        """Drain the outbox until cancelled"""
+        wakeup = _get_wakeup()
+        try:
+            while True:
+                try:
+                    sent = await self.drain_once()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Outbox drain failed: {e}")
+                    sent = 0
+                if sent < BATCH_SIZE:
+                    wakeup.clear()
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            await self.transport.close()
+
+    async def _claim(self) -> List[dict]:
+        now = datetime.utcnow()
+        due = {"$or": [
+            {"status": PENDING, "send_after": {"$lte": now}},
+            # Lease of a dead sender
+            {"status": SENDING, "lease_expires_at": {"$lt": now}},
+        ]}
+        ids = [row["_id"] async for row in self.db.email_outbox.find(due, {"_id": 1})
+               .sort("send_after", 1).limit(BATCH_SIZE)]
+        if not ids:
+            return []
+        # Re-checking ``due`` makes the claim safe against a concurrent sender
+        await self.db.email_outbox.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {"status": SENDING, "lease_owner": self.owner,
+                      "lease_expires_at": now + timedelta(seconds=LEASE)},
+             "$inc": {"attempts": 1}}
+        )
+        return await self.db.email_outbox.find(
+            {"_id": {"$in": ids}, "status": SENDING, "lease_owner": self.owner}
+        ).to_list(length=None)
+
+    async def drain_once(self) -> int:
+        """Send one batch; returns the number of rows processed"""
+        rows = await self._claim()
+        if not rows:
+            return 0
+        results = await self.transport.send([build_message(row, self.sender) for row in rows])
+
+        now = datetime.utcnow()
+        sent = [row["_id"] for row, error in zip(rows, results) if error is None]
+        if sent:
+            await self.db.email_outbox.update_many(
+                {"_id": {"$in": sent}, "lease_owner": self.owner},
+                {"$set": {"status": SENT, "finished_at": now},
+                 "$unset": {"lease_owner": "", "lease_expires_at": "", "body": ""}}
+            )
+        for row, error in zip(rows, results):
+            if error is None:
+                metrics.EMAILS.inc(row["kind"], SENT)
+                continue
+            message = f"{type(error).__name__}: {error}"
+            if is_permanent(error) or row["attempts"] >= MAX_ATTEMPTS:
+                logger.error(f"Email {row['_id']} ({row['kind']}) failed for good: {message}")
+                metrics.EMAILS.inc(row["kind"], FAILED)
+                values = {"status": FAILED, "finished_at": now, "last_error": message}
+            else:
+                metrics.EMAILS.inc(row["kind"], "retry")
+                delay = RETRY_BASE * 2 ** (row["attempts"] - 1)
+                values = {"status": PENDING, "send_after": now + timedelta(seconds=delay), "last_error": message}
+            await self.db.email_outbox.update_one(
+                {"_id": row["_id"], "lease_owner": self.owner},
+                {"$set": values, "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+            )
+        return len(rows)
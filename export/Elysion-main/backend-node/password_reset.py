@@ -0,0 +1,124 @@
+"""
+Password reset emails.
+
+``POST /auth/forgot-password`` only signs a token and queues an
+``auth.password_reset`` job, whether or not the address has an account, so
+its response time says nothing about which emails are registered. The job
+looks the account up, stores the token in ``password_resets`` and queues the
+email in the outbox (see outbox.py). Requests for an address that already
+got an email within ``RESET_EMAIL_WINDOW_SECONDS`` are collapsed into it.
+
+Users created by a bulk import without a password get an invitation
+instead: the same kind of token, valid ``INVITE_VALID_HOURS``, sent by one
+``auth.invite`` job per import batch.
+
+Backends without the job queue and outbox (``DATABASE_BACKEND=postgres`` or
+``memory``) store the token and send the email straight away, in the
+background (``outbox.send_now``): no retry and no collapsing of repeated
+requests.
+"""
+
+import logging
+import os
+from typing import List
+
+import jobs
+import outbox
+import workers
+from repositories import MongoResetRepository, MongoUserRepository
+
+logger = logging.getLogger(__name__)
+
+RESET_URL = os.environ.get("PASSWORD_RESET_URL", "https://retire-planner-13.preview.emergentagent.com/reset-password")
+RESET_EMAIL_WINDOW = float(os.environ.get("RESET_EMAIL_WINDOW_SECONDS", "300"))
+INVITE_VALID_HOURS = int(os.environ.get("INVITE_VALID_HOURS", "72"))
+
+SUBJECT = "Réinitialisation de votre mot de passe Elysion"
+BODY = """Bonjour,
+
+Vous avez demandé la réinitialisation du mot de passe de votre compte Elysion.
+Pour choisir un nouveau mot de passe, ouvrez le lien suivant (valable 1 heure) :
+
+{link}
+
+Si vous n'êtes pas à l'origine de cette demande, ignorez simplement cet email.
+
+L'équipe Elysion
+"""
+
+INVITE_SUBJECT = "Votre compte Elysion"
+INVITE_BODY = """Bonjour {name},
+
+Un compte Elysion a été créé pour vous. Pour l'activer, choisissez votre
+mot de passe en ouvrant le lien suivant (valable {hours} heures) :
+
+{link}
+
+L'équipe Elysion
+"""
+
+
+def reset_link(token: str) -> str:
+    return f"{RESET_URL}?token={token}"
+
+
+async def request_reset(db, email: str, token: str):
+    """Queue the reset for ``email``: constant work, whether the account exists or not"""
+    await jobs.enqueue(db, "auth.password_reset", {"email": email, "token": token},
+                       dedupe_key=f"password_reset:{email}")
+
+
+@jobs.job("auth.password_reset")
+async def _send_reset(db, payload: dict):
+    email = payload["email"]
+    if await MongoUserRepository(db).get_by_email(email, ["id"]) is None:
+        return
+    # Also makes a retry after the email was queued a no-op
+    collapse_key = f"password_reset:{email}"
+    if await outbox.recently_queued(db, collapse_key, RESET_EMAIL_WINDOW):
+        return
+    await MongoResetRepository(db).create(email, payload["token"])
+    await outbox.queue_email(db, email, SUBJECT, BODY.format(link=reset_link(payload["token"])),
+                             kind="password_reset", collapse_key=collapse_key)
+
+
+async def send_without_outbox(repos, email: str, token: str):
+    """Backends without the job queue and outbox: store the token and send the email directly"""
+    if await repos.users.get_by_email(email, ["id"]) is None:
+        return
+    await repos.resets.create(email, token)
+    await outbox.send_now(email, SUBJECT, BODY.format(link=reset_link(token)), kind="password_reset")
+
+
+async def queue_invites(repos, invites: List[dict]):
+    """Send invitations (``{"email", "full_name", "token"}``) to freshly imported users"""
+    if not invites:
+        return
+    if repos.db is None:
+        for invite in invites:
+            await repos.resets.create(invite["email"], invite["token"])
+        workers.spawn(_send_invites_now(invites))
+        return
+    await jobs.enqueue(repos.db, "auth.invite", {"invites": invites})
+
+
+async def _send_invites_now(invites: List[dict]):
+    for invite in invites:
+        await outbox.send_now(
+            invite["email"], INVITE_SUBJECT,
+            INVITE_BODY.format(name=invite["full_name"], hours=INVITE_VALID_HOURS, link=reset_link(invite["token"])),
+            kind="invite",
+        )
+
+
+@jobs.job("auth.invite")
+async def _send_invites(db, payload: dict):
+    resets = MongoResetRepository(db)
+    for invite in payload["invites"]:
+        await resets.create(invite["email"], invite["token"])
+        # The collapse key makes a retried batch skip the emails already queued
+        await outbox.queue_email(
+            db, invite["email"], INVITE_SUBJECT,
+            INVITE_BODY.format(name=invite["full_name"], hours=INVITE_VALID_HOURS, link=reset_link(invite["token"])),
+            kind="invite", collapse_key=f"invite:{invite['email']}", window=INVITE_VALID_HOURS * 3600,
+        )
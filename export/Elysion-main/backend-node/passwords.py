@@ -0,0 +1,23 @@
+"""
+Password hashing, shared by the API and the process pool (bulk imports hash
+a whole batch in one ``workers.run_cpu_bound`` call).
+"""
+
+import hashlib
+from typing import List, Optional
+
+
+def get_password_hash(password: str) -> str:
+    # Simple SHA-256 hash for MVP (in production, use bcrypt or argon2)
+    return hashlib.sha256((password + "elysion_salt").encode()).hexdigest()
+
+
+def verify_password(plain_password: str, hashed_password: Optional[str]) -> bool:
+    # Invited users have no password until they choose one
+    if not hashed_password:
+        return False
+    return get_password_hash(plain_password) == hashed_password
+
+
+def hash_passwords(passwords: List[str]) -> List[str]:
+    return [get_password_hash(password) for password in passwords]
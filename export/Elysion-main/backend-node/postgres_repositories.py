@@ -0,0 +1,547 @@
+"""
+PostgreSQL implementation of the repositories (``DATABASE_BACKEND=postgres``),
+on asyncpg, over the tables of postgres_schema.sql (DATABASE_SCHEMA.sql
+adapted to what the API stores). The schema is applied at startup.
+
+* one connection pool per process, created on first use
+  (``POSTGRES_MIN_POOL_SIZE``, ``POSTGRES_MAX_POOL_SIZE``...). asyncpg
+  prepares each query once per connection and keeps it in its statement
+  cache (``POSTGRES_STATEMENT_CACHE_SIZE``), so the hot queries are parsed
+  and planned once;
+* the dashboard and stats endpoints are one ``GROUP BY`` query each, the
+  quota check is a conditional ``UPDATE`` and bulk inserts are a single
+  ``INSERT ... SELECT FROM unnest(...)``;
+* keys with a column of their own are stored there, the rest of a row
+  (questionnaire answers, encryption, text extraction state...) in the
+  ``data`` JSONB column, so rows keep the shape of the Mongo documents.
+  Datetimes inside ``data`` are stored as ``{"$date": ...}``.
+
+Unique violations raise pymongo's DuplicateKeyError, like the other
+implementations. Ids that are not UUIDs match nothing.
+
+migrate_to_postgres.py copies an existing Mongo database.
+"""
+
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime
+from enum import Enum
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import asyncpg
+from pymongo.errors import DuplicateKeyError
+
+from repositories import (
+    DocumentRepository, Fields, ProfileRepository, Repositories, ResetRepository,
+    RetirementProfileRepository, UsageRepository, UserRepository,
+)
+
+SCHEMA_FILE = Path(__file__).parent / "postgres_schema.sql"
+# pg_advisory_xact_lock key: instances starting together apply the schema one at a time
+SCHEMA_LOCK = 0x456C7973
+# Rows fetched per round trip by DocumentRepository.iterate
+ITERATE_PREFETCH = 200
+
+# POSTGRES_* environment variable -> (asyncpg.create_pool option, parser)
+_POSTGRES_OPTIONS = {
+    "POSTGRES_MIN_POOL_SIZE": ("min_size", int),
+    "POSTGRES_MAX_POOL_SIZE": ("max_size", int),
+    "POSTGRES_STATEMENT_CACHE_SIZE": ("statement_cache_size", int),
+    "POSTGRES_COMMAND_TIMEOUT": ("command_timeout", float),
+    "POSTGRES_MAX_INACTIVE_CONNECTION_LIFETIME": ("max_inactive_connection_lifetime", float),
+}
+
+# Column types sent as text and cast in SQL (arrays of these go through text[])
+_TEXT_TYPES = {"uuid", "jsonb", "user_type", "document_category"}
+
+
+def postgres_pool_options() -> Dict[str, object]:
+    """asyncpg pool options from the POSTGRES_* environment variables"""
+    options = {}
+    for variable, (option, parse) in _POSTGRES_OPTIONS.items():
+        value = os.environ.get(variable)
+        if value:
+            options[option] = parse(value)
+    return options
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return {"$date": obj.isoformat()}
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj)
+
+
+def _json_object(obj: dict):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def encode_json(value) -> str:
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_json(text: str):
+    return json.loads(text, object_hook=_json_object)
+
+
+async def _init_connection(connection):
+    await connection.set_type_codec("jsonb", encoder=encode_json, decoder=decode_json, schema="pg_catalog")
+    # Ids are strings everywhere else in the API
+    await connection.set_type_codec("uuid", encoder=str, decoder=str, schema="pg_catalog", format="text")
+
+
+def _is_uuid(value) -> bool:
+    try:
+        uuid.UUID(value)
+    except (TypeError, ValueError, AttributeError):
+        return False
+    return True
+
+
+def _count(status: str) -> int:
+    """Rows affected, from a command status such as ``UPDATE 1``"""
+    return int(status.rsplit(" ", 1)[-1])
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class PostgresDatabase:
+    """The connection pool, created on first use; ``schema`` (POSTGRES_SCHEMA)
+    is the search_path, for several databases in one Postgres database"""
+
+    def __init__(self, dsn: str, schema: Optional[str] = None, **pool_options):
+        self.dsn = dsn
+        self.schema = schema
+        self.pool_options = pool_options
+        self._pool: Optional[asyncpg.Pool] = None
+        self._lock = asyncio.Lock()
+
+    async def pool(self) -> asyncpg.Pool:
+        if self._pool is None:
+            async with self._lock:
+                if self._pool is None:
+                    settings = {"search_path": quote_identifier(self.schema)} if self.schema else None
+                    self._pool = await asyncpg.create_pool(
+                        self.dsn, init=_init_connection, server_settings=settings, **self.pool_options
+                    )
+        return self._pool
+
+    async def fetch(self, query: str, *args) -> List[asyncpg.Record]:
+        return await (await self.pool()).fetch(query, *args)
+
+    async def fetchrow(self, query: str, *args) -> Optional[asyncpg.Record]:
+        return await (await self.pool()).fetchrow(query, *args)
+
+    async def execute(self, query: str, *args) -> str:
+        return await (await self.pool()).execute(query, *args)
+
+    async def ping(self):
+        await (await self.pool()).fetchval("SELECT 1")
+
+    async def ensure_schema(self):
+        sql = SCHEMA_FILE.read_text(encoding="utf-8")
+        async with (await self.pool()).acquire() as connection:
+            async with connection.transaction():
+                await connection.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK)
+                if self.schema:
+                    await connection.execute(f"CREATE SCHEMA IF NOT EXISTS {quote_identifier(self.schema)}")
+                await connection.execute(sql)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+class Table:
+    """Maps rows shaped like the Mongo documents to a table: ``columns``
+    (name -> SQL type) are stored as such, other keys in ``data``"""
+
+    def __init__(self, name: str, columns: Dict[str, str]):
+        self.name = name
+        self.columns = columns
+        self._selects: Dict[Optional[tuple], str] = {}
+
+    def split(self, row: dict) -> Tuple[dict, dict]:
+        columns, data = {}, {}
+        for key, value in row.items():
+            if key in self.columns:
+                columns[key] = value.value if isinstance(value, Enum) else value
+            else:
+                data[key] = value
+        return columns, data
+
+    def select(self, fields: Fields = None) -> str:
+        key = None if fields is None else tuple(fields)
+        query = self._selects.get(key)
+        if query is None:
+            if key is None:
+                names = [*self.columns, "data"]
+            else:
+                names = [name for name in self.columns if name in key]
+                if not names or any(name not in self.columns for name in key):
+                    names.append("data")
+            query = self._selects[key] = f"SELECT {', '.join(names)} FROM {self.name}"
+        return query
+
+    def row(self, record: Optional[asyncpg.Record], fields: Fields = None) -> Optional[dict]:
+        if record is None:
+            return None
+        row = dict(record)
+        row.update(row.pop("data", None) or {})
+        if fields is not None:
+            return {name: row[name] for name in fields if name in row}
+        return row
+
+    # Statements are returned as ``(query, *args)``
+
+    def insert(self, row: dict, suffix: str = "") -> tuple:
+        columns, data = self.split(row)
+        names = [*columns, "data"]
+        placeholders = ", ".join(f"${i}" for i in range(1, len(names) + 1))
+        query = f"INSERT INTO {self.name} ({', '.join(names)}) VALUES ({placeholders}){suffix}"
+        return (query, *columns.values(), data)
+
+    def insert_many(self, rows: List[dict], suffix: str = "") -> tuple:
+        """One statement for the whole batch: a typed array per column, unnested"""
+        split = [self.split(row) for row in rows]
+        names = [name for name in self.columns if any(name in columns for columns, _ in split)]
+        arrays = [[self._array_value(name, columns.get(name)) for columns, _ in split] for name in names]
+        arrays.append([encode_json(data) for _, data in split])
+        types = [self._array_type(name) for name in names] + ["text"]
+        values = [f"u.{name}::{self.columns[name]}" for name in names] + ["u.data::jsonb"]
+        params = ", ".join(f"${i}::{kind}[]" for i, kind in enumerate(types, start=1))
+        query = (
+            f"INSERT INTO {self.name} ({', '.join([*names, 'data'])}) "
+            f"SELECT {', '.join(values)} FROM unnest({params}) AS u({', '.join([*names, 'data'])}){suffix}"
+        )
+        return (query, *arrays)
+
+    def upsert(self, key: str, row: dict, on_insert: Optional[dict] = None) -> tuple:
+        """Insert ``row``, or set its values on the row with the same ``key``;
+        ``on_insert`` values are only used for a new row"""
+        columns, data = self.split(row)
+        inserted = {**{k: v for k, v in (on_insert or {}).items() if k not in columns}, **columns}
+        names = [*inserted, "data"]
+        placeholders = ", ".join(f"${i}" for i in range(1, len(names) + 1))
+        updates = [f"{name} = EXCLUDED.{name}" for name in columns if name != key]
+        updates.append(f"data = {self.name}.data || EXCLUDED.data")
+        query = (
+            f"INSERT INTO {self.name} ({', '.join(names)}) VALUES ({placeholders}) "
+            f"ON CONFLICT ({key}) DO UPDATE SET {', '.join(updates)}"
+        )
+        return (query, *inserted.values(), data)
+
+    def update(self, key: str, value, values: dict) -> tuple:
+        columns, data = self.split(values)
+        args = [value, *columns.values()]
+        assignments = [f"{name} = ${i}" for i, name in enumerate(columns, start=2)]
+        if data or not assignments:
+            args.append(data)
+            assignments.append(f"data = data || ${len(args)}::jsonb")
+        return (f"UPDATE {self.name} SET {', '.join(assignments)} WHERE {key} = $1", *args)
+
+    def _array_type(self, name: str) -> str:
+        kind = self.columns[name]
+        return "text" if kind in _TEXT_TYPES else kind
+
+    def _array_value(self, name: str, value):
+        if value is not None and self.columns[name] == "jsonb":
+            return encode_json(value)
+        return value
+
+
+USERS = Table("users", {
+    "id": "uuid", "email": "text", "hashed_password": "text", "full_name": "text", "user_type": "user_type",
+    "is_active": "boolean", "profile_completed": "boolean", "profile_completed_at": "timestamp",
+    "last_login_at": "timestamp", "created_at": "timestamp", "updated_at": "timestamp",
+})
+PROFILES = Table("user_profiles", {
+    "user_id": "uuid", "completed_at": "timestamp", "last_updated": "timestamp",
+})
+RETIREMENT_PROFILES = Table("retirement_profiles", {
+    "user_id": "uuid", "simulation_data": "jsonb", "last_simulation_at": "timestamp",
+    "created_at": "timestamp", "updated_at": "timestamp",
+})
+DOCUMENTS = Table("documents", {
+    "id": "uuid", "user_id": "uuid", "filename": "text", "original_filename": "text",
+    "category": "document_category", "file_size": "bigint", "storage_backend": "text", "storage_key": "text",
+    "file_path": "text", "content_hash": "text", "uploaded_at": "timestamp", "updated_at": "timestamp",
+})
+RESETS = Table("password_resets", {
+    "email": "text", "token": "text", "created_at": "timestamp", "used": "boolean", "used_at": "timestamp",
+})
+USAGE = Table("user_usage", {"user_id": "uuid", "bytes": "bigint", "files": "integer"})
+
+
+# ============================================================================
+# Repositories
+# ============================================================================
+
+class PostgresUserRepository(UserRepository):
+    table = USERS
+
+    def __init__(self, db: PostgresDatabase):
+        self.db = db
+
+    async def get(self, user_id, fields=None):
+        if not _is_uuid(user_id):
+            return None
+        return self.table.row(await self.db.fetchrow(f"{self.table.select(fields)} WHERE id = $1", user_id), fields)
+
+    async def get_by_email(self, email, fields=None):
+        return self.table.row(await self.db.fetchrow(f"{self.table.select(fields)} WHERE email = $1", email), fields)
+
+    async def create(self, user):
+        try:
+            await self.db.execute(*self.table.insert(user))
+        except asyncpg.UniqueViolationError as e:
+            raise DuplicateKeyError(str(e))
+
+    async def create_many(self, users):
+        if not users:
+            return set()
+        # Taken emails (and repeats within the batch) are skipped, not errors
+        records = await self.db.fetch(*self.table.insert_many(users, " ON CONFLICT DO NOTHING RETURNING id"))
+        inserted = {record["id"] for record in records}
+        return {index for index, user in enumerate(users) if user["id"] not in inserted}
+
+    async def update(self, user_id, values):
+        if not _is_uuid(user_id):
+            return False
+        return _count(await self.db.execute(*self.table.update("id", user_id, values))) > 0
+
+    async def set_password(self, email, hashed_password):
+        status = await self.db.execute(
+            "UPDATE users SET hashed_password = $2 WHERE email = $1 AND hashed_password IS DISTINCT FROM $2",
+            email, hashed_password
+        )
+        return _count(status) > 0
+
+
+class PostgresProfileRepository(ProfileRepository):
+    table = PROFILES
+
+    def __init__(self, db: PostgresDatabase):
+        self.db = db
+
+    async def get(self, user_id, fields=None):
+        if not _is_uuid(user_id):
+            return None
+        return self.table.row(await self.db.fetchrow(f"{self.table.select(fields)} WHERE user_id = $1", user_id), fields)
+
+    async def upsert(self, user_id, values):
+        await self.db.execute(*self.table.upsert("user_id", {**values, "user_id": user_id}))
+
+    async def insert_many(self, profiles):
+        if profiles:
+            await self.db.execute(*self.table.insert_many(profiles))
+
+
+class PostgresRetirementProfileRepository(RetirementProfileRepository):
+    table = RETIREMENT_PROFILES
+
+    def __init__(self, db: PostgresDatabase):
+        self.db = db
+
+    async def get(self, user_id, fields=None):
+        if not _is_uuid(user_id):
+            return None
+        return self.table.row(await self.db.fetchrow(f"{self.table.select(fields)} WHERE user_id = $1", user_id), fields)
+
+    async def upsert(self, user_id, values):
+        await self.db.execute(*self.table.upsert(
+            "user_id", {**values, "user_id": user_id}, on_insert={"created_at": datetime.utcnow()}
+        ))
+
+
+class PostgresDocumentRepository(DocumentRepository):
+    table = DOCUMENTS
+
+    def __init__(self, db: PostgresDatabase):
+        self.db = db
+
+    def _list_query(self, user_id, category, fields) -> Tuple[str, list]:
+        if category:
+            return (f"{self.table.select(fields)} WHERE user_id = $1 AND category = $2 ORDER BY uploaded_at DESC",
+                    [user_id, getattr(category, "value", category)])
+        return f"{self.table.select(fields)} WHERE user_id = $1 ORDER BY uploaded_at DESC", [user_id]
+
+    async def get(self, document_id, user_id=None, fields=None):
+        if not _is_uuid(document_id) or (user_id is not None and not _is_uuid(user_id)):
+            return None
+        if user_id is None:
+            record = await self.db.fetchrow(f"{self.table.select(fields)} WHERE id = $1", document_id)
+        else:
+            record = await self.db.fetchrow(
+                f"{self.table.select(fields)} WHERE id = $1 AND user_id = $2", document_id, user_id
+            )
+        return self.table.row(record, fields)
+
+    async def list(self, user_id, category=None, fields=None):
+        if not _is_uuid(user_id):
+            return []
+        query, args = self._list_query(user_id, category, fields)
+        records = await self.db.fetch(query, *args)
+        return [self.table.row(record, fields) for record in records]
+
+    async def iterate(self, user_id, category=None, fields=None):
+        if not _is_uuid(user_id):
+            return
+        query, args = self._list_query(user_id, category, fields)
+        async with (await self.db.pool()).acquire() as connection:
+            # Server-side cursors only live inside a transaction
+            async with connection.transaction():
+                async for record in connection.cursor(query, *args, prefetch=ITERATE_PREFETCH):
+                    yield self.table.row(record, fields)
+
+    async def get_many(self, user_id, document_ids, fields=None):
+        document_ids = [document_id for document_id in document_ids if _is_uuid(document_id)]
+        if not _is_uuid(user_id) or not document_ids:
+            return []
+        records = await self.db.fetch(
+            f"{self.table.select(fields)} WHERE user_id = $1 AND id = ANY($2::uuid[])", user_id, document_ids
+        )
+        return [self.table.row(record, fields) for record in records]
+
+    async def insert(self, document):
+        try:
+            await self.db.execute(*self.table.insert(document))
+        except asyncpg.UniqueViolationError as e:
+            raise DuplicateKeyError(str(e))
+
+    async def insert_many(self, documents):
+        if not documents:
+            return
+        try:
+            await self.db.execute(*self.table.insert_many(documents))
+        except asyncpg.UniqueViolationError as e:
+            raise DuplicateKeyError(str(e))
+
+    async def update(self, document_id, values):
+        if not _is_uuid(document_id):
+            return False
+        return _count(await self.db.execute(*self.table.update("id", document_id, values))) > 0
+
+    async def delete(self, document_id):
+        if not _is_uuid(document_id):
+            return False
+        return _count(await self.db.execute("DELETE FROM documents WHERE id = $1", document_id)) > 0
+
+    async def delete_many(self, user_id, document_ids):
+        document_ids = [document_id for document_id in document_ids if _is_uuid(document_id)]
+        if not _is_uuid(user_id) or not document_ids:
+            return 0
+        status = await self.db.execute(
+            "DELETE FROM documents WHERE user_id = $1 AND id = ANY($2::uuid[])", user_id, document_ids
+        )
+        return _count(status)
+
+    async def version(self, user_id, category=None):
+        if not _is_uuid(user_id):
+            return "0"
+        query = "SELECT count(*) AS count, max(greatest(uploaded_at, updated_at)) AS latest FROM documents WHERE user_id = $1"
+        args = [user_id]
+        if category:
+            query += " AND category = $2"
+            args.append(getattr(category, "value", category))
+        record = await self.db.fetchrow(query, *args)
+        if not record["count"]:
+            return "0"
+        latest = record["latest"]
+        return f"{record['count']}:{latest.isoformat() if latest else ''}"
+
+    async def category_summary(self, user_id, since):
+        if not _is_uuid(user_id):
+            return []
+        records = await self.db.fetch(
+            "SELECT category::text AS category, count(*) AS count, "
+            "count(*) FILTER (WHERE uploaded_at >= $2) AS recent "
+            "FROM documents WHERE user_id = $1 GROUP BY category",
+            user_id, since
+        )
+        return [dict(record) for record in records]
+
+    async def usage_totals(self, user_id):
+        if not _is_uuid(user_id):
+            return {"bytes": 0, "files": 0}
+        record = await self.db.fetchrow(
+            "SELECT coalesce(sum(file_size), 0)::bigint AS bytes, count(*) AS files FROM documents WHERE user_id = $1",
+            user_id
+        )
+        return {"bytes": record["bytes"], "files": record["files"]}
+
+
+class PostgresResetRepository(ResetRepository):
+    table = RESETS
+
+    def __init__(self, db: PostgresDatabase):
+        self.db = db
+
+    async def create(self, email, token):
+        # A retried job must not fail on, or duplicate, the token
+        await self.db.execute(*self.table.insert(
+            {"email": email, "token": token, "created_at": datetime.utcnow(), "used": False},
+            " ON CONFLICT (token) DO NOTHING"
+        ))
+
+    async def find_unused(self, token):
+        return self.table.row(await self.db.fetchrow(f"{self.table.select()} WHERE token = $1 AND NOT used", token))
+
+    async def mark_used(self, token):
+        await self.db.execute("UPDATE password_resets SET used = TRUE, used_at = $2 WHERE token = $1",
+                              token, datetime.utcnow())
+
+
+class PostgresUsageRepository(UsageRepository):
+    table = USAGE
+
+    def __init__(self, db: PostgresDatabase):
+        self.db = db
+
+    async def get(self, user_id):
+        if not _is_uuid(user_id):
+            return None
+        return self.table.row(await self.db.fetchrow("SELECT bytes, files FROM user_usage WHERE user_id = $1", user_id))
+
+    async def initialize(self, user_id, usage):
+        await self.db.execute(*self.table.insert({**usage, "user_id": user_id}, " ON CONFLICT (user_id) DO NOTHING"))
+
+    async def increment_within(self, user_id, size, files, max_bytes, max_files):
+        # The row only matches while the new totals stay within the limits
+        status = await self.db.execute(
+            "UPDATE user_usage SET bytes = bytes + $2, files = files + $3 "
+            "WHERE user_id = $1 AND bytes + $2 <= $4 AND files + $3 <= $5",
+            user_id, size, files, max_bytes, max_files
+        )
+        return _count(status) > 0
+
+    async def increment(self, user_id, size, files=0):
+        await self.db.execute("UPDATE user_usage SET bytes = bytes + $2, files = files + $3 WHERE user_id = $1",
+                              user_id, size, files)
+
+    async def set(self, user_id, usage):
+        await self.db.execute(*self.table.upsert("user_id", {**usage, "user_id": user_id}))
+
+
+def postgres_repositories(dsn: str, schema: Optional[str] = None, **pool_options) -> Repositories:
+    db = PostgresDatabase(dsn, schema, **{**postgres_pool_options(), **pool_options})
+    return Repositories(
+        users=PostgresUserRepository(db),
+        profiles=PostgresProfileRepository(db),
+        retirement_profiles=PostgresRetirementProfileRepository(db),
+        documents=PostgresDocumentRepository(db),
+        resets=PostgresResetRepository(db),
+        usage=PostgresUsageRepository(db),
+        sql=db,
+    )
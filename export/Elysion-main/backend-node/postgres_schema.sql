@@ -0,0 +1,194 @@
+-- ============================================
+-- ELYSION - Schéma PostgreSQL de l'API (DATABASE_BACKEND=postgres)
+-- ============================================
+-- Appliqué au démarrage par postgres_repositories.py : idempotent, il ne
+-- supprime rien (contrairement à DATABASE_SCHEMA.sql).
+--
+-- Différences avec DATABASE_SCHEMA.sql, pour suivre ce que l'API écrit :
+-- * dates en TIMESTAMP UTC sans fuseau (datetime.utcnow() côté API) ;
+-- * les champs sans colonne dédiée (réponses du questionnaire, chiffrement,
+--   état de l'extraction de texte...) vont dans la colonne JSONB « data » ;
+-- * hashed_password peut être NULL (utilisateurs invités) ;
+-- * password_resets.token est unique et la table user_usage est ajoutée.
+-- ============================================
+
+-- ============================================
+-- TYPES ÉNUMÉRÉS
+-- ============================================
+
+DO $$ BEGIN
+    CREATE TYPE user_type AS ENUM ('employee', 'freelancer', 'business_owner');
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+DO $$ BEGIN
+    CREATE TYPE document_category AS ENUM (
+        'salary_slip', 'career_statement', 'tax_declaration', 'retirement_contract', 'other'
+    );
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+-- ============================================
+-- TABLE : users
+-- ============================================
+CREATE TABLE IF NOT EXISTS users (
+    id UUID PRIMARY KEY,
+    email VARCHAR(255) NOT NULL UNIQUE,
+    hashed_password VARCHAR(255),
+    full_name VARCHAR(255) NOT NULL,
+    user_type user_type NOT NULL DEFAULT 'employee',
+    is_active BOOLEAN DEFAULT TRUE,
+    profile_completed BOOLEAN,
+    profile_completed_at TIMESTAMP,
+    last_login_at TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    updated_at TIMESTAMP,
+    data JSONB NOT NULL DEFAULT '{}'
+);
+
+CREATE INDEX IF NOT EXISTS idx_users_user_type ON users(user_type);
+CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at);
+
+-- ============================================
+-- TABLE : user_profiles (réponses du questionnaire dans data)
+-- ============================================
+CREATE TABLE IF NOT EXISTS user_profiles (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID NOT NULL UNIQUE REFERENCES users(id) ON DELETE CASCADE,
+    completed_at TIMESTAMP,
+    last_updated TIMESTAMP,
+    data JSONB NOT NULL DEFAULT '{}'
+);
+
+-- ============================================
+-- TABLE : retirement_profiles (dernière simulation enregistrée)
+-- ============================================
+CREATE TABLE IF NOT EXISTS retirement_profiles (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID NOT NULL UNIQUE REFERENCES users(id) ON DELETE CASCADE,
+    simulation_data JSONB,
+    last_simulation_at TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    updated_at TIMESTAMP,
+    data JSONB NOT NULL DEFAULT '{}'
+);
+
+-- ============================================
+-- TABLE : documents
+-- ============================================
+CREATE TABLE IF NOT EXISTS documents (
+    id UUID PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    filename VARCHAR(255) NOT NULL,
+    original_filename VARCHAR(255) NOT NULL,
+    category document_category NOT NULL DEFAULT 'other',
+    file_size BIGINT NOT NULL CHECK (file_size >= 0),
+    storage_backend VARCHAR(50) DEFAULT 'local',
+    storage_key VARCHAR(500),
+    file_path VARCHAR(500),
+    content_hash VARCHAR(64),
+    uploaded_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    updated_at TIMESTAMP,
+    data JSONB NOT NULL DEFAULT '{}'
+);
+
+-- Liste d'un utilisateur (plus récents d'abord), filtre par catégorie
+CREATE INDEX IF NOT EXISTS idx_documents_user_uploaded ON documents(user_id, uploaded_at DESC);
+CREATE INDEX IF NOT EXISTS idx_documents_user_category ON documents(user_id, category);
+CREATE INDEX IF NOT EXISTS idx_documents_storage ON documents(storage_backend, storage_key);
+
+-- ============================================
+-- TABLE : password_resets
+-- ============================================
+CREATE TABLE IF NOT EXISTS password_resets (
+    id BIGSERIAL PRIMARY KEY,
+    email VARCHAR(255) NOT NULL,
+    token VARCHAR(1000) NOT NULL UNIQUE,
+    created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    used BOOLEAN NOT NULL DEFAULT FALSE,
+    used_at TIMESTAMP,
+    data JSONB NOT NULL DEFAULT '{}'
+);
+
+CREATE INDEX IF NOT EXISTS idx_password_resets_email ON password_resets(email);
+
+-- ============================================
+-- TABLE : user_usage (compteurs des quotas, voir quotas.py)
+-- ============================================
+CREATE TABLE IF NOT EXISTS user_usage (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    bytes BIGINT NOT NULL DEFAULT 0,
+    files INTEGER NOT NULL DEFAULT 0,
+    data JSONB NOT NULL DEFAULT '{}'
+);
+
+-- ============================================
+-- TABLE : simulation_scenarios (pas encore utilisée par l'API)
+-- ============================================
+CREATE TABLE IF NOT EXISTS simulation_scenarios (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    scenario_name VARCHAR(100) NOT NULL,
+    retirement_age INTEGER NOT NULL,
+    base_pension DECIMAL(12, 2) DEFAULT 0,
+    complementary_pension DECIMAL(12, 2) DEFAULT 0,
+    total_pension DECIMAL(12, 2) DEFAULT 0,
+    replacement_rate DECIMAL(5, 2) DEFAULT 0,
+    quarters_at_retirement INTEGER DEFAULT 0,
+    decote_rate DECIMAL(5, 2) DEFAULT 0,
+    surcote_rate DECIMAL(5, 2) DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+CREATE INDEX IF NOT EXISTS idx_simulation_scenarios_user_id ON simulation_scenarios(user_id);
+
+-- ============================================
+-- VALEURS DE RÉFÉRENCE
+-- ============================================
+CREATE TABLE IF NOT EXISTS ref_quarter_thresholds (
+    id SERIAL PRIMARY KEY,
+    year INTEGER NOT NULL UNIQUE,
+    threshold_1_quarter DECIMAL(10, 2),
+    threshold_2_quarters DECIMAL(10, 2),
+    threshold_3_quarters DECIMAL(10, 2),
+    threshold_4_quarters DECIMAL(10, 2),
+    point_value_agirc_arrco DECIMAL(6, 4),
+    point_value_rci DECIMAL(6, 4)
+);
+
+INSERT INTO ref_quarter_thresholds
+(year, threshold_1_quarter, threshold_2_quarters, threshold_3_quarters, threshold_4_quarters, point_value_agirc_arrco, point_value_rci)
+VALUES
+(2024, 4020.00, 8040.00, 12060.00, 16080.00, 1.4386, 1.4386)
+ON CONFLICT (year) DO NOTHING;
+
+-- ============================================
+-- VUES
+-- ============================================
+
+CREATE OR REPLACE VIEW v_user_summary AS
+SELECT
+    u.id AS user_id,
+    u.email,
+    u.full_name,
+    u.user_type,
+    u.created_at AS account_created,
+    u.is_active,
+    up.data->>'date_of_birth' AS date_of_birth,
+    up.data->>'gender' AS gender,
+    up.data->>'validated_quarters' AS validated_quarters,
+    rp.last_simulation_at,
+    (SELECT COUNT(*) FROM documents d WHERE d.user_id = u.id) AS document_count
+FROM users u
+LEFT JOIN user_profiles up ON u.id = up.user_id
+LEFT JOIN retirement_profiles rp ON u.id = rp.user_id;
+
+CREATE OR REPLACE VIEW v_documents_by_category AS
+SELECT
+    user_id,
+    category,
+    COUNT(*) AS document_count,
+    SUM(file_size) AS total_size,
+    MAX(uploaded_at) AS last_upload
+FROM documents
+GROUP BY user_id, category;
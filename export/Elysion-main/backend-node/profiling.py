@@ -0,0 +1,265 @@
+"""
+On-demand sampling profiler for live requests.
+
+A request is profiled when one of the triggers fires:
+
+* ``X-Profile: 1`` sent together with a valid ``X-Admin-Token``;
+* a random sample of ``PROFILE_SAMPLE_RATE`` (0..1) of the requests;
+* ``PROFILE_SLOW_MS``: every request is watched and the profile is kept only
+  if the request turned out slower than the threshold.
+
+While at least one request is watched, a daemon thread wakes every
+``PROFILE_INTERVAL_MS`` and records, for each watched request:
+
+* the running stack of the event-loop thread when the request's task is the
+  one executing, or its suspended coroutine chain (prefixed ``[await]``)
+  when it is waiting;
+* the stacks of busy threadpool workers (prefixed ``[thread]``) while the
+  request awaits a threadpool call. With several such requests in flight at
+  once, worker stacks cannot be told apart and are attributed to each.
+
+Profiles are written as flamegraph-ready collapsed stacks (``a;b;c count``)
+with a JSON sidecar into ``PROFILE_DIR``, keeping the newest
+``PROFILE_MAX_FILES``. With no trigger configured the middleware only reads
+one header, so the overhead is negligible.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = Path(__file__).parent
+_THREADPOOL_MARKERS = ("run_sync_in_worker_thread", "run_in_threadpool", "to_thread")
+_IDLE_FUNCTIONS = {"wait", "get", "_worker", "select", "poll", "sleep"}
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({Path(code.co_filename).stem})"
+
+
+def _thread_stack(frame) -> List[str]:
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _coroutine_stack(coro) -> List[str]:
+    """Outermost-first labels of a suspended coroutine chain"""
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        stack.append(_frame_label(frame.f_code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return stack
+
+
+class ProfileSession:
+    def __init__(self, task: asyncio.Task, loop_thread: int, method: str, path: str, trigger: str):
+        self.id = uuid.uuid4().hex
+        self.task = task
+        self.loop_thread = loop_thread
+        self.loop = task.get_loop()
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = datetime.utcnow()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+
+class Profiler:
+    def __init__(self):
+        self.sample_rate = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+        self.slow_ms = float(os.environ.get("PROFILE_SLOW_MS", "0"))
+        self.interval = float(os.environ.get("PROFILE_INTERVAL_MS", "10")) / 1000
+        self.directory = Path(os.environ.get("PROFILE_DIR", str(ROOT_DIR / "profiles")))
+        self.max_files = int(os.environ.get("PROFILE_MAX_FILES", "50"))
+        self.admin_token = os.environ.get("ADMIN_TOKEN")
+        self._sessions: Dict[str, ProfileSession] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.admin_token or self.sample_rate or self.slow_ms)
+
+    def trigger_for(self, headers: Dict[bytes, bytes]) -> Optional[str]:
+        if self.admin_token and headers.get(b"x-profile") == b"1":
+            token = headers.get(b"x-admin-token", b"").decode("latin-1")
+            if hmac.compare_digest(token, self.admin_token):
+                return "header"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sample"
+        if self.slow_ms:
+            return "slow"
+        return None
+
+    # -- sampling ------------------------------------------------------------
+
+    def start(self, session: ProfileSession):
+        with self._lock:
+            self._sessions[session.id] = session
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def stop(self, session: ProfileSession):
+        with self._lock:
+            self._sessions.pop(session.id, None)
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            if not self._sessions:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            time.sleep(self.interval)
+            # Sampling under the lock: once stop() returns, a session is no
+            # longer touched and can be written out safely
+            with self._lock:
+                try:
+                    self._sample(list(self._sessions.values()), me)
+                except Exception as e:  # never let the sampler die
+                    logger.error(f"Profiler sample failed: {e}")
+
+    def _sample(self, sessions: List[ProfileSession], me: int):
+        frames = sys._current_frames()
+        workers = None
+        for session in sessions:
+            session.samples += 1
+            try:
+                running = asyncio.current_task(session.loop) is session.task
+            except RuntimeError:
+                running = False
+            if running and session.loop_thread in frames:
+                session.stacks[";".join(_thread_stack(frames[session.loop_thread]))] += 1
+                continue
+
+            chain = _coroutine_stack(session.task.get_coro())
+            session.stacks[";".join(["[await]"] + chain)] += 1
+            if any(marker in label for label in chain[-3:] for marker in _THREADPOOL_MARKERS):
+                if workers is None:
+                    workers = self._busy_worker_stacks(frames, me, session.loop_thread)
+                for stack in workers:
+                    session.stacks[";".join(["[thread]"] + stack)] += 1
+
+    @staticmethod
+    def _busy_worker_stacks(frames, me: int, loop_thread: int) -> List[List[str]]:
+        stacks = []
+        for thread_id, frame in frames.items():
+            if thread_id in (me, loop_thread):
+                continue
+            if frame.f_code.co_name in _IDLE_FUNCTIONS:
+                continue
+            stacks.append(_thread_stack(frame))
+        return stacks
+
+    # -- storage -------------------------------------------------------------
+
+    def _write(self, session: ProfileSession, meta: dict):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        lines = [f"{stack} {count}" for stack, count in session.stacks.most_common()]
+        (self.directory / f"{session.id}.collapsed").write_text("\n".join(lines) + "\n", encoding="utf-8")
+        (self.directory / f"{session.id}.json").write_text(json.dumps(meta), encoding="utf-8")
+        # Keep only the newest profiles
+        metas = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for old in metas[self.max_files:]:
+            old.unlink(missing_ok=True)
+            old.with_suffix(".collapsed").unlink(missing_ok=True)
+
+    async def save(self, session: ProfileSession, route: str, status: int, duration: float):
+        meta = {
+            "id": session.id,
+            "method": session.method,
+            "path": session.path,
+            "route": route,
+            "status": status,
+            "trigger": session.trigger,
+            "duration_ms": round(duration * 1000, 1),
+            "samples": session.samples,
+            "interval_ms": self.interval * 1000,
+            "created_at": session.started_at.isoformat(),
+        }
+        try:
+            await asyncio.to_thread(self._write, session, meta)
+        except Exception as e:
+            logger.error(f"Error saving profile {session.id}: {e}")
+
+    def list_profiles(self) -> List[dict]:
+        if not self.directory.exists():
+            return []
+        profiles = []
+        for path in self.directory.glob("*.json"):
+            try:
+                profiles.append(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue
+        return sorted(profiles, key=lambda p: p["created_at"], reverse=True)
+
+    def read_profile(self, profile_id: str) -> Optional[str]:
+        if not _ID_RE.match(profile_id):
+            return None
+        path = self.directory / f"{profile_id}.collapsed"
+        return path.read_text(encoding="utf-8") if path.exists() else None
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware wrapping each request in a profile session when triggered"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiler.enabled:
+            return await self.app(scope, receive, send)
+        trigger = profiler.trigger_for(dict(scope["headers"]))
+        if trigger is None:
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def status_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        session = ProfileSession(
+            asyncio.current_task(), threading.get_ident(), scope["method"], scope["path"], trigger
+        )
+        started = time.perf_counter()
+        profiler.start(session)
+        try:
+            await self.app(scope, receive, status_send)
+        finally:
+            profiler.stop(session)
+            duration = time.perf_counter() - started
+            if trigger != "slow" or duration * 1000 >= profiler.slow_ms:
+                route = getattr(scope.get("route"), "path", None) or "unmatched"
+                await profiler.save(session, route, status, duration)
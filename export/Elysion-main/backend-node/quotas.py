@@ -0,0 +1,79 @@
+"""
+Per-user storage quotas.
+
+Usage lives in one small ``user_usage`` document per user. Uploads reserve
+space with a single conditional ``$inc`` (the filter only matches while the
+new total stays within the limits), so two concurrent uploads can never
+overshoot the quota, and reading usage never scans the documents. The
+queries themselves are in ``repositories.UsageRepository``.
+"""
+
+import os
+from typing import Dict, Optional
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_MAX_FILES = 500
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def limits_for(user_type: Optional[str]) -> Dict[str, int]:
+    """Limits for a user type: QUOTA_MAX_BYTES_<TYPE> overrides QUOTA_MAX_BYTES"""
+    user_type = getattr(user_type, "value", user_type)
+    suffix = f"_{user_type.upper()}" if user_type else ""
+    max_bytes = os.environ.get(f"QUOTA_MAX_BYTES{suffix}") or os.environ.get("QUOTA_MAX_BYTES")
+    max_files = os.environ.get(f"QUOTA_MAX_FILES{suffix}") or os.environ.get("QUOTA_MAX_FILES")
+    return {
+        "max_bytes": int(max_bytes) if max_bytes else DEFAULT_MAX_BYTES,
+        "max_files": int(max_files) if max_files else DEFAULT_MAX_FILES,
+    }
+
+
+async def _ensure_usage(repos, user_id: str):
+    """Create the counter from existing documents the first time it is needed"""
+    await repos.usage.initialize(user_id, await repos.documents.usage_totals(user_id))
+
+
+async def get_usage(repos, user_id: str) -> Dict[str, int]:
+    usage = await repos.usage.get(user_id)
+    if usage is None:
+        await _ensure_usage(repos, user_id)
+        usage = await repos.usage.get(user_id)
+    return {"bytes": usage.get("bytes", 0), "files": usage.get("files", 0)}
+
+
+async def reserve(repos, user_id: str, user_type: Optional[str], size: int, files: int = 1):
+    """Atomically add ``size`` bytes / ``files`` files, or raise QuotaExceeded"""
+    limits = limits_for(user_type)
+    args = (user_id, size, files, limits["max_bytes"], limits["max_files"])
+    reserved = await repos.usage.increment_within(*args)
+    if not reserved and await repos.usage.get(user_id) is None:
+        await _ensure_usage(repos, user_id)
+        reserved = await repos.usage.increment_within(*args)
+    if not reserved:
+        raise QuotaExceeded()
+
+
+async def release(repos, user_id: str, size: int, files: int = 1):
+    """Refund space (document deleted or upload aborted)"""
+    await repos.usage.increment(user_id, -size, -files)
+
+
+async def adjust(repos, user_id: str, delta_bytes: int):
+    if delta_bytes:
+        await repos.usage.increment(user_id, delta_bytes)
+
+
+async def recompute(repos, user_id: str):
+    """Reset the counter from the documents (used when it may have drifted)"""
+    await repos.usage.set(user_id, await repos.documents.usage_totals(user_id))
+
+
+async def check_declared(repos, user_id: str, user_type: Optional[str], declared_size: int):
+    """Cheap pre-check on a declared request size, before the body is read"""
+    limits = limits_for(user_type)
+    usage = await get_usage(repos, user_id)
+    if usage["bytes"] + declared_size > limits["max_bytes"] or usage["files"] >= limits["max_files"]:
+        raise QuotaExceeded()
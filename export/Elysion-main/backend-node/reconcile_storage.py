@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Reconcile stored files with the documents collection.
+
+Usage:
+    python reconcile_storage.py --dry-run
+    python reconcile_storage.py --min-age-hours 1 --grace-days 7 --rate 50
+"""
+
+import argparse
+import asyncio
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import reconciliation
+from storage import get_storage, close_storages
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+async def run(args):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    storage = get_storage(args.backend)
+    owner = f"cli:{os.getpid()}"
+
+    try:
+        if not args.dry_run and not await reconciliation.acquire_lock(db, timedelta(hours=6), owner):
+            print("⚠️  Une réconciliation est déjà en cours")
+            return
+        mode = " (simulation)" if args.dry_run else ""
+        print(f"🔄 Réconciliation du stockage '{storage.name}'{mode}...")
+        try:
+            stats = await reconciliation.reconcile(
+                db,
+                storage,
+                dry_run=args.dry_run,
+                min_age=timedelta(hours=args.min_age_hours),
+                grace=timedelta(days=args.grace_days),
+                rate=args.rate,
+            )
+        finally:
+            if not args.dry_run:
+                await reconciliation.release_lock(db, owner)
+        print("\n📊 Résultat :")
+        for name, count in stats.items():
+            print(f"   - {name} : {count}")
+    finally:
+        client.close()
+        await close_storages()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile stored files with document rows")
+    parser.add_argument("--backend", default=os.environ.get("STORAGE_BACKEND", "local"), choices=["local", "s3"])
+    parser.add_argument("--dry-run", action="store_true", help="report only, change nothing")
+    parser.add_argument("--min-age-hours", type=float, default=1.0, help="ignore orphan files younger than this")
+    parser.add_argument("--grace-days", type=float, default=7.0, help="keep quarantined files this long")
+    parser.add_argument("--rate", type=float, default=50.0, help="max mutations per second (0 = unlimited)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Reconciliation between the ``documents`` collection and stored files.
+
+Both sides are streamed in storage-key order and merged like a sorted-list
+diff, so memory stays constant whatever the number of files:
+
+* a file without a row is moved to ``quarantine/`` and deleted for good once
+  the grace period is over (unless a row referencing it shows up again);
+* a row without a file is flagged with ``file_missing`` (and unflagged if the
+  file reappears).
+
+Rows written before sharding (no ``storage_key``) and flat files at the
+storage root are left to ``migrate_storage.py`` and only counted.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from storage import EXPORTS_PREFIX, QUARANTINE_PREFIX, StorageBackend, StoredObject, get_storage
+
+logger = logging.getLogger(__name__)
+
+LOCK_ID = "storage_reconciliation"
+
+
+class RateLimiter:
+    """At most ``rate`` operations per second (0 = unlimited)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next = 0.0
+
+    async def wait(self, count: int = 1):
+        """Wait for the turn of the next ``count`` operations (a batch)"""
+        if not self.interval:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._next > now:
+            await asyncio.sleep(self._next - now)
+        self._next = max(now, self._next) + self.interval * count
+
+
+async def _document_keys(db, backend: str) -> AsyncIterator[dict]:
+    cursor = db.documents.find(
+        {"storage_backend": backend, "storage_key": {"$exists": True, "$ne": None}},
+        {"_id": 0, "id": 1, "storage_key": 1, "file_missing": 1}
+    ).sort("storage_key", 1)
+    async for document in cursor:
+        yield document
+
+
+async def _stored_objects(storage: StorageBackend, stats: Dict) -> AsyncIterator[StoredObject]:
+    async for obj in storage.list_objects():
+        if obj.key.startswith((QUARANTINE_PREFIX, EXPORTS_PREFIX)):
+            # Not document files: exports expire through their own job
+            continue
+        if "/" not in obj.key:
+            stats["legacy_files"] += 1
+            continue
+        yield obj
+
+
+async def _next(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def reconcile(
+    db,
+    storage: Optional[StorageBackend] = None,
+    dry_run: bool = False,
+    min_age: timedelta = timedelta(hours=1),
+    grace: timedelta = timedelta(days=7),
+    rate: float = 50,
+) -> Dict[str, int]:
+    """One reconciliation pass. Returns counters of what was found and done."""
+    storage = storage or get_storage()
+    limiter = RateLimiter(rate)
+    now = datetime.utcnow()
+    stats = {
+        "matched": 0, "orphan_files": 0, "quarantined": 0, "too_recent": 0,
+        "missing_files": 0, "flagged": 0, "unflagged": 0,
+        "purged": 0, "restored": 0, "legacy_files": 0, "legacy_rows": 0,
+    }
+
+    stats["legacy_rows"] = await db.documents.count_documents(
+        {"$or": [{"storage_key": {"$exists": False}}, {"storage_key": None}]}
+    )
+
+    rows = _document_keys(db, storage.name)
+    files = _stored_objects(storage, stats)
+    row = await _next(rows)
+    obj = await _next(files)
+
+    while row is not None or obj is not None:
+        if obj is None or (row is not None and row["storage_key"] < obj.key):
+            # Row without a file
+            stats["missing_files"] += 1
+            if not row.get("file_missing"):
+                stats["flagged"] += 1
+                if not dry_run:
+                    await limiter.wait()
+                    await db.documents.update_one(
+                        {"id": row["id"]},
+                        {"$set": {"file_missing": True, "file_missing_since": now}}
+                    )
+            row = await _next(rows)
+        elif row is None or obj.key < row["storage_key"]:
+            # File without a row. Recent files may belong to an upload whose
+            # row is about to be inserted, so they get another chance.
+            stats["orphan_files"] += 1
+            if now - obj.modified_at < min_age:
+                stats["too_recent"] += 1
+            elif dry_run:
+                stats["quarantined"] += 1
+            else:
+                await limiter.wait()
+                try:
+                    await quarantine(db, storage, obj, now)
+                    stats["quarantined"] += 1
+                except Exception as e:
+                    logger.error(f"Error quarantining {obj.key}: {e}")
+            obj = await _next(files)
+        else:
+            stats["matched"] += 1
+            if row.get("file_missing"):
+                stats["unflagged"] += 1
+                if not dry_run:
+                    await db.documents.update_one(
+                        {"id": row["id"]},
+                        {"$unset": {"file_missing": "", "file_missing_since": ""}}
+                    )
+            row = await _next(rows)
+            obj = await _next(files)
+
+    await purge_quarantine(db, storage, now - grace, dry_run, limiter, stats)
+    return stats
+
+
+async def quarantine(db, storage: StorageBackend, obj: StoredObject, now: datetime):
+    quarantine_key = f"{QUARANTINE_PREFIX}{now:%Y%m%d}/{obj.key}"
+    await storage.move(obj.key, quarantine_key)
+    await db.storage_quarantine.insert_one({
+        "backend": storage.name,
+        "key": obj.key,
+        "quarantine_key": quarantine_key,
+        "size": obj.size,
+        "quarantined_at": now,
+    })
+
+
+async def purge_quarantine(db, storage: StorageBackend, before: datetime, dry_run: bool,
+                           limiter: RateLimiter, stats: Dict):
+    """Delete quarantined files older than the grace period"""
+    cursor = db.storage_quarantine.find(
+        {"backend": storage.name, "quarantined_at": {"$lt": before}}
+    ).sort("quarantined_at", 1)
+    async for entry in cursor:
+        if dry_run:
+            stats["purged"] += 1
+            continue
+        await limiter.wait()
+        referenced = await db.documents.find_one(
+            {"storage_backend": storage.name, "storage_key": entry["key"]}, {"_id": 1}
+        )
+        try:
+            if referenced:
+                # A row points at it after all: put the file back
+                await storage.move(entry["quarantine_key"], entry["key"])
+                stats["restored"] += 1
+            else:
+                await storage.delete(entry["quarantine_key"])
+                stats["purged"] += 1
+        except Exception as e:
+            logger.error(f"Error purging quarantined file {entry['quarantine_key']}: {e}")
+            continue
+        await db.storage_quarantine.delete_one({"_id": entry["_id"]})
+
+
+async def acquire_lock(db, ttl: timedelta, owner: str) -> bool:
+    """Mongo lease so only one worker/host reconciles at a time"""
+    now = datetime.utcnow()
+    try:
+        await db.maintenance_locks.find_one_and_update(
+            {"_id": LOCK_ID, "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires_at": now + ttl}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # Someone else holds a valid lease
+        return False
+    return True
+
+
+async def release_lock(db, owner: str):
+    await db.maintenance_locks.delete_one({"_id": LOCK_ID, "owner": owner})
+
+
+async def run_periodically(db, interval: float):
+    """Background loop started with the app when RECONCILE_INTERVAL_SECONDS > 0"""
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    min_age = timedelta(seconds=float(os.environ.get("RECONCILE_MIN_AGE_SECONDS", "3600")))
+    grace = timedelta(seconds=float(os.environ.get("RECONCILE_GRACE_SECONDS", str(7 * 24 * 3600))))
+    rate = float(os.environ.get("RECONCILE_RATE", "20"))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if not await acquire_lock(db, timedelta(seconds=max(interval, 3600)), owner):
+                continue
+            try:
+                stats = await reconcile(db, min_age=min_age, grace=grace, rate=rate)
+                logger.info(f"Storage reconciliation: {stats}")
+            finally:
+                await release_lock(db, owner)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Storage reconciliation failed: {e}")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Throttled backfill of the document full-text index.
+
+Only documents whose text is missing or was produced by an older extractor
+are processed, so the command can be interrupted and re-run at will.
+
+Usage:
+    python reindex_documents.py --rate 5 --concurrency 2
+    python reindex_documents.py --user-id <id> --force
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import document_search
+import workers
+from storage import close_storages
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+async def backfill(args):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    await document_search.ensure_indexes(db)
+
+    query = {} if args.force else {"text_indexed_version": {"$ne": document_search.EXTRACTOR_VERSION}}
+    if args.user_id:
+        query["user_id"] = args.user_id
+
+    total = await db.documents.count_documents(query)
+    print(f"🔎 {total} document(s) à indexer")
+
+    stats = {"indexed": 0, "unchanged": 0, "errors": 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    interval = 1.0 / args.rate if args.rate > 0 else 0
+    started = time.monotonic()
+
+    def finished(outcome: str):
+        # Called once per document, with no await in between: every
+        # milestone prints exactly once
+        stats[outcome] += 1
+        done = sum(stats.values())
+        if done % 100 == 0:
+            print(f"   {done}/{total} ({done / (time.monotonic() - started):.1f} doc/s)")
+
+    async def run(document):
+        async with semaphore:
+            try:
+                changed = await document_search.index_document(db, document, force=args.force)
+                finished("indexed" if changed else "unchanged")
+            except Exception as e:
+                finished("errors")
+                print(f"❌ {document['id']} : {e}")
+                await db.documents.update_one({"id": document["id"]}, {"$set": {"text_status": "failed"}})
+
+    try:
+        pending = set()
+        async for document in db.documents.find(query, {"_id": 0}).sort("uploaded_at", 1):
+            task = asyncio.ensure_future(run(document))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            # Throttle: never start more than ``rate`` documents per second
+            if interval:
+                await asyncio.sleep(interval)
+            if len(pending) >= args.concurrency:
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if pending:
+            await asyncio.wait(pending)
+        print(f"\n📊 Indexés : {stats['indexed']}, inchangés : {stats['unchanged']}, erreurs : {stats['errors']}")
+    finally:
+        client.close()
+        await close_storages()
+        workers.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the document full-text index")
+    parser.add_argument("--rate", type=float, default=5.0, help="max documents started per second (0 = unlimited)")
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--user-id")
+    parser.add_argument("--force", action="store_true", help="re-extract even if the index is current")
+    asyncio.run(backfill(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
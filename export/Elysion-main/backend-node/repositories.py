@@ -0,0 +1,751 @@
+"""
+Data access for the API: one repository per aggregate, injected into the
+handlers through FastAPI dependencies.
+
+Implementations with the same semantics:
+
+* ``Mongo*Repository`` over Motor, where projections, upserts and batching
+  live (handlers never build Mongo queries themselves);
+* ``Postgres*Repository`` over asyncpg, in postgres_repositories.py;
+* ``Memory*Repository``, plain dicts in the process, for tests and
+  benchmarks that must run without a database.
+
+Rows are returned as plain dicts without Mongo's ``_id``. ``fields`` limits
+the returned keys, like a projection. ``create_repositories()`` picks the
+implementation from ``DATABASE_BACKEND`` (``mongo`` by default,
+``postgres`` or ``memory``).
+
+Modules that own Mongo-specific collections (text index, career cache,
+storage reconciliation, jobs) keep working on ``Repositories.db``, which is
+None for the other backends.
+"""
+
+import copy
+import logging
+import os
+from datetime import datetime
+from enum import Enum
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+Fields = Optional[Iterable[str]]
+
+
+def _projection(fields: Fields) -> Dict[str, int]:
+    if fields is None:
+        return {"_id": 0}
+    return {"_id": 0, **{name: 1 for name in fields}}
+
+
+def _select(row: Optional[dict], fields: Fields) -> Optional[dict]:
+    """In-memory equivalent of a projection (returns a copy)"""
+    if row is None:
+        return None
+    if fields is None:
+        return copy.deepcopy(row)
+    return {name: copy.deepcopy(row[name]) for name in fields if name in row}
+
+
+def _stored(value):
+    """Copy of a value as Mongo or Postgres would store it: Enums by value"""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, dict):
+        return {k: _stored(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_stored(v) for v in value]
+    return copy.deepcopy(value)
+
+
+# ============================================================================
+# Interfaces
+# ============================================================================
+
+class UserRepository:
+    async def get(self, user_id: str, fields: Fields = None) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def get_by_email(self, email: str, fields: Fields = None) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def create(self, user: dict):
+        """Raises DuplicateKeyError when the email is taken"""
+        raise NotImplementedError
+
+    async def create_many(self, users: List[dict]) -> Set[int]:
+        """Insert what can be inserted; returns the indexes of the users whose email is taken"""
+        raise NotImplementedError
+
+    async def update(self, user_id: str, values: dict) -> bool:
+        """Set ``values`` on the user; returns whether a user matched"""
+        raise NotImplementedError
+
+    async def set_password(self, email: str, hashed_password: str) -> bool:
+        """Returns whether the stored hash changed"""
+        raise NotImplementedError
+
+    async def ensure_indexes(self):
+        pass
+
+
+class ProfileRepository:
+    """Questionnaire answers (``user_profiles``), one per user"""
+
+    async def get(self, user_id: str, fields: Fields = None) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def upsert(self, user_id: str, values: dict):
+        raise NotImplementedError
+
+    async def insert_many(self, profiles: List[dict]):
+        """Profiles of new users (bulk imports)"""
+        raise NotImplementedError
+
+    async def ensure_indexes(self):
+        pass
+
+
+class RetirementProfileRepository:
+    """Saved simulations (``retirement_profiles``), one per user"""
+
+    async def get(self, user_id: str, fields: Fields = None) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def upsert(self, user_id: str, values: dict):
+        """Set ``values``, adding ``created_at`` when the row is new"""
+        raise NotImplementedError
+
+    async def ensure_indexes(self):
+        pass
+
+
+class DocumentRepository:
+    async def get(self, document_id: str, user_id: Optional[str] = None, fields: Fields = None) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def list(self, user_id: str, category: Optional[str] = None, fields: Fields = None) -> List[dict]:
+        """A user's documents, newest first"""
+        raise NotImplementedError
+
+    def iterate(self, user_id: str, category: Optional[str] = None, fields: Fields = None) -> AsyncIterator[dict]:
+        """Same as ``list`` without loading everything at once"""
+        raise NotImplementedError
+
+    async def get_many(self, user_id: str, document_ids: List[str], fields: Fields = None) -> List[dict]:
+        raise NotImplementedError
+
+    async def insert(self, document: dict):
+        raise NotImplementedError
+
+    async def insert_many(self, documents: List[dict]):
+        raise NotImplementedError
+
+    async def update(self, document_id: str, values: dict) -> bool:
+        raise NotImplementedError
+
+    async def delete(self, document_id: str) -> bool:
+        raise NotImplementedError
+
+    async def delete_many(self, user_id: str, document_ids: List[str]) -> int:
+        raise NotImplementedError
+
+    async def category_summary(self, user_id: str, since: datetime) -> List[dict]:
+        """``[{"category", "count", "recent"}]`` where recent counts uploads after ``since``"""
+        raise NotImplementedError
+
+    async def usage_totals(self, user_id: str) -> Dict[str, int]:
+        """``{"bytes", "files"}`` summed over the user's documents"""
+        raise NotImplementedError
+
+    async def version(self, user_id: str, category: Optional[str] = None) -> str:
+        """Changes whenever the matching list changes: count and latest upload/update"""
+        raise NotImplementedError
+
+    async def ensure_indexes(self):
+        pass
+
+
+class ResetRepository:
+    """Password reset tokens (``password_resets``)"""
+
+    async def create(self, email: str, token: str):
+        """Store a token; creating the same token again is a no-op"""
+        raise NotImplementedError
+
+    async def find_unused(self, token: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def mark_used(self, token: str):
+        raise NotImplementedError
+
+    async def ensure_indexes(self):
+        pass
+
+
+class UsageRepository:
+    """Per-user storage counters (``user_usage``), see quotas.py"""
+
+    async def get(self, user_id: str) -> Optional[Dict[str, int]]:
+        raise NotImplementedError
+
+    async def initialize(self, user_id: str, usage: Dict[str, int]):
+        """Create the counter unless it already exists"""
+        raise NotImplementedError
+
+    async def increment_within(self, user_id: str, size: int, files: int, max_bytes: int, max_files: int) -> bool:
+        """Atomically add to the counter if it stays within the limits"""
+        raise NotImplementedError
+
+    async def increment(self, user_id: str, size: int, files: int = 0):
+        raise NotImplementedError
+
+    async def set(self, user_id: str, usage: Dict[str, int]):
+        raise NotImplementedError
+
+    async def ensure_indexes(self):
+        pass
+
+
+class Repositories:
+    def __init__(self, users: UserRepository, profiles: ProfileRepository,
+                 retirement_profiles: RetirementProfileRepository, documents: DocumentRepository,
+                 resets: ResetRepository, usage: UsageRepository, db=None, client=None, sql=None):
+        self.users = users
+        self.profiles = profiles
+        self.retirement_profiles = retirement_profiles
+        self.documents = documents
+        self.resets = resets
+        self.usage = usage
+        # Underlying Motor database/client (None for the in-memory backend)
+        self.db = db
+        self.client = client
+        # PostgresDatabase of the Postgres backend
+        self.sql = sql
+
+    async def ensure_indexes(self):
+        if self.sql is not None:
+            await self.sql.ensure_schema()
+        for repository in (self.users, self.profiles, self.retirement_profiles,
+                           self.documents, self.resets, self.usage):
+            await repository.ensure_indexes()
+
+    async def close(self):
+        if self.client is not None:
+            self.client.close()
+        if self.sql is not None:
+            await self.sql.close()
+
+
+# ============================================================================
+# Mongo
+# ============================================================================
+
+class MongoUserRepository(UserRepository):
+    def __init__(self, db):
+        self.collection = db.users
+
+    async def get(self, user_id, fields=None):
+        return await self.collection.find_one({"id": user_id}, _projection(fields))
+
+    async def get_by_email(self, email, fields=None):
+        return await self.collection.find_one({"email": email}, _projection(fields))
+
+    async def create(self, user):
+        await self.collection.insert_one(dict(user))
+
+    async def create_many(self, users):
+        if not users:
+            return set()
+        try:
+            # Unordered: one taken email does not stop the rest of the batch
+            await self.collection.insert_many([dict(u) for u in users], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if not errors or any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            return {error["index"] for error in errors}
+        return set()
+
+    async def update(self, user_id, values):
+        result = await self.collection.update_one({"id": user_id}, {"$set": values})
+        return result.matched_count > 0
+
+    async def set_password(self, email, hashed_password):
+        result = await self.collection.update_one({"email": email}, {"$set": {"hashed_password": hashed_password}})
+        return result.modified_count > 0
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("id", unique=True)
+        # Unique, so concurrent signups and bulk imports cannot create the
+        # same account twice. Older deployments have a plain index
+        indexes = await self.collection.index_information()
+        if "email_1" in indexes and not indexes["email_1"].get("unique"):
+            await self.collection.drop_index("email_1")
+        try:
+            await self.collection.create_index("email", unique=True)
+        except DuplicateKeyError as e:
+            logger.error(f"Existing duplicate emails, keeping a non-unique email index: {e}")
+            await self.collection.create_index("email")
+
+
+class MongoProfileRepository(ProfileRepository):
+    def __init__(self, db):
+        self.collection = db.user_profiles
+
+    async def get(self, user_id, fields=None):
+        return await self.collection.find_one({"user_id": user_id}, _projection(fields))
+
+    async def upsert(self, user_id, values):
+        await self.collection.update_one({"user_id": user_id}, {"$set": {**values, "user_id": user_id}}, upsert=True)
+
+    async def insert_many(self, profiles):
+        if profiles:
+            await self.collection.insert_many([dict(p) for p in profiles], ordered=False)
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("user_id")
+
+
+class MongoRetirementProfileRepository(RetirementProfileRepository):
+    def __init__(self, db):
+        self.collection = db.retirement_profiles
+
+    async def get(self, user_id, fields=None):
+        return await self.collection.find_one({"user_id": user_id}, _projection(fields))
+
+    async def upsert(self, user_id, values):
+        await self.collection.update_one(
+            {"user_id": user_id},
+            {"$set": {**values, "user_id": user_id}, "$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("user_id")
+
+
+class MongoDocumentRepository(DocumentRepository):
+    def __init__(self, db):
+        self.collection = db.documents
+
+    @staticmethod
+    def _query(user_id, category):
+        query = {"user_id": user_id}
+        if category:
+            query["category"] = category
+        return query
+
+    async def get(self, document_id, user_id=None, fields=None):
+        query = {"id": document_id}
+        if user_id is not None:
+            query["user_id"] = user_id
+        return await self.collection.find_one(query, _projection(fields))
+
+    async def list(self, user_id, category=None, fields=None):
+        cursor = self.collection.find(self._query(user_id, category), _projection(fields))
+        return await cursor.sort("uploaded_at", -1).to_list(length=None)
+
+    async def iterate(self, user_id, category=None, fields=None):
+        cursor = self.collection.find(self._query(user_id, category), _projection(fields))
+        async for document in cursor.sort("uploaded_at", -1):
+            yield document
+
+    async def get_many(self, user_id, document_ids, fields=None):
+        cursor = self.collection.find({"user_id": user_id, "id": {"$in": list(document_ids)}}, _projection(fields))
+        return await cursor.to_list(length=None)
+
+    async def insert(self, document):
+        # insert_one adds _id to the dict it is given
+        await self.collection.insert_one(dict(document))
+
+    async def insert_many(self, documents):
+        await self.collection.insert_many([dict(d) for d in documents])
+
+    async def update(self, document_id, values):
+        result = await self.collection.update_one({"id": document_id}, {"$set": values})
+        return result.matched_count > 0
+
+    async def delete(self, document_id):
+        result = await self.collection.delete_one({"id": document_id})
+        return result.deleted_count > 0
+
+    async def delete_many(self, user_id, document_ids):
+        result = await self.collection.delete_many({"user_id": user_id, "id": {"$in": list(document_ids)}})
+        return result.deleted_count
+
+    async def version(self, user_id, category=None):
+        result = await self.collection.aggregate([
+            {"$match": self._query(user_id, category)},
+            {"$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "latest": {"$max": {"$max": ["$uploaded_at", "$updated_at"]}}
+            }}
+        ]).to_list(length=1)
+        if not result:
+            return "0"
+        latest = result[0]["latest"]
+        return f"{result[0]['count']}:{latest.isoformat() if latest else ''}"
+
+    async def category_summary(self, user_id, since):
+        groups = await self.collection.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$group": {
+                "_id": "$category",
+                "count": {"$sum": 1},
+                "recent": {"$sum": {"$cond": [{"$gte": ["$uploaded_at", since]}, 1, 0]}}
+            }}
+        ]).to_list(length=None)
+        return [{"category": g["_id"], "count": g["count"], "recent": g["recent"]} for g in groups]
+
+    async def usage_totals(self, user_id):
+        result = await self.collection.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$group": {"_id": None, "bytes": {"$sum": "$file_size"}, "files": {"$sum": 1}}},
+        ]).to_list(length=1)
+        if not result:
+            return {"bytes": 0, "files": 0}
+        return {"bytes": result[0]["bytes"], "files": result[0]["files"]}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("id", unique=True)
+        await self.collection.create_index([("user_id", 1), ("uploaded_at", -1)])
+        await self.collection.create_index([("storage_backend", 1), ("storage_key", 1)])
+
+
+class MongoResetRepository(ResetRepository):
+    def __init__(self, db):
+        self.collection = db.password_resets
+
+    async def create(self, email, token):
+        # Upsert: a retried job must not leave a second, unused copy of the token
+        await self.collection.update_one(
+            {"token": token},
+            {"$setOnInsert": {"email": email, "token": token, "created_at": datetime.utcnow(), "used": False}},
+            upsert=True
+        )
+
+    async def find_unused(self, token):
+        return await self.collection.find_one({"token": token, "used": False}, {"_id": 0})
+
+    async def mark_used(self, token):
+        await self.collection.update_one({"token": token}, {"$set": {"used": True, "used_at": datetime.utcnow()}})
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("token")
+        await self.collection.create_index("email")
+
+
+class MongoUsageRepository(UsageRepository):
+    def __init__(self, db):
+        self.collection = db.user_usage
+
+    async def get(self, user_id):
+        return await self.collection.find_one({"user_id": user_id}, {"_id": 0, "bytes": 1, "files": 1})
+
+    async def initialize(self, user_id, usage):
+        try:
+            await self.collection.update_one(
+                {"user_id": user_id},
+                {"$setOnInsert": {"user_id": user_id, **usage}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass
+
+    async def increment_within(self, user_id, size, files, max_bytes, max_files):
+        # The filter only matches while the new totals stay within the limits
+        result = await self.collection.find_one_and_update(
+            {"user_id": user_id, "bytes": {"$lte": max_bytes - size}, "files": {"$lte": max_files - files}},
+            {"$inc": {"bytes": size, "files": files}},
+            projection={"_id": 1}, return_document=ReturnDocument.AFTER
+        )
+        return result is not None
+
+    async def increment(self, user_id, size, files=0):
+        await self.collection.update_one({"user_id": user_id}, {"$inc": {"bytes": size, "files": files}})
+
+    async def set(self, user_id, usage):
+        await self.collection.update_one({"user_id": user_id}, {"$set": usage}, upsert=True)
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("user_id", unique=True)
+
+
+def mongo_repositories(client, db_name: str) -> Repositories:
+    db = client[db_name]
+    return Repositories(
+        users=MongoUserRepository(db),
+        profiles=MongoProfileRepository(db),
+        retirement_profiles=MongoRetirementProfileRepository(db),
+        documents=MongoDocumentRepository(db),
+        resets=MongoResetRepository(db),
+        usage=MongoUsageRepository(db),
+        db=db,
+        client=client,
+    )
+
+
+# ============================================================================
+# In memory
+# ============================================================================
+#
+# Methods never await between reading and writing, so each call is atomic
+# with respect to the event loop, like a single Mongo operation.
+
+class MemoryUserRepository(UserRepository):
+    def __init__(self):
+        self.rows: Dict[str, dict] = {}
+
+    async def get(self, user_id, fields=None):
+        return _select(self.rows.get(user_id), fields)
+
+    async def get_by_email(self, email, fields=None):
+        for row in self.rows.values():
+            if row.get("email") == email:
+                return _select(row, fields)
+        return None
+
+    async def create(self, user):
+        if user["id"] in self.rows or await self.get_by_email(user["email"], ["id"]) is not None:
+            raise DuplicateKeyError(f"duplicate user {user['email']}")
+        self.rows[user["id"]] = _stored(user)
+
+    async def create_many(self, users):
+        duplicates = set()
+        for index, user in enumerate(users):
+            try:
+                await self.create(user)
+            except DuplicateKeyError:
+                duplicates.add(index)
+        return duplicates
+
+    async def update(self, user_id, values):
+        row = self.rows.get(user_id)
+        if row is None:
+            return False
+        row.update(_stored(values))
+        return True
+
+    async def set_password(self, email, hashed_password):
+        for row in self.rows.values():
+            if row.get("email") == email:
+                changed = row.get("hashed_password") != hashed_password
+                row["hashed_password"] = hashed_password
+                return changed
+        return False
+
+
+class MemoryProfileRepository(ProfileRepository):
+    def __init__(self):
+        self.rows: Dict[str, dict] = {}
+
+    async def get(self, user_id, fields=None):
+        return _select(self.rows.get(user_id), fields)
+
+    async def upsert(self, user_id, values):
+        self.rows.setdefault(user_id, {}).update(_stored(values), user_id=user_id)
+
+    async def insert_many(self, profiles):
+        for profile in profiles:
+            self.rows[profile["user_id"]] = _stored(profile)
+
+
+class MemoryRetirementProfileRepository(RetirementProfileRepository):
+    def __init__(self):
+        self.rows: Dict[str, dict] = {}
+
+    async def get(self, user_id, fields=None):
+        return _select(self.rows.get(user_id), fields)
+
+    async def upsert(self, user_id, values):
+        row = self.rows.setdefault(user_id, {"created_at": datetime.utcnow()})
+        row.update(_stored(values), user_id=user_id)
+
+
+class MemoryDocumentRepository(DocumentRepository):
+    def __init__(self):
+        self.rows: Dict[str, dict] = {}
+
+    def _matching(self, user_id, category=None):
+        rows = [
+            r for r in self.rows.values()
+            if r["user_id"] == user_id and (not category or r["category"] == category)
+        ]
+        return sorted(rows, key=lambda r: r["uploaded_at"], reverse=True)
+
+    async def get(self, document_id, user_id=None, fields=None):
+        row = self.rows.get(document_id)
+        if row is None or (user_id is not None and row["user_id"] != user_id):
+            return None
+        return _select(row, fields)
+
+    async def list(self, user_id, category=None, fields=None):
+        return [_select(r, fields) for r in self._matching(user_id, category)]
+
+    async def iterate(self, user_id, category=None, fields=None):
+        for row in self._matching(user_id, category):
+            yield _select(row, fields)
+
+    async def get_many(self, user_id, document_ids, fields=None):
+        wanted = set(document_ids)
+        return [_select(r, fields) for r in self.rows.values() if r["user_id"] == user_id and r["id"] in wanted]
+
+    async def insert(self, document):
+        if document["id"] in self.rows:
+            raise DuplicateKeyError(f"duplicate document id {document['id']}")
+        self.rows[document["id"]] = _stored(document)
+
+    async def insert_many(self, documents):
+        for document in documents:
+            await self.insert(document)
+
+    async def update(self, document_id, values):
+        row = self.rows.get(document_id)
+        if row is None:
+            return False
+        row.update(_stored(values))
+        return True
+
+    async def delete(self, document_id):
+        return self.rows.pop(document_id, None) is not None
+
+    async def delete_many(self, user_id, document_ids):
+        deleted = 0
+        for document_id in document_ids:
+            row = self.rows.get(document_id)
+            if row is not None and row["user_id"] == user_id:
+                del self.rows[document_id]
+                deleted += 1
+        return deleted
+
+    async def version(self, user_id, category=None):
+        rows = self._matching(user_id, category)
+        if not rows:
+            return "0"
+        latest = max(max(r["uploaded_at"], r.get("updated_at") or r["uploaded_at"]) for r in rows)
+        return f"{len(rows)}:{latest.isoformat()}"
+
+    async def category_summary(self, user_id, since):
+        groups: Dict[str, dict] = {}
+        for row in self._matching(user_id):
+            group = groups.setdefault(row["category"], {"category": row["category"], "count": 0, "recent": 0})
+            group["count"] += 1
+            group["recent"] += row["uploaded_at"] >= since
+        return list(groups.values())
+
+    async def usage_totals(self, user_id):
+        rows = self._matching(user_id)
+        return {"bytes": sum(r["file_size"] for r in rows), "files": len(rows)}
+
+
+class MemoryResetRepository(ResetRepository):
+    def __init__(self):
+        self.rows: List[dict] = []
+
+    async def create(self, email, token):
+        if not any(row["token"] == token for row in self.rows):
+            self.rows.append({"email": email, "token": token, "created_at": datetime.utcnow(), "used": False})
+
+    async def find_unused(self, token):
+        for row in self.rows:
+            if row["token"] == token and not row["used"]:
+                return dict(row)
+        return None
+
+    async def mark_used(self, token):
+        for row in self.rows:
+            if row["token"] == token:
+                row.update(used=True, used_at=datetime.utcnow())
+                return
+
+
+class MemoryUsageRepository(UsageRepository):
+    def __init__(self):
+        self.rows: Dict[str, Dict[str, int]] = {}
+
+    async def get(self, user_id):
+        row = self.rows.get(user_id)
+        return dict(row) if row is not None else None
+
+    async def initialize(self, user_id, usage):
+        self.rows.setdefault(user_id, dict(usage))
+
+    async def increment_within(self, user_id, size, files, max_bytes, max_files):
+        row = self.rows.get(user_id)
+        if row is None or row["bytes"] + size > max_bytes or row["files"] + files > max_files:
+            return False
+        row["bytes"] += size
+        row["files"] += files
+        return True
+
+    async def increment(self, user_id, size, files=0):
+        row = self.rows.get(user_id)
+        if row is not None:
+            row["bytes"] += size
+            row["files"] += files
+
+    async def set(self, user_id, usage):
+        self.rows[user_id] = dict(usage)
+
+
+def memory_repositories() -> Repositories:
+    return Repositories(
+        users=MemoryUserRepository(),
+        profiles=MemoryProfileRepository(),
+        retirement_profiles=MemoryRetirementProfileRepository(),
+        documents=MemoryDocumentRepository(),
+        resets=MemoryResetRepository(),
+        usage=MemoryUsageRepository(),
+    )
+
+
+# MONGO_* environment variable -> (client option, parser). Unset variables
+# keep the driver defaults (or whatever MONGO_URL specifies).
+_MONGO_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int),
+    "MONGO_MAX_CONNECTING": ("maxConnecting", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "MONGO_COMPRESSORS": ("compressors", str),  # e.g. "zstd,snappy,zlib"
+    "MONGO_WRITE_CONCERN": ("w", lambda v: int(v) if v.isdigit() else v),  # 1, 2, "majority"...
+    "MONGO_WRITE_TIMEOUT_MS": ("wTimeoutMS", int),
+    "MONGO_JOURNAL": ("journal", lambda v: v.lower() in ("1", "true", "yes")),
+}
+DEFAULT_MAX_POOL_SIZE = 100  # pymongo's default
+
+
+def mongo_client_options() -> Dict[str, object]:
+    """Motor client options from the MONGO_* environment variables"""
+    options = {}
+    for variable, (option, parse) in _MONGO_OPTIONS.items():
+        value = os.environ.get(variable)
+        if value:
+            options[option] = parse(value)
+    return options
+
+
+def create_repositories(**client_options) -> Repositories:
+    """Repositories for the configured DATABASE_BACKEND"""
+    backend = os.environ.get("DATABASE_BACKEND", "mongo")
+    if backend == "memory":
+        return memory_repositories()
+    if backend == "postgres":
+        # Mongo client options (pool listeners...) do not apply
+        from postgres_repositories import postgres_repositories
+        return postgres_repositories(os.environ["POSTGRES_URL"], os.environ.get("POSTGRES_SCHEMA"))
+    if backend != "mongo":
+        raise ValueError(f"Unknown DATABASE_BACKEND: {backend}")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"], **{**mongo_client_options(), **client_options})
+    return mongo_repositories(client, os.environ["DB_NAME"])
@@ -0,0 +1,319 @@
+"""
+Server-side retirement calculations.
+
+Python port of the formulas used by the React simulators and documented in
+CALCUL_RETRAITE_SALARIE.md / CALCUL_RETRAITE_FREELANCE.md. Functions are
+pure so they can be used from request handlers, worker processes and
+benchmarks alike.
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+MAX_QUARTERS = 172
+FULL_RATE = 0.50
+DECOTE_PER_QUARTER = 0.0125
+SURCOTE_PER_QUARTER = 0.0125
+MAX_DECOTE = 0.25
+LEGAL_AGE = 62
+FULL_RATE_AGE = 67
+POINT_VALUE = 1.4386  # Valeur du point Agirc-Arrco / RCI 2024
+RCI_POINT_COST = 12
+RCI_CONTRIBUTION_RATE = 0.07
+SCENARIO_AGES = (62, 64, 67)
+
+# Seuils de validation des trimestres SSI 2024
+QUARTER_THRESHOLDS = {1: 4020, 2: 8040, 3: 12060, 4: 16080}
+
+# Abattements micro selon activité
+MICRO_ABATEMENTS = {
+    "vente": 0.71,
+    "service_bic": 0.50,
+    "service_bnc": 0.34,
+    "liberal": 0.34,
+}
+
+RISK_PROFILES = {
+    "prudent": {"name": "Prudent", "annual_return": 0.015},
+    "equilibre": {"name": "Équilibré", "annual_return": 0.04},
+    "dynamique": {"name": "Dynamique", "annual_return": 0.07},
+}
+
+
+# ----------------------------------------------------------------------------
+# Quarters
+# ----------------------------------------------------------------------------
+
+def convert_to_months(duration: float, unit: str = "months") -> float:
+    """30 jours = 1 mois"""
+    return duration / 30 if unit == "days" else duration
+
+
+def unemployment_quarters(months: float) -> int:
+    """1 trimestre par période de 50 jours (≈ 1.67 mois)"""
+    return int(months // 1.67)
+
+
+def parental_leave_quarters(months: float) -> int:
+    """1 trimestre par 3 mois, maximum 12 trimestres"""
+    return min(int(months // 3), 12)
+
+
+def sick_leave_quarters(months: float) -> int:
+    """1 trimestre par 60 jours (≈ 2 mois)"""
+    return int(months // 2)
+
+
+def children_quarters(gender: Optional[str], children: int) -> int:
+    """8 trimestres par enfant pour les femmes"""
+    return children * 8 if gender == "F" and children > 0 else 0
+
+
+def required_quarters(birth_year: Optional[int]) -> int:
+    if birth_year is None or birth_year >= 1973:
+        return 172
+    if birth_year >= 1961:
+        return 168
+    return 166
+
+
+def private_quarters(
+    full_time_years: float = 0,
+    part_time_years: float = 0,
+    unemployment_months: float = 0,
+    parental_months: float = 0,
+    sick_leave_months: float = 0,
+    gender: Optional[str] = None,
+    children: int = 0,
+) -> Dict[str, float]:
+    """Trimestres d'un salarié du privé, par catégorie"""
+    worked = full_time_years * 4 + part_time_years * 2
+    breakdown = {
+        "worked": worked,
+        "unemployment": unemployment_quarters(unemployment_months),
+        "parental": parental_leave_quarters(parental_months),
+        "sick_leave": sick_leave_quarters(sick_leave_months),
+        "children": children_quarters(gender, children),
+    }
+    breakdown["total"] = min(sum(breakdown.values()), MAX_QUARTERS)
+    return breakdown
+
+
+def quarters_for_revenue(revenue: float) -> int:
+    """Trimestres validés par un revenu annuel (seuils SSI)"""
+    for quarters in (4, 3, 2, 1):
+        if revenue >= QUARTER_THRESHOLDS[quarters]:
+            return quarters
+    return 0
+
+
+def convert_micro_revenue(turnover: float, activity_type: Optional[str]) -> float:
+    """Revenu retraite d'un micro-entrepreneur après abattement forfaitaire"""
+    return turnover * (1 - MICRO_ABATEMENTS.get(activity_type, 0.50))
+
+
+# ----------------------------------------------------------------------------
+# Base pension
+# ----------------------------------------------------------------------------
+
+def best_years_average(amounts: Iterable[float], years: int = 25) -> float:
+    """SAM / revenu annuel moyen : moyenne des 25 meilleures années"""
+    best = sorted(amounts, reverse=True)[:years]
+    return sum(best) / len(best) if best else 0.0
+
+
+def pension_rate(age: int, quarters: float, required: int, surcote_age: int = LEGAL_AGE):
+    """Return ``(rate, decote, surcote)`` as fractions.
+
+    Salariés get the surcote from the legal age, SSI freelancers only from
+    the full-rate age (``surcote_age=FULL_RATE_AGE``).
+    """
+    rate, decote, surcote = FULL_RATE, 0.0, 0.0
+    if age >= LEGAL_AGE:
+        missing = max(0, required - quarters)
+        extra = max(0, quarters - required)
+        if missing > 0 and age < FULL_RATE_AGE:
+            decote = min(missing * DECOTE_PER_QUARTER, MAX_DECOTE)
+            rate = FULL_RATE * (1 - decote)
+        elif extra > 0 and age >= surcote_age:
+            surcote = extra * SURCOTE_PER_QUARTER
+            rate = FULL_RATE * (1 + surcote)
+    return rate, decote, surcote
+
+
+def base_pension(
+    average_income: float,
+    age: int,
+    quarters: float,
+    birth_year: Optional[int] = None,
+    surcote_age: int = LEGAL_AGE,
+) -> Dict[str, float]:
+    """Pension de base = revenu moyen × taux × (trimestres / trimestres requis)"""
+    required = required_quarters(birth_year)
+    rate, decote, surcote = pension_rate(age, quarters, required, surcote_age)
+    annual = average_income * rate * (quarters / required)
+    return {
+        "sam": average_income,
+        "rate": rate * 100,
+        "decote": decote * 100,
+        "surcote": surcote * 100,
+        "annual": annual,
+        "monthly": annual / 12,
+        "required_quarters": required,
+    }
+
+
+# ----------------------------------------------------------------------------
+# Complementary pension
+# ----------------------------------------------------------------------------
+
+def points_pension(points: float, point_value: float = POINT_VALUE) -> Dict[str, float]:
+    """Pension complémentaire par points (Agirc-Arrco ou RCI)"""
+    annual = points * point_value
+    return {"points": points, "point_value": point_value, "annual": annual, "monthly": annual / 12}
+
+
+def estimated_agirc_arrco(last_salary: float) -> Dict[str, float]:
+    """Estimation sans relevé de points : ~27% du dernier salaire mensuel"""
+    monthly = (last_salary / 12) * 0.27
+    return {"points": 0, "point_value": POINT_VALUE, "annual": monthly * 12, "monthly": monthly, "estimated": True}
+
+
+def rci_points(revenues: Iterable[float]) -> float:
+    """Points RCI : cotisation ≈ 7% du revenu, 1 point ≈ 12€"""
+    return sum(r * RCI_CONTRIBUTION_RATE / RCI_POINT_COST for r in revenues)
+
+
+# ----------------------------------------------------------------------------
+# Savings effort
+# ----------------------------------------------------------------------------
+
+def required_savings(
+    target_monthly_income: float,
+    current_pension: float,
+    years_until_retirement: float,
+    profile: str,
+    current_savings: float = 0,
+) -> Dict[str, float]:
+    """Versement mensuel nécessaire pour combler l'écart à l'objectif"""
+    monthly_gap = target_monthly_income - current_pension
+    if monthly_gap <= 0:
+        return {"monthly_contribution": 0, "total_capital": 0}
+
+    retirement_duration = 25
+    annual_return = RISK_PROFILES.get(profile, {}).get("annual_return", 0.03)
+    monthly_return = annual_return / 12
+
+    required_capital = monthly_gap * 12 * retirement_duration * 0.85
+    savings_projected = current_savings * (1 + annual_return) ** years_until_retirement
+    to_accumulate = max(0.0, required_capital - savings_projected)
+
+    n = years_until_retirement * 12
+    monthly_contribution = 0.0
+    if n > 0 and monthly_return > 0:
+        monthly_contribution = to_accumulate * monthly_return / ((1 + monthly_return) ** n - 1)
+    elif n > 0:
+        monthly_contribution = to_accumulate / n
+
+    return {
+        "monthly_gap": monthly_gap,
+        "required_capital": round(required_capital),
+        "current_savings_projected": round(savings_projected),
+        "capital_to_accumulate": round(to_accumulate),
+        "monthly_contribution": round(monthly_contribution),
+        "annual_return": annual_return * 100,
+    }
+
+
+# ----------------------------------------------------------------------------
+# Scenarios
+# ----------------------------------------------------------------------------
+
+def employee_scenarios(
+    current_age: int,
+    birth_year: Optional[int],
+    salaries: List[float],
+    quarters: float,
+    agirc_arrco_points: Optional[float] = None,
+    ages: Iterable[int] = SCENARIO_AGES,
+) -> List[Dict[str, float]]:
+    """Projection salarié du privé pour chaque âge de départ"""
+    sam = best_years_average(salaries)
+    last_salary = salaries[-1] if salaries else 0
+    complementary = (
+        points_pension(agirc_arrco_points) if agirc_arrco_points
+        else estimated_agirc_arrco(last_salary)
+    )
+    scenarios = []
+    for age in ages:
+        years_until = max(0, age - current_age)
+        total_quarters = min(quarters + years_until * 4, MAX_QUARTERS)
+        base = base_pension(sam, age, total_quarters, birth_year)
+        total_monthly = base["monthly"] + complementary["monthly"]
+        scenarios.append({
+            "age": age,
+            "yearsUntil": years_until,
+            "totalQuarters": total_quarters,
+            "basePension": base["monthly"],
+            "complementary": complementary["monthly"],
+            "totalMonthly": round(total_monthly),
+            "replacementRate": round(total_monthly * 12 / last_salary * 100) if last_salary > 0 else 0,
+            "details": {k: base[k] for k in ("sam", "rate", "decote", "surcote")},
+        })
+    return scenarios
+
+
+def freelance_scenarios(
+    current_age: int,
+    birth_year: Optional[int],
+    revenues: List[float],
+    quarters: float,
+    ages: Iterable[int] = SCENARIO_AGES,
+) -> List[Dict[str, float]]:
+    """Projection SSI + RCI pour chaque âge de départ"""
+    average = best_years_average(revenues)
+    last_revenue = revenues[-1] if revenues else 0
+    scenarios = []
+    for age in ages:
+        years_until = max(0, age - current_age)
+        total_quarters = min(quarters + years_until * 4, MAX_QUARTERS)
+        base = base_pension(average, age, total_quarters, birth_year, surcote_age=FULL_RATE_AGE)
+        # Future years are assumed to contribute at the last known revenue
+        complementary = points_pension(rci_points(list(revenues) + [last_revenue] * years_until))
+        total_monthly = base["monthly"] + complementary["monthly"]
+        scenarios.append({
+            "age": age,
+            "yearsUntil": years_until,
+            "totalQuarters": total_quarters,
+            "basePension": base["monthly"],
+            "complementary": complementary["monthly"],
+            "totalMonthly": round(total_monthly),
+            "replacementRate": round(total_monthly * 12 / last_revenue * 100) if last_revenue > 0 else 0,
+            "details": {k: base[k] for k in ("sam", "rate", "decote", "surcote")},
+        })
+    return scenarios
+
+
+def saved_simulation_estimates(simulation_data: Optional[Dict]) -> Dict[str, float]:
+    """Departure age, monthly pension and progress (% of the target income)
+    read from a simulation saved by the React simulators; the pension is 0
+    when the simulation has no result"""
+    projected_age = 65
+    estimated_pension = 0
+    savings_progress = 0
+    results = (simulation_data or {}).get("results")
+    if results:
+        if results.get("scenarios"):
+            first_scenario = results["scenarios"][0]
+            projected_age = first_scenario.get("age", 65)
+            estimated_pension = first_scenario.get("totalMonthly", 0)
+        elif "totalMonthly" in results:
+            estimated_pension = results.get("totalMonthly", 0)
+        if results.get("currentIncome", 0) > 0:
+            target = results.get("targetIncome", results["currentIncome"] * 0.7)
+            if estimated_pension > 0:
+                savings_progress = min(100, int((estimated_pension / target) * 100))
+    return {
+        "projected_age": projected_age,
+        "estimated_pension": estimated_pension,
+        "savings_progress": savings_progress,
+    }
@@ -0,0 +1,86 @@
+"""
+Fast JSON responses.
+
+``FastJSONResponse`` renders with orjson when it is installed (native
+datetime, UUID, enum and dataclass support) and falls back to a compact
+stdlib encoding otherwise. Handlers on hot paths return it directly with
+plain dicts, which also skips FastAPI's ``jsonable_encoder`` walk and the
+response_model re-validation; the response_model is kept on the route for
+the OpenAPI schema only.
+
+``trusted`` builds a model from a row read from our own collections without
+running validation again: the data was validated when it was written.
+"""
+
+import json
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Dict, Type, TypeVar
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+def _model_dict(obj: BaseModel) -> dict:
+    dump = getattr(obj, "model_dump", None)
+    return dump() if dump is not None else obj.dict()
+
+
+def _orjson_default(obj: Any):
+    if isinstance(obj, BaseModel):
+        return _model_dict(obj)
+    # ObjectId, Decimal, ...
+    return str(obj)
+
+
+def _json_default(obj: Any):
+    if isinstance(obj, BaseModel):
+        return _model_dict(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    # UUID, ObjectId, Decimal, ...
+    return str(obj)
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content, default=_json_default, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def model_fields(model: Type[BaseModel]) -> Dict[str, Any]:
+    fields = getattr(model, "model_fields", None)
+    return fields if fields is not None else model.__fields__
+
+
+def project(model: Type[BaseModel], row: dict) -> dict:
+    """Keep only the keys of ``row`` that are fields of ``model``"""
+    return {name: row[name] for name in model_fields(model) if name in row}
+
+
+def trusted(model: Type[Model], row: dict) -> Model:
+    """Model instance from a stored row, without re-validation (defaults still apply)"""
+    construct = getattr(model, "model_construct", None) or model.construct
+    return construct(**project(model, row))
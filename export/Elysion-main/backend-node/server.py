@@ -1,39 +1,138 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
-from fastapi import UploadFile, File
-from fastapi.responses import FileResponse
-import aiofiles
-import shutil
+from fastapi import UploadFile, File, Request, Response, Header
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from fastapi.routing import APIRoute
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
+from pymongo.errors import DuplicateKeyError
 from typing import List, Optional
 import uuid
+import hashlib
+import hmac
 from datetime import datetime, timedelta
 import jwt
 from enum import Enum
+from urllib.parse import quote
+from storage import get_storage, new_storage_key, document_location, close_storages, CHUNK_SIZE
+import document_search
+import encryption
+import career_statement
+import reconciliation
+import quotas
+import metrics
+import profiling
+import workers
+import health
+import jobs
+import analytics
+import outbox
+import password_reset
+import retirement
+import user_export
+import user_import
+import conditional
+from passwords import get_password_hash, verify_password
+from serialization import FastJSONResponse, dumps, loads, model_fields, project, trusted
+from repositories import Repositories, create_repositories
+from cache import Cache, create_cache
+from changes import ChangeFeed, RETRY_FRAME
+from zip_stream import stream_zip, unique_name
+from compression import CompressionMiddleware
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
 # Security
-import hashlib
 security = HTTPBearer()
 SECRET_KEY = "elysion-secret-key-2024"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Settings of features built on Mongo-only collections: set with another
+# DATABASE_BACKEND, they fail the startup instead of being ignored
+MONGO_ONLY_SETTINGS = ('JOB_QUEUES', 'RECONCILE_INTERVAL_SECONDS', 'ANALYTICS_REBUILD_INTERVAL_SECONDS')
+
+def check_backend_features(repos: Repositories):
+    if repos.db is not None:
+        return
+    configured = [name for name in MONGO_ONLY_SETTINGS if os.environ.get(name, '0') not in ('', '0')]
+    if configured:
+        raise RuntimeError(f"{', '.join(configured)}: requires DATABASE_BACKEND=mongo")
+    logger.warning(
+        "Without DATABASE_BACKEND=mongo, document search, career statement parsing, background exports, "
+        "analytics, storage reconciliation, the job queue and the email outbox are unavailable"
+    )
+    # Reset and invitation emails are then sent directly: check SMTP now
+    outbox.create_transport()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Database access goes through repositories (Motor, asyncpg with
+    # DATABASE_BACKEND=postgres, or in memory with DATABASE_BACKEND=memory);
+    # handlers get them from get_repositories
+    repos = create_repositories(event_listeners=[metrics.MongoPoolListener()])
+    app.state.repositories = repos
+    app.state.cache = create_cache()
+    app.state.changes = ChangeFeed(repos.db)
+    app.state.started = False
+    try:
+        check_backend_features(repos)
+        try:
+            await repos.ensure_indexes()
+            if repos.db is not None:
+                await document_search.ensure_indexes(repos.db)
+                await career_statement.ensure_indexes(repos.db)
+                await jobs.ensure_indexes(repos.db)
+                await outbox.ensure_indexes(repos.db)
+                await user_export.ensure_indexes(repos.db)
+            await app.state.changes.start()
+            await health.warm_pool(repos)
+        except Exception as e:
+            # Serve anyway: readiness keeps reporting Mongo as unreachable
+            logger.error(f"Database startup failed: {e}")
+
+        workers.spawn(metrics.monitor_event_loop())
+        workers.spawn(app.state.cache.listen_for_invalidations())
+        workers.spawn(app.state.changes.heartbeat())
+        workers.spawn(app.state.changes.follow())
+        interval = float(os.environ.get('RECONCILE_INTERVAL_SECONDS', '0'))
+        if interval > 0 and repos.db is not None:
+            workers.spawn(reconciliation.run_periodically(repos.db, interval))
+        # Set JOBS_IN_PROCESS=0 when the queues and the outbox are run by job_worker.py instead
+        if repos.db is not None and os.environ.get('JOBS_IN_PROCESS', '1') != '0':
+            queues = jobs.parse_queues(os.environ.get('JOB_QUEUES', jobs.DEFAULT_QUEUES))
+            workers.spawn(jobs.JobWorker(repos.db, queues).run())
+            workers.spawn(outbox.OutboxSender(repos.db).run())
+        interval = float(os.environ.get('ANALYTICS_REBUILD_INTERVAL_SECONDS', '0'))
+        if interval > 0 and repos.db is not None:
+            workers.spawn(analytics.rebuild_periodically(repos.db, interval))
+
+        app.state.started = True
+        yield
+    finally:
+        # Drain first: readiness fails while connections are still open
+        app.state.started = False
+        app.state.changes.close()
+        await workers.cancel_background_tasks()
+        await app.state.cache.close()
+        await repos.close()
+        await close_storages()
+        workers.shutdown()
 
 # Create the main app without a prefix
-app = FastAPI(title="Elysion Retirement Platform API")
+app = FastAPI(
+    title="Elysion Retirement Platform API",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan
+)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -94,6 +193,13 @@ class ProfileCompletion(BaseModel):
     gross_remuneration: Optional[str] = None
     pension_regime: Optional[str] = None
 
+class ImportedUserRow(BaseModel):
+    """One line of a bulk import; questionnaire fields are validated by ProfileCompletion"""
+    email: EmailStr
+    full_name: str
+    user_type: UserType = UserType.EMPLOYEE
+    password: Optional[str] = None
+
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
@@ -120,14 +226,6 @@ class DashboardData(BaseModel):
     recent_documents: List[dict] = []
 
 # Utility Functions
-def get_password_hash(password: str) -> str:
-    # Simple SHA-256 hash for MVP (in production, use bcrypt or argon2)
-    return hashlib.sha256((password + "elysion_salt").encode()).hexdigest()
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    # Verify against SHA-256 hash
-    return get_password_hash(plain_password) == hashed_password
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -138,9 +236,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def create_reset_token(email: str) -> str:
-    # Create a reset token valid for 1 hour
-    expire = datetime.utcnow() + timedelta(hours=1)
+def create_reset_token(email: str, valid_for: timedelta = timedelta(hours=1)) -> str:
+    # Create a reset token valid for 1 hour (longer for invitations)
+    expire = datetime.utcnow() + valid_for
     to_encode = {"email": email, "exp": expire, "type": "reset"}
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
@@ -155,48 +253,111 @@ def verify_reset_token(token: str) -> Optional[str]:
     except jwt.PyJWTError:
         return None
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    credentials_exception = HTTPException(
+def user_id_from_authorization(authorization: Optional[str]) -> Optional[str]:
+    """User id from an "Authorization: Bearer <jwt>" header, without hitting the database"""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    return payload.get("sub")
+
+def get_repositories(request: Request) -> Repositories:
+    return request.app.state.repositories
+
+def get_cache(request: Request) -> Cache:
+    return request.app.state.cache
+
+def get_changes(request: Request) -> ChangeFeed:
+    return request.app.state.changes
+
+async def cached_json(cache: Cache, user_id: str, kind: str, build) -> Response:
+    """JSON response for ``kind``, from the cache or rendered from ``await build()``"""
+    async def load():
+        return dumps(await build())
+    return Response(content=await cache.get_or_load(user_id, kind, load), media_type="application/json")
+
+async def conditional_json(
+    request: Request, cache: Cache, user_id: str, kind: str, version, build, cached: bool = True
+) -> Response:
+    """JSON response with an ETag derived from ``await version()``: 304 when
+    If-None-Match matches, before the body is loaded or serialized"""
+    etag = await cache.get_or_load(
+        user_id, f"{kind}:etag", lambda: conditional.version_etag(version),
+        encode=str.encode, decode=bytes.decode
+    )
+    if conditional.etag_matches(request.headers.get("if-none-match"), etag):
+        return conditional.not_modified(etag)
+    if cached:
+        response = await cached_json(cache, user_id, kind, build)
+    else:
+        response = FastJSONResponse(await build())
+    return conditional.with_etag(response, etag)
+
+def require_mongo(repos: Repositories):
+    """Motor database for features built on Mongo-only collections (text index, career cache)"""
+    if repos.db is None:
+        raise HTTPException(status_code=503, detail="Fonctionnalité indisponible sur ce serveur")
+    return repos.db
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_access_token(token: str, token_type: Optional[str] = None) -> dict:
+    """Claims of a valid access token (``sub`` is the user id); 401 otherwise.
+
+    Access tokens carry no ``type``: single-purpose tokens (``changes``
+    stream tickets) are only accepted where ``token_type`` asks for them.
+    """
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.PyJWTError:
-        raise credentials_exception
-    
-    user = await db.users.find_one({"id": user_id})
+        raise credentials_exception()
+    if payload.get("sub") is None or payload.get("type") != token_type:
+        raise credentials_exception()
+    return payload
+
+async def load_principal(repos: Repositories, cache: Cache, user_id: str) -> User:
+    """Authenticated user, from the cache or the database; 401 when gone"""
+    async def load_user():
+        user = await repos.users.get(user_id, model_fields(User))
+        # Stored users were validated on write
+        return trusted(User, user) if user is not None else None
+    
+    user = await cache.get_or_load(
+        user_id, "principal", load_user, encode=dumps, decode=lambda raw: User(**loads(raw))
+    )
     if user is None:
-        raise credentials_exception
-    return User(**user)
+        raise credentials_exception()
+    return user
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache)
+):
+    payload = decode_access_token(credentials.credentials)
+    return await load_principal(repos, cache, payload["sub"])
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Internal endpoints: X-Admin-Token must match ADMIN_TOKEN (disabled when unset)"""
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
 
 # Generate mock retirement data based on user profile
 def generate_mock_retirement_data(user: User, profile: Optional[RetirementProfile] = None):
     recommendations = []
-    projected_age = 65
-    estimated_pension = 0
-    savings_progress = 0
     
     # Use real data from profile if available (profile is a dict from MongoDB)
-    if profile and profile.get('simulation_data'):
-        sim_data = profile.get('simulation_data')
-        # Try to get real values from simulation
-        if 'results' in sim_data:
-            results = sim_data['results']
-            if 'scenarios' in results and len(results['scenarios']) > 0:
-                first_scenario = results['scenarios'][0]
-                projected_age = first_scenario.get('age', 65)
-                estimated_pension = first_scenario.get('totalMonthly', 0)
-            elif 'totalMonthly' in results:
-                estimated_pension = results.get('totalMonthly', 0)
-            if 'currentIncome' in results and results['currentIncome'] > 0:
-                target = results.get('targetIncome', results['currentIncome'] * 0.7)
-                if estimated_pension > 0:
-                    savings_progress = min(100, int((estimated_pension / target) * 100))
+    estimates = retirement.saved_simulation_estimates(profile and profile.get('simulation_data'))
+    projected_age = estimates["projected_age"]
+    estimated_pension = estimates["estimated_pension"]
+    savings_progress = estimates["savings_progress"]
     
     # Fallback to mock data based on user type
     if estimated_pension == 0:
@@ -262,9 +423,9 @@ def generate_mock_retirement_data(user: User, profile: Optional[RetirementProfil
 
 # Authentication Routes
 @api_router.post("/auth/register", response_model=Token)
-async def register(user_data: UserCreate):
+async def register(user_data: UserCreate, repos: Repositories = Depends(get_repositories)):
     # Check if user already exists
-    existing_user = await db.users.find_one({"email": user_data.email})
+    existing_user = await repos.users.get_by_email(user_data.email, ["id"])
     if existing_user:
         raise HTTPException(
             status_code=400,
@@ -282,7 +443,16 @@ async def register(user_data: UserCreate):
     # Store user with hashed password
     user_dict = user.dict()
     user_dict["hashed_password"] = hashed_password
-    await db.users.insert_one(user_dict)
+    try:
+        await repos.users.create(user_dict)
+    except DuplicateKeyError:
+        # Registered concurrently (the email index is unique)
+        raise HTTPException(
+            status_code=400,
+            detail="Email already registered"
+        )
+    await analytics.record_event(repos.db, {f"signups.{user.user_type.value}": 1})
+    await analytics.user_changed(repos.db, user.id)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -290,12 +460,12 @@ async def register(user_data: UserCreate):
         data={"sub": user.id}, expires_delta=access_token_expires
     )
     
-    return Token(access_token=access_token, user=user)
+    return FastJSONResponse({"access_token": access_token, "token_type": "bearer", "user": user})
 
 @api_router.post("/auth/login", response_model=Token)
-async def login(user_data: UserLogin):
+async def login(user_data: UserLogin, repos: Repositories = Depends(get_repositories)):
     # Find user
-    user_doc = await db.users.find_one({"email": user_data.email})
+    user_doc = await repos.users.get_by_email(user_data.email)
     if not user_doc or not verify_password(user_data.password, user_doc["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -303,7 +473,9 @@ async def login(user_data: UserLogin):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = User(**user_doc)
+    user = trusted(User, user_doc)
+    # For the inactive-account purge (maintenance.py)
+    await repos.users.update(user.id, {"last_login_at": datetime.utcnow()})
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -311,38 +483,23 @@ async def login(user_data: UserLogin):
         data={"sub": user.id}, expires_delta=access_token_expires
     )
     
-    return Token(access_token=access_token, user=user)
+    return FastJSONResponse({"access_token": access_token, "token_type": "bearer", "user": user})
 
 @api_router.post("/auth/forgot-password")
-async def forgot_password(request: ForgotPasswordRequest):
-    # Check if user exists
-    user = await db.users.find_one({"email": request.email})
-    
-    if not user:
-        # For security, don't reveal if email exists or not
-        return {"message": "Si cette adresse email est enregistrée, vous recevrez un lien de réinitialisation"}
-    
-    # Generate reset token
+async def forgot_password(request: ForgotPasswordRequest, repos: Repositories = Depends(get_repositories)):
+    # The same work whether the account exists or not, so neither the answer
+    # nor its timing reveals registered emails: the lookup and the email
+    # happen in a background job
     reset_token = create_reset_token(request.email)
+    if repos.db is not None:
+        await password_reset.request_reset(repos.db, request.email, reset_token)
+    else:
+        workers.spawn(password_reset.send_without_outbox(repos, request.email, reset_token))
     
-    # In production, send email here. For MVP, we'll return the reset link
-    reset_link = f"https://retire-planner-13.preview.emergentagent.com/reset-password?token={reset_token}"
-    
-    # Store reset token in database (optional for tracking)
-    await db.password_resets.insert_one({
-        "email": request.email,
-        "token": reset_token,
-        "created_at": datetime.utcnow(),
-        "used": False
-    })
-    
-    return {
-        "message": "Si cette adresse email est enregistrée, vous recevrez un lien de réinitialisation",
-        "reset_link": reset_link  # Remove this in production
-    }
+    return {"message": "Si cette adresse email est enregistrée, vous recevrez un lien de réinitialisation"}
 
 @api_router.post("/auth/reset-password")
-async def reset_password(request: ResetPasswordRequest):
+async def reset_password(request: ResetPasswordRequest, repos: Repositories = Depends(get_repositories)):
     # Verify reset token
     email = verify_reset_token(request.token)
     
@@ -353,10 +510,7 @@ async def reset_password(request: ResetPasswordRequest):
         )
     
     # Check if token was already used
-    reset_record = await db.password_resets.find_one({
-        "token": request.token,
-        "used": False
-    })
+    reset_record = await repos.resets.find_unused(request.token)
     
     if not reset_record:
         raise HTTPException(
@@ -367,27 +521,27 @@ async def reset_password(request: ResetPasswordRequest):
     # Update password
     hashed_password = get_password_hash(request.new_password)
     
-    result = await db.users.update_one(
-        {"email": email},
-        {"$set": {"hashed_password": hashed_password}}
-    )
+    changed = await repos.users.set_password(email, hashed_password)
     
-    if result.modified_count == 0:
+    if not changed:
         raise HTTPException(
             status_code=400,
             detail="Erreur lors de la mise à jour du mot de passe"
         )
     
     # Mark token as used
-    await db.password_resets.update_one(
-        {"token": request.token},
-        {"$set": {"used": True, "used_at": datetime.utcnow()}}
-    )
+    await repos.resets.mark_used(request.token)
     
     return {"message": "Mot de passe réinitialisé avec succès"}
 
 @api_router.post("/profile/complete")
-async def complete_profile(profile_data: ProfileCompletion, current_user: User = Depends(get_current_user)):
+async def complete_profile(
+    profile_data: ProfileCompletion,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache),
+    changes: ChangeFeed = Depends(get_changes)
+):
     # Verify the user_id matches current user
     if profile_data.user_id != current_user.id:
         raise HTTPException(
@@ -405,64 +559,97 @@ async def complete_profile(profile_data: ProfileCompletion, current_user: User =
     profile_dict = {k: v for k, v in profile_dict.items() if v is not None}
     
     # Update or create profile
-    existing_profile = await db.user_profiles.find_one({"user_id": current_user.id})
-    
-    if existing_profile:
-        await db.user_profiles.update_one(
-            {"user_id": current_user.id},
-            {"$set": profile_dict}
-        )
-    else:
-        await db.user_profiles.insert_one(profile_dict)
+    await repos.profiles.upsert(current_user.id, profile_dict)
     
     # Mark user as having completed profile
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$set": {"profile_completed": True, "profile_completed_at": datetime.utcnow()}}
+    await repos.users.update(
+        current_user.id,
+        {"profile_completed": True, "profile_completed_at": datetime.utcnow()}
     )
+    await cache.invalidate(current_user.id)
+    await changes.publish(current_user.id, "profile.updated")
+    await analytics.record_event(repos.db, {f"profiles_completed.{getattr(current_user.user_type, 'value', current_user.user_type)}": 1})
+    await analytics.user_changed(repos.db, current_user.id)
     
     return {"message": "Profil complété avec succès"}
 
 @api_router.get("/profile")
-async def get_user_profile_complete(current_user: User = Depends(get_current_user)):
-    # Get user profile data
-    profile = await db.user_profiles.find_one({"user_id": current_user.id})
+async def get_user_profile_complete(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache)
+):
+    async def version():
+        profile = await repos.profiles.get(current_user.id, ["last_updated"])
+        return [dumps(current_user), profile is not None, profile and profile.get("last_updated")]
     
-    return {
-        "user": current_user,
-        "profile": profile,
-        "profile_completed": profile is not None
-    }
+    async def build():
+        # Get user profile data
+        profile = await repos.profiles.get(current_user.id)
+        
+        return {
+            "user": current_user,
+            "profile": profile,
+            "profile_completed": profile is not None
+        }
+    
+    return await conditional_json(request, cache, current_user.id, "profile", version, build, cached=False)
 
 # Dashboard Routes
 @api_router.get("/dashboard")
-async def get_dashboard(current_user: User = Depends(get_current_user)):
-    # Get retirement profile (raw dict from MongoDB)
-    retirement_profile = await db.retirement_profiles.find_one({"user_id": current_user.id})
+async def get_dashboard(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache)
+):
+    async def build():
+        # Get retirement profile (raw dict from MongoDB)
+        retirement_profile = await repos.retirement_profiles.get(current_user.id, ["simulation_data"])
+        
+        # Generate data based on user type and simulation data
+        dashboard_data = generate_mock_retirement_data(current_user, retirement_profile)
+        
+        # Return simple dict response (avoid Pydantic validation issues)
+        return {
+            "user": {
+                "id": current_user.id,
+                "email": current_user.email,
+                "full_name": current_user.full_name,
+                "user_type": current_user.user_type
+            },
+            "retirement_profile": None,  # Skip complex Pydantic conversion
+            **dashboard_data
+        }
     
-    # Generate data based on user type and simulation data
-    dashboard_data = generate_mock_retirement_data(current_user, retirement_profile)
+    async def version():
+        profile = await repos.retirement_profiles.get(current_user.id, ["last_simulation_at"])
+        return [dumps(current_user), profile and profile.get("last_simulation_at")]
     
-    # Return simple dict response (avoid Pydantic validation issues)
-    return {
-        "user": {
-            "id": current_user.id,
-            "email": current_user.email,
-            "full_name": current_user.full_name,
-            "user_type": current_user.user_type
-        },
-        "retirement_profile": None,  # Skip complex Pydantic conversion
-        **dashboard_data
-    }
+    return await conditional_json(request, cache, current_user.id, "dashboard", version, build)
 
 @api_router.get("/user/profile")
-async def get_user_profile(current_user: User = Depends(get_current_user)):
-    return current_user
+async def get_user_profile(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    cache: Cache = Depends(get_cache)
+):
+    async def version():
+        return [dumps(current_user)]
+    
+    async def build():
+        return current_user
+    
+    return await conditional_json(request, cache, current_user.id, "user", version, build, cached=False)
 
 @api_router.put("/user/profile")
 async def update_user_profile(
     profile_update: dict,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache),
+    changes: ChangeFeed = Depends(get_changes)
 ):
     """Update user profile information"""
     # Fields that can be updated
@@ -475,17 +662,18 @@ async def update_user_profile(
     update_data['updated_at'] = datetime.utcnow()
     
     # Update user
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$set": update_data}
-    )
+    await repos.users.update(current_user.id, update_data)
+    await cache.invalidate(current_user.id)
+    await changes.publish(current_user.id, "profile.updated")
     
     return {"message": "Profil mis à jour avec succès"}
 
 @api_router.put("/user/password")
 async def change_password(
     password_data: dict,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache)
 ):
     """Change user password"""
     current_password = password_data.get('current_password')
@@ -495,24 +683,80 @@ async def change_password(
         raise HTTPException(status_code=400, detail="Mot de passe requis")
     
     # Verify current password
-    user = await db.users.find_one({"id": current_user.id})
+    user = await repos.users.get(current_user.id, ["hashed_password"])
     if not user or not verify_password(current_password, user['hashed_password']):
         raise HTTPException(status_code=400, detail="Mot de passe actuel incorrect")
     
     # Update password
     new_hashed = get_password_hash(new_password)
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$set": {"hashed_password": new_hashed, "updated_at": datetime.utcnow()}}
-    )
+    await repos.users.update(current_user.id, {"hashed_password": new_hashed, "updated_at": datetime.utcnow()})
+    await cache.invalidate(current_user.id)
     
     return {"message": "Mot de passe modifié avec succès"}
 
+# Data portability
+@api_router.get("/user/export")
+async def export_user_data(
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories)
+):
+    """Stream a ZIP of everything stored about the user (NDJSON + original files)"""
+    return StreamingResponse(
+        user_export.stream_export(repos, current_user.id),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(user_export.archive_name(datetime.utcnow()))}
+    )
+
+@api_router.post("/user/exports", status_code=202)
+async def request_user_export(
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories)
+):
+    """Build the export in the background (large accounts); the user is emailed when it is ready"""
+    export = await user_export.request_export(require_mongo(repos), current_user.id)
+    return FastJSONResponse(export, status_code=202)
+
+@api_router.get("/user/exports/{export_id}")
+async def get_user_export(
+    export_id: str,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories)
+):
+    export = await user_export.get_export(require_mongo(repos), current_user.id, export_id)
+    if not export:
+        raise HTTPException(status_code=404, detail="Export non trouvé")
+    return FastJSONResponse({k: v for k, v in export.items() if k not in ("storage_backend", "storage_key")})
+
+@api_router.get("/user/exports/{export_id}/download")
+async def download_user_export(
+    export_id: str,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories)
+):
+    export = await user_export.get_export(require_mongo(repos), current_user.id, export_id)
+    if not export:
+        raise HTTPException(status_code=404, detail="Export non trouvé")
+    if export["status"] in ("pending", "running"):
+        raise HTTPException(status_code=409, detail="Export pas encore disponible")
+    if export["status"] != "ready":
+        raise HTTPException(status_code=410, detail="Export expiré ou en échec")
+    return StreamingResponse(
+        user_export.open_archive(export),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": content_disposition(user_export.archive_name(export["finished_at"])),
+            "Content-Length": str(export["size"]),
+        }
+    )
+
 # Save simulation results
 @api_router.post("/simulation/save")
 async def save_simulation(
     simulation_data: dict,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache),
+    changes: ChangeFeed = Depends(get_changes)
 ):
     """Save simulation results to user's retirement profile"""
     try:
@@ -524,40 +768,178 @@ async def save_simulation(
             "updated_at": datetime.utcnow()
         }
         
-        # Update or create retirement profile
-        existing = await db.retirement_profiles.find_one({"user_id": current_user.id})
-        
-        if existing:
-            await db.retirement_profiles.update_one(
-                {"user_id": current_user.id},
-                {"$set": profile_data}
-            )
-        else:
-            profile_data["created_at"] = datetime.utcnow()
-            await db.retirement_profiles.insert_one(profile_data)
+        # Update or create retirement profile (created_at set on creation)
+        await repos.retirement_profiles.upsert(current_user.id, profile_data)
+        await cache.invalidate(current_user.id)
+        await changes.publish(current_user.id, "simulation.saved")
+        await analytics.record_event(repos.db, {f"simulations.{getattr(current_user.user_type, 'value', current_user.user_type)}": 1})
+        await analytics.user_changed(repos.db, current_user.id)
         
         return {"message": "Simulation sauvegardée avec succès", "success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/simulation/latest")
-async def get_latest_simulation(current_user: User = Depends(get_current_user)):
+async def get_latest_simulation(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache)
+):
     """Get user's latest simulation"""
-    profile = await db.retirement_profiles.find_one({"user_id": current_user.id})
+    async def build():
+        profile = await repos.retirement_profiles.get(current_user.id, ["simulation_data", "last_simulation_at"])
+        
+        if not profile or "simulation_data" not in profile:
+            return {"simulation": None}
+        
+        return {
+            "simulation": profile.get("simulation_data"),
+            "saved_at": profile.get("last_simulation_at")
+        }
     
-    if not profile or "simulation_data" not in profile:
-        return {"simulation": None}
+    async def version():
+        profile = await repos.retirement_profiles.get(current_user.id, ["last_simulation_at"])
+        return [profile and profile.get("last_simulation_at")]
     
+    return await conditional_json(request, cache, current_user.id, "simulation", version, build)
+
+# Change events, so open tabs refetch instead of polling (see changes.py)
+MAX_STREAMS_PER_USER = int(os.environ.get('CHANGES_MAX_PER_USER', '10'))
+STREAM_TICKET_SECONDS = int(os.environ.get('CHANGES_TICKET_SECONDS', '60'))
+
+def create_stream_ticket(user_id: str, session_expires: int) -> str:
+    """Short-lived token that only opens a change stream; the stream itself
+    lasts until the access token it was issued for expires"""
+    expire = datetime.utcnow() + timedelta(seconds=STREAM_TICKET_SECONDS)
+    to_encode = {"sub": user_id, "type": "changes", "exp": expire, "session_exp": session_expires}
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+@api_router.post("/changes/ticket")
+async def create_changes_ticket(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: User = Depends(get_current_user)
+):
+    """Ticket for ``GET /api/changes?ticket=``: EventSource cannot set an
+    Authorization header, and the access token must not end up in URLs
+    (access logs, proxies, browser history)"""
+    payload = decode_access_token(credentials.credentials)
     return {
-        "simulation": profile.get("simulation_data"),
-        "saved_at": profile.get("last_simulation_at")
+        "ticket": create_stream_ticket(current_user.id, payload["exp"]),
+        "expires_in": STREAM_TICKET_SECONDS
     }
 
+@api_router.get("/changes")
+async def stream_changes(
+    ticket: Optional[str] = None,
+    last_event_id: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache),
+    changes: ChangeFeed = Depends(get_changes)
+):
+    """Server-sent ``change`` events for the current user.
+
+    Browsers open it with a ticket from ``POST /api/changes/ticket``, other
+    clients may send their Authorization header. A new EventSource cannot
+    send Last-Event-ID: it may be passed as ``?last_event_id=`` instead.
+    The stream ends when the session's access token expires.
+    """
+    if ticket:
+        payload = decode_access_token(ticket, token_type="changes")
+        expires = payload.get("session_exp")
+    elif authorization and authorization.lower().startswith("bearer "):
+        payload = decode_access_token(authorization[7:])
+        expires = payload.get("exp")
+    else:
+        raise credentials_exception()
+    user = await load_principal(repos, cache, payload["sub"])
+    if changes.connections(user.id) >= MAX_STREAMS_PER_USER:
+        raise HTTPException(status_code=429, detail="Trop de connexions ouvertes")
+    
+    async def events():
+        # Subscribed before the replay: an event published meanwhile may
+        # come twice, never not at all
+        subscription = changes.subscribe(user.id, expires)
+        try:
+            yield RETRY_FRAME
+            await changes.replay(subscription, last_event_id_header or last_event_id)
+            async for data in subscription.frames():
+                yield data
+        finally:
+            changes.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Basic Routes
 @api_router.get("/")
 async def root():
     return {"message": "Elysion Retirement Platform API"}
 
+# Internal Routes
+@api_router.get("/internal/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Request profiles captured by the sampling profiler, newest first"""
+    return {"profiles": await asyncio.to_thread(profiling.profiler.list_profiles)}
+
+@api_router.get("/internal/analytics", dependencies=[Depends(require_admin)])
+async def get_analytics(repos: Repositories = Depends(get_repositories)):
+    """Platform-wide numbers, read from the precomputed rollups"""
+    return FastJSONResponse(await analytics.overview(require_mongo(repos)))
+
+@api_router.get("/internal/analytics/daily", dependencies=[Depends(require_admin)])
+async def get_daily_analytics(days: int = 30, repos: Repositories = Depends(get_repositories)):
+    """Signups, completed profiles, simulations and uploads per day"""
+    days = max(1, min(days, 366))
+    return FastJSONResponse({"days": await analytics.daily(require_mongo(repos), days)})
+
+@api_router.post("/internal/analytics/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_analytics(repos: Repositories = Depends(get_repositories)):
+    """Recompute the totals from every user (repairs drift, backfills a new deployment)"""
+    queued = await analytics.request_rebuild(require_mongo(repos))
+    return {"queued": queued}
+
+IMPORT_PROFILE_FIELDS = [name for name in model_fields(ProfileCompletion) if name != "user_id"]
+
+def prepare_imported_user(row: dict) -> user_import.ImportedUser:
+    data = ImportedUserRow(**row)
+    user = User(email=data.email, full_name=data.full_name, user_type=data.user_type)
+    answers = {name: row[name] for name in IMPORT_PROFILE_FIELDS if name in row}
+    profile = None
+    if answers:
+        # Prefilled answers: the user still completes the questionnaire
+        profile = ProfileCompletion(user_id=user.id, **answers).dict(exclude_none=True)
+        profile["last_updated"] = datetime.utcnow()
+    return user_import.ImportedUser(user.dict(), profile, data.password)
+
+@api_router.post("/internal/users/import", dependencies=[Depends(require_admin)])
+async def import_users(file: UploadFile = File(...), repos: Repositories = Depends(get_repositories)):
+    """Create users in bulk from a CSV or NDJSON file, with a per-line report (see user_import.py)"""
+    kind = user_import.file_format(file.filename, file.content_type)
+    if kind is None:
+        raise HTTPException(status_code=400, detail="Format non supporté : fichier CSV ou NDJSON attendu")
+    invite_valid_for = timedelta(hours=password_reset.INVITE_VALID_HOURS)
+    report = await user_import.import_users(
+        repos, user_import.read_rows(file.file, kind), prepare_imported_user,
+        lambda email: create_reset_token(email, invite_valid_for)
+    )
+    return FastJSONResponse(report)
+
+@api_router.get("/internal/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """Collapsed stacks of one profile (input for flamegraph.pl / speedscope)"""
+    content = await asyncio.to_thread(profiling.profiler.read_profile, profile_id)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Profil non trouvé")
+    return Response(content=content, media_type="text/plain; charset=utf-8")
+
+# Innermost, so the metrics count the bytes actually sent
+app.add_middleware(CompressionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -565,6 +947,28 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Prometheus scrape endpoint (outside /api, optionally protected by METRICS_TOKEN)
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    token = os.environ.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {token}"):
+        raise HTTPException(status_code=401, detail="Non autorisé")
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# Orchestrator probes (outside /api, no authentication)
+@app.get("/health/live", include_in_schema=False)
+async def liveness():
+    return {"status": "ok"}
+
+@app.get("/health/ready", include_in_schema=False)
+async def readiness(request: Request):
+    ready, details = await health.readiness(
+        request.app.state.repositories, getattr(request.app.state, "started", False)
+    )
+    return FastJSONResponse(details, status_code=200 if ready else 503)
 
 # Configure logging
 logging.basicConfig(
@@ -579,8 +983,12 @@ logger = logging.getLogger(__name__)
 # ============================================
 
 # Create uploads directory if it doesn't exist
+# (legacy flat layout; new files go through the configured storage backend)
 UPLOAD_DIR = ROOT_DIR / "uploads" / "documents"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', '50'))
+MULTIPART_OVERHEAD = 16 * 1024
 
 # Document Categories
 class DocumentCategory(str, Enum):
@@ -598,7 +1006,11 @@ class Document(BaseModel):
     original_filename: str
     category: DocumentCategory
     file_size: int  # in bytes
-    file_path: str
+    storage_backend: str = "local"
+    storage_key: Optional[str] = None
+    file_path: Optional[str] = None  # legacy absolute path in UPLOAD_DIR
+    content_hash: Optional[str] = None  # sha256 of the file content
+    encryption: Optional[dict] = None  # wrapped data key when encrypted at rest
     uploaded_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -606,6 +1018,9 @@ class DocumentUpdate(BaseModel):
     filename: Optional[str] = None
     category: Optional[DocumentCategory] = None
 
+class DocumentBatchDelete(BaseModel):
+    ids: List[str]
+
 class DocumentResponse(BaseModel):
     id: str
     filename: str
@@ -626,117 +1041,434 @@ def is_valid_pdf(file: UploadFile) -> bool:
         return False
     return True
 
-# Upload Document
-@api_router.post("/documents/upload", response_model=DocumentResponse)
-async def upload_document(
-    file: UploadFile = File(...),
-    category: DocumentCategory = DocumentCategory.OTHER,
-    current_user: User = Depends(get_current_user)
-):
-    """Upload a PDF document (max 10MB)"""
-    
-    # Validate file type
-    if not is_valid_pdf(file):
+def content_disposition(filename: str) -> str:
+    """Attachment header that survives non-ASCII (accented) filenames"""
+    return f"attachment; filename*=utf-8''{quote(filename)}"
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """Single ``bytes=start-end`` range as inclusive offsets, None when absent"""
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    start, _, end = spec.strip().partition("-")
+    if unit.strip() != "bytes" or "," in spec or not (start.isdigit() or end.isdigit()):
+        return None
+    if not start:
+        # Suffix range: the last N bytes
+        first, last = max(0, size - int(end)), size - 1
+    else:
+        first, last = int(start), min(int(end), size - 1) if end.isdigit() else size - 1
+    if first > last or first >= size:
         raise HTTPException(
-            status_code=400,
-            detail="Seuls les fichiers PDF sont acceptés"
+            status_code=416,
+            detail="Plage demandée invalide",
+            headers={"Content-Range": f"bytes */{size}"}
         )
+    return first, last
+
+async def read_upload_chunks(file: UploadFile, hasher=None, max_size: int = MAX_UPLOAD_SIZE):
+    """Stream an upload in chunks, rejecting it as soon as it exceeds max_size"""
+    total = 0
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if hasher is not None:
+            hasher.update(chunk)
+        total += len(chunk)
+        if total > max_size:
+            raise HTTPException(
+                status_code=400,
+                detail="Le fichier est trop volumineux. Taille maximale : 10MB"
+            )
+        yield chunk
+
+class UploadRoute(APIRoute):
+    """Route that refuses over-quota uploads from their Content-Length, before reading the body"""
     
-    # Read file content to check size
-    content = await file.read()
-    file_size = len(content)
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        
+        async def route_handler(request: Request):
+            declared = request.headers.get("content-length", "")
+            user_id = user_id_from_authorization(request.headers.get("authorization"))
+            if declared.isdigit() and user_id:
+                repos = request.app.state.repositories
+                user = await repos.users.get(user_id, ["user_type"])
+                # Leave room for the multipart framing around the file(s)
+                declared_size = max(0, int(declared) - MULTIPART_OVERHEAD)
+                if user:
+                    try:
+                        await quotas.check_declared(repos, user_id, user.get("user_type"), declared_size)
+                    except quotas.QuotaExceeded:
+                        return JSONResponse(status_code=413, content={"detail": QUOTA_EXCEEDED_DETAIL})
+            return await handler(request)
+        
+        return route_handler
+
+upload_router = APIRouter(prefix="/api", route_class=UploadRoute)
+
+QUOTA_EXCEEDED_DETAIL = "Quota de stockage dépassé. Supprimez des documents pour libérer de l'espace"
+
+async def store_upload(repos: Repositories, file: UploadFile, category: DocumentCategory, user: User) -> dict:
+    """Validate an uploaded PDF, reserve quota and stream it to storage; returns the document row to insert"""
     
-    # Check file size (10MB = 10 * 1024 * 1024 bytes)
-    max_size = 10 * 1024 * 1024
-    if file_size > max_size:
+    # Validate file type
+    if not is_valid_pdf(file):
         raise HTTPException(
             status_code=400,
-            detail=f"Le fichier est trop volumineux. Taille maximale : 10MB"
+            detail="Seuls les fichiers PDF sont acceptés"
         )
     
-    # Generate unique filename
-    file_extension = Path(file.filename).suffix
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = UPLOAD_DIR / unique_filename
-    
-    # Save file
+    # When the size is already known, check it and reserve quota before
+    # anything is written to storage
+    declared_size = getattr(file, "size", None)
+    if declared_size is not None:
+        if declared_size > MAX_UPLOAD_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail="Le fichier est trop volumineux. Taille maximale : 10MB"
+            )
+        try:
+            await quotas.reserve(repos, user.id, user.user_type, declared_size)
+        except quotas.QuotaExceeded:
+            raise HTTPException(status_code=413, detail=QUOTA_EXCEEDED_DETAIL)
+    
+    # Stream file to storage (size is checked chunk by chunk)
+    storage = get_storage()
+    storage_key = new_storage_key(Path(file.filename).suffix)
+    hasher = hashlib.sha256()
+    chunks = read_upload_chunks(file, hasher)
+    encryption_metadata = None
+    if encryption.is_enabled():
+        data_key, encryption_metadata = encryption.new_document_key()
+        chunks = encryption.encrypt_stream(chunks, data_key, encryption_metadata)
     try:
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(content)
+        file_size = await storage.save(storage_key, chunks)
+        if encryption_metadata:
+            file_size = encryption.plaintext_size(file_size, encryption_metadata["chunk_size"])
     except Exception as e:
+        if declared_size is not None:
+            await quotas.release(repos, user.id, declared_size)
+        if isinstance(e, HTTPException):
+            raise
         logger.error(f"Error saving file: {e}")
         raise HTTPException(
             status_code=500,
             detail="Erreur lors de l'enregistrement du fichier"
         )
     
-    # Save document metadata to database
+    if declared_size is None:
+        try:
+            await quotas.reserve(repos, user.id, user.user_type, file_size)
+        except quotas.QuotaExceeded:
+            await storage.delete(storage_key)
+            raise HTTPException(status_code=413, detail=QUOTA_EXCEEDED_DETAIL)
+    else:
+        await quotas.adjust(repos, user.id, file_size - declared_size)
+    
     document = Document(
-        user_id=current_user.id,
+        user_id=user.id,
         filename=file.filename,
         original_filename=file.filename,
         category=category,
         file_size=file_size,
-        file_path=str(file_path)
+        storage_backend=storage.name,
+        storage_key=storage_key,
+        content_hash=hasher.hexdigest(),
+        encryption=encryption_metadata
     )
-    
     document_dict = document.dict()
-    await db.documents.insert_one(document_dict)
+    document_dict["text_status"] = "pending"
+    return document_dict
+
+async def documents_created(repos: Repositories, documents: List[dict]):
+    """Queue the background work for freshly inserted documents"""
+    if repos.db is None:
+        # Text index, career cache and job queue are Mongo collections
+        return
+    uploads = {}
+    for document in documents:
+        # Extract text for search
+        await document_search.schedule_indexing(repos.db, document)
+        if document["category"] == DocumentCategory.CAREER_STATEMENT:
+            await career_statement.warm_cache(repos.db, document)
+        category = DocumentCategory(document["category"]).value
+        uploads[f"uploads.{category}.count"] = uploads.get(f"uploads.{category}.count", 0) + 1
+        uploads[f"uploads.{category}.bytes"] = uploads.get(f"uploads.{category}.bytes", 0) + document["file_size"]
+    await analytics.record_event(repos.db, uploads)
+    for user_id in {document["user_id"] for document in documents}:
+        await analytics.user_changed(repos.db, user_id)
+
+async def discard_stored(repos: Repositories, documents: List[dict], user_id: Optional[str] = None):
+    """Remove files whose metadata could not be saved (refunding quota if user_id is given)"""
+    if user_id and documents:
+        await quotas.release(repos, user_id, sum(d["file_size"] for d in documents), len(documents))
+    for document in documents:
+        storage, key = document_location(document)
+        try:
+            await storage.delete(key)
+        except Exception as e:
+            logger.error(f"Error deleting file: {e}")
+
+# Upload Document
+@upload_router.post("/documents/upload", response_model=DocumentResponse)
+async def upload_document(
+    file: UploadFile = File(...),
+    category: DocumentCategory = DocumentCategory.OTHER,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache),
+    changes: ChangeFeed = Depends(get_changes)
+):
+    """Upload a PDF document (max 10MB)"""
+    
+    document_dict = await store_upload(repos, file, category, current_user)
+    
+    # Save document metadata to database
+    try:
+        await repos.documents.insert(document_dict)
+    except Exception:
+        await discard_stored(repos, [document_dict], current_user.id)
+        raise
+    
+    await documents_created(repos, [document_dict])
+    await cache.invalidate(current_user.id)
+    await changes.publish(current_user.id, "document.added", ids=[document_dict["id"]])
     
-    return DocumentResponse(**document_dict)
+    return FastJSONResponse(project(DocumentResponse, document_dict))
+
+# Upload several documents at once
+@upload_router.post("/documents/upload/batch")
+async def upload_documents_batch(
+    files: List[UploadFile] = File(...),
+    category: DocumentCategory = DocumentCategory.OTHER,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache),
+    changes: ChangeFeed = Depends(get_changes)
+):
+    """Upload up to MAX_BATCH_FILES PDF documents in one request"""
+    
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximum {MAX_BATCH_FILES} fichiers par envoi"
+        )
+    
+    stored = []
+    rejected = []
+    for file in files:
+        try:
+            stored.append(await store_upload(repos, file, category, current_user))
+        except HTTPException as e:
+            rejected.append({"filename": file.filename, "detail": e.detail})
+    
+    # One round trip for all the metadata
+    if stored:
+        try:
+            await repos.documents.insert_many(stored)
+        except Exception:
+            await discard_stored(repos, stored, current_user.id)
+            raise
+        await documents_created(repos, stored)
+        await cache.invalidate(current_user.id)
+        await changes.publish(current_user.id, "document.added", ids=[doc["id"] for doc in stored])
+    
+    return FastJSONResponse({
+        "uploaded": [project(DocumentResponse, doc) for doc in stored],
+        "rejected": rejected
+    })
 
 # Get all documents for current user
 @api_router.get("/documents", response_model=List[DocumentResponse])
 async def get_documents(
+    request: Request,
     category: Optional[DocumentCategory] = None,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache)
 ):
     """Get all documents for current user, optionally filtered by category"""
     
-    query = {"user_id": current_user.id}
-    if category:
-        query["category"] = category
+    async def version():
+        return [await repos.documents.version(current_user.id, category)]
     
-    documents = await db.documents.find(query).sort("uploaded_at", -1).to_list(length=None)
+    async def build():
+        return await repos.documents.list(current_user.id, category, model_fields(DocumentResponse))
     
-    return [DocumentResponse(**doc) for doc in documents]
+    # Rows already have the response shape: serialize them as they are.
+    # Only the unfiltered list is cached; each category has its own ETag
+    kind = f"documents:{category.value}" if category else "documents"
+    return await conditional_json(request, cache, current_user.id, kind, version, build, cached=not category)
 
 # Get document statistics - MUST be before /{document_id} route
 @api_router.get("/documents/stats/summary")
-async def get_document_stats(current_user: User = Depends(get_current_user)):
+async def get_document_stats(
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache)
+):
     """Get document statistics for current user"""
+    return await cached_json(cache, current_user.id, "document_stats", lambda: document_stats(repos, current_user))
+
+async def document_stats(repos: Repositories, current_user: User) -> dict:
+    # Totals come from the usage counter; only the per-category breakdown
+    # and recent count need the documents, aggregated server-side
+    usage = await quotas.get_usage(repos, current_user.id)
+    limits = quotas.limits_for(current_user.user_type)
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    groups = await repos.documents.category_summary(current_user.id, week_ago)
     
-    documents = await db.documents.find({"user_id": current_user.id}).to_list(length=None)
-    
-    total_count = len(documents)
-    total_size = sum(doc["file_size"] for doc in documents)
+    return {
+        "total_documents": usage["files"],
+        "total_size_bytes": usage["bytes"],
+        "total_size_mb": round(usage["bytes"] / (1024 * 1024), 2),
+        "by_category": {g["category"]: g["count"] for g in groups},
+        "recent_count": sum(g["recent"] for g in groups),
+        "quota": {
+            "max_bytes": limits["max_bytes"],
+            "max_files": limits["max_files"],
+            "used_bytes": usage["bytes"],
+            "used_files": usage["files"],
+            "remaining_bytes": max(0, limits["max_bytes"] - usage["bytes"]),
+            "remaining_files": max(0, limits["max_files"] - usage["files"])
+        }
+    }
+
+# Delete several documents at once
+@api_router.post("/documents/delete")
+async def delete_documents_batch(
+    request: DocumentBatchDelete,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache),
+    changes: ChangeFeed = Depends(get_changes)
+):
+    """Delete a list of documents"""
     
-    # Count by category
-    category_counts = {}
-    for doc in documents:
-        category = doc["category"]
-        category_counts[category] = category_counts.get(category, 0) + 1
+    documents = await repos.documents.get_many(
+        current_user.id, request.ids,
+        ["id", "file_size", "storage_backend", "storage_key", "file_path"]
+    )
     
+    ids = [doc["id"] for doc in documents]
+    if ids:
+        # Rows first, files second (see delete_document)
+        deleted = await repos.documents.delete_many(current_user.id, ids)
+        if repos.db is not None:
+            await document_search.remove_documents(repos.db, ids)
+        if deleted == len(ids):
+            await quotas.release(repos, current_user.id, sum(d["file_size"] for d in documents), len(ids))
+        else:
+            # Some rows vanished concurrently: recount instead of guessing
+            await quotas.recompute(repos, current_user.id)
+        await cache.invalidate(current_user.id)
+        await changes.publish(current_user.id, "document.removed", ids=ids)
+        await analytics.user_changed(repos.db, current_user.id)
+        await discard_stored(repos, documents)
+    
+    found = set(ids)
     return {
-        "total_documents": total_count,
-        "total_size_bytes": total_size,
-        "total_size_mb": round(total_size / (1024 * 1024), 2),
-        "by_category": category_counts,
-        "recent_count": len([d for d in documents if (datetime.utcnow() - d["uploaded_at"]).days <= 7])
+        "deleted": ids,
+        "not_found": [i for i in request.ids if i not in found],
+        "message": f"{len(ids)} document(s) supprimé(s)"
     }
 
+# Download all documents as a ZIP - MUST be before /{document_id} route
+@api_router.get("/documents/export")
+async def export_documents(
+    category: Optional[DocumentCategory] = None,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories)
+):
+    """Stream a ZIP of all the user's documents, optionally for one category"""
+    
+    async def entries():
+        seen = set()
+        documents = repos.documents.iterate(
+            current_user.id, category,
+            ["filename", "category", "uploaded_at", "file_size",
+             "storage_backend", "storage_key", "file_path", "encryption"]
+        )
+        async for document in documents:
+            storage, key = document_location(document)
+            if not await storage.exists(key):
+                logger.warning(f"Missing file skipped in export: {key}")
+                continue
+            name = unique_name(f"{document['category']}/{Path(document['filename']).name}", seen)
+            yield name, document["uploaded_at"], encryption.open_document(document)
+    
+    archive_name = f"elysion-documents-{category.value if category else 'tous'}.zip"
+    return StreamingResponse(
+        stream_zip(entries()),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(archive_name)}
+    )
+
+# Full-text search - MUST be before /{document_id} route
+@api_router.get("/documents/search")
+async def search_documents(
+    q: str,
+    category: Optional[DocumentCategory] = None,
+    limit: int = 20,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories)
+):
+    """Search the text of the current user's documents"""
+    
+    if not q.strip():
+        return {"results": []}
+    
+    limit = max(1, min(limit, 100))
+    hits = await document_search.search(require_mongo(repos), current_user.id, q, category, limit)
+    
+    documents = await repos.documents.get_many(
+        current_user.id, [h["document_id"] for h in hits], model_fields(DocumentResponse)
+    )
+    by_id = {doc["id"]: doc for doc in documents}
+    
+    return FastJSONResponse({
+        "results": [
+            {
+                "document": by_id[h["document_id"]],
+                "score": h["score"],
+                "snippet": h["snippet"]
+            }
+            for h in hits if h["document_id"] in by_id
+        ]
+    })
+
 # Get single document
 @api_router.get("/documents/{document_id}", response_model=DocumentResponse)
 async def get_document(
     document_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories)
 ):
     """Get a specific document"""
     
-    document = await db.documents.find_one({
-        "id": document_id,
-        "user_id": current_user.id
-    })
+    document = await repos.documents.get(document_id, current_user.id, model_fields(DocumentResponse))
+    
+    if not document:
+        raise HTTPException(
+            status_code=404,
+            detail="Document non trouvé"
+        )
+    
+    return FastJSONResponse(document)
+
+# Parsed career statement
+@api_router.get("/documents/{document_id}/career")
+async def get_document_career(
+    document_id: str,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories)
+):
+    """Year-by-year career parsed from a career statement, with simulator prefill and projection"""
+    
+    db = require_mongo(repos)
+    document = await repos.documents.get(document_id, current_user.id)
     
     if not document:
         raise HTTPException(
@@ -744,20 +1476,45 @@ async def get_document(
             detail="Document non trouvé"
         )
     
-    return DocumentResponse(**document)
+    if document["category"] != DocumentCategory.CAREER_STATEMENT:
+        raise HTTPException(
+            status_code=400,
+            detail="Ce document n'est pas un relevé de carrière"
+        )
+    
+    try:
+        career = await career_statement.get_career(db, document)
+    except Exception as e:
+        logger.error(f"Error parsing career statement: {e}")
+        raise HTTPException(
+            status_code=422,
+            detail="Impossible de lire ce relevé de carrière"
+        )
+    
+    profile = await repos.profiles.get(current_user.id, ["date_of_birth"])
+    birth_year = None
+    if profile and profile.get("date_of_birth") and profile["date_of_birth"][:4].isdigit():
+        birth_year = int(profile["date_of_birth"][:4])
+    
+    return {
+        "career": career,
+        "prefill": career_statement.simulator_prefill(career),
+        "projection": career_statement.projection(
+            career, birth_year, freelance=current_user.user_type == UserType.FREELANCER
+        )
+    }
 
 # Download document
 @api_router.get("/documents/{document_id}/download")
 async def download_document(
     document_id: str,
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories)
 ):
     """Download a document"""
     
-    document = await db.documents.find_one({
-        "id": document_id,
-        "user_id": current_user.id
-    })
+    document = await repos.documents.get(document_id, current_user.id)
     
     if not document:
         raise HTTPException(
@@ -765,18 +1522,39 @@ async def download_document(
             detail="Document non trouvé"
         )
     
-    file_path = Path(document["file_path"])
+    storage, key = document_location(document)
     
-    if not file_path.exists():
+    if not await storage.exists(key):
         raise HTTPException(
             status_code=404,
             detail="Fichier introuvable sur le serveur"
         )
     
-    return FileResponse(
-        path=file_path,
-        filename=document["filename"],
-        media_type="application/pdf"
+    file_path = storage.local_path(key)
+    if file_path is not None and not document.get("encryption"):
+        return FileResponse(
+            path=file_path,
+            filename=document["filename"],
+            media_type="application/pdf"
+        )
+    
+    # Encrypted or remote files: stream (and decrypt) only the requested range
+    size = document["file_size"]
+    byte_range = parse_range(request.headers.get("range"), size)
+    start, end = byte_range or (0, size - 1)
+    headers = {
+        "Content-Disposition": content_disposition(document["filename"]),
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(max(0, end - start + 1)),
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    
+    return StreamingResponse(
+        encryption.open_document(document, start, end) if byte_range else encryption.open_document(document),
+        status_code=206 if byte_range else 200,
+        media_type="application/pdf",
+        headers=headers
     )
 
 # Update document (rename or change category)
@@ -784,14 +1562,14 @@ async def download_document(
 async def update_document(
     document_id: str,
     update_data: DocumentUpdate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache),
+    changes: ChangeFeed = Depends(get_changes)
 ):
     """Update document metadata (rename or change category)"""
     
-    document = await db.documents.find_one({
-        "id": document_id,
-        "user_id": current_user.id
-    })
+    document = await repos.documents.get(document_id, current_user.id)
     
     if not document:
         raise HTTPException(
@@ -809,29 +1587,34 @@ async def update_document(
     if update_dict:
         update_dict["updated_at"] = datetime.utcnow()
         
-        await db.documents.update_one(
-            {"id": document_id},
-            {"$set": update_dict}
-        )
+        await repos.documents.update(document_id, update_dict)
+        await cache.invalidate(current_user.id)
+        await changes.publish(current_user.id, "document.updated", ids=[document_id])
+        if repos.db is not None:
+            await document_search.update_document_fields(repos.db, document_id, update_dict)
+            if update_data.category == DocumentCategory.CAREER_STATEMENT:
+                await career_statement.warm_cache(repos.db, document)
+            if update_data.category:
+                await analytics.user_changed(repos.db, current_user.id)
         
         # Get updated document
-        updated_doc = await db.documents.find_one({"id": document_id})
-        return DocumentResponse(**updated_doc)
+        updated_doc = await repos.documents.get(document_id, fields=model_fields(DocumentResponse))
+        return FastJSONResponse(updated_doc)
     
-    return DocumentResponse(**document)
+    return FastJSONResponse(project(DocumentResponse, document))
 
 # Delete document
 @api_router.delete("/documents/{document_id}")
 async def delete_document(
     document_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    repos: Repositories = Depends(get_repositories),
+    cache: Cache = Depends(get_cache),
+    changes: ChangeFeed = Depends(get_changes)
 ):
     """Delete a document"""
     
-    document = await db.documents.find_one({
-        "id": document_id,
-        "user_id": current_user.id
-    })
+    document = await repos.documents.get(document_id, current_user.id)
     
     if not document:
         raise HTTPException(
@@ -839,23 +1622,23 @@ async def delete_document(
             detail="Document non trouvé"
         )
     
-    # Delete file from filesystem
-    file_path = Path(document["file_path"])
-    try:
-        if file_path.exists():
-            file_path.unlink()
-    except Exception as e:
-        logger.error(f"Error deleting file: {e}")
+    # Delete from database first: if removing the file fails, the storage
+    # reconciliation job collects it as an orphan
+    deleted = await repos.documents.delete(document_id)
+    if repos.db is not None:
+        await document_search.remove_document(repos.db, document_id)
+    if deleted:
+        await quotas.release(repos, current_user.id, document["file_size"])
+    await cache.invalidate(current_user.id)
+    await changes.publish(current_user.id, "document.removed", ids=[document_id])
+    await analytics.user_changed(repos.db, current_user.id)
     
-    # Delete from database
-    await db.documents.delete_one({"id": document_id})
+    # Delete file from storage
+    await discard_stored(repos, [document])
     
     return {"message": "Document supprimé avec succès"}
 
 # Include the router in the main app - MUST be after all routes are defined
+app.include_router(upload_router)
 app.include_router(api_router)
 
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
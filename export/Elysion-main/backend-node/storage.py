@@ -0,0 +1,404 @@
+"""
+Document storage backends.
+
+Documents are addressed by a storage key. New keys are sharded by a hash
+prefix (``ab/cd/<uuid>.pdf``) so no single directory (or S3 prefix) grows
+without bound. Legacy documents stored flat in UPLOAD_DIR keep their bare
+filename as key and are served by the same local driver.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Dict, NamedTuple, Optional
+
+import aiofiles
+import aiofiles.os
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# Key prefixes that do not hold document files: user data exports
+# (user_export.py) and files set aside by reconciliation.py
+EXPORTS_PREFIX = "exports/"
+QUARANTINE_PREFIX = "quarantine/"
+
+
+class StorageError(Exception):
+    pass
+
+
+class StoredObject(NamedTuple):
+    key: str
+    size: int
+    modified_at: datetime  # naive UTC, like the rest of the app
+
+
+def sharded_key(name: str) -> str:
+    """Place ``name`` under its two-level hash prefix: ``3f/a2/<name>``"""
+    digest = hashlib.sha256(name.encode()).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{name}"
+
+
+def new_storage_key(suffix: str = "") -> str:
+    """Generate a fresh sharded key such as ``3f/a2/<uuid>.pdf``"""
+    return sharded_key(f"{uuid.uuid4()}{suffix}")
+
+
+class StorageBackend:
+    """Interface shared by every storage driver"""
+
+    name = "base"
+
+    async def save(self, key: str, chunks: AsyncIterator[bytes]) -> int:
+        """Store the stream under ``key`` and return the number of bytes written.
+
+        If ``chunks`` raises, nothing is left behind under ``key``.
+        """
+        raise NotImplementedError
+
+    def open(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Yield the bytes of ``key`` from ``start`` to ``end`` (inclusive)"""
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        return await self.size(key) is not None
+
+    async def size(self, key: str) -> Optional[int]:
+        raise NotImplementedError
+
+    async def move(self, key: str, new_key: str):
+        raise NotImplementedError
+
+    def list_objects(self, prefix: str = "") -> AsyncIterator[StoredObject]:
+        """Yield every object under ``prefix`` in lexicographic key order"""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Filesystem path for ``key`` when the driver is disk backed"""
+        return None
+
+    async def close(self):
+        pass
+
+
+class LocalStorage(StorageBackend):
+    """Files on local disk under ``root``, one subdirectory per key segment"""
+
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._resolved_root = self.root.resolve()
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self._resolved_root not in path.parents:
+            raise StorageError(f"Invalid storage key: {key}")
+        return path
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return self._path(key)
+
+    async def save(self, key: str, chunks: AsyncIterator[bytes]) -> int:
+        path = self._path(key)
+        await aiofiles.os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+        written = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+                    written += len(chunk)
+            # Atomic rename so readers never observe a half-written file
+            await aiofiles.os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                await aiofiles.os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return written
+
+    async def open(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        remaining = None if end is None else end - start + 1
+        async with aiofiles.open(self._path(key), "rb") as f:
+            if start:
+                await f.seek(start)
+            while remaining is None or remaining > 0:
+                size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+                chunk = await f.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def delete(self, key: str) -> bool:
+        try:
+            await aiofiles.os.remove(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            stat = await aiofiles.os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return stat.st_size
+
+    async def move(self, key: str, new_key: str):
+        new_path = self._path(new_key)
+        await aiofiles.os.makedirs(new_path.parent, exist_ok=True)
+        await aiofiles.os.replace(self._path(key), new_path)
+
+    async def list_objects(self, prefix: str = "") -> AsyncIterator[StoredObject]:
+        base = self._path(prefix) if prefix else self.root
+        if not base.is_dir():
+            return
+        async for obj in self._walk(base, base.relative_to(self.root).as_posix() if prefix else ""):
+            yield obj
+
+    async def _walk(self, directory: Path, rel: str) -> AsyncIterator[StoredObject]:
+        items = await asyncio.to_thread(_sorted_entries, directory)
+        for name, is_dir, size, mtime in items:
+            key = f"{rel}/{name}" if rel else name
+            if is_dir:
+                async for sub in self._walk(directory / name, key):
+                    yield sub
+            else:
+                yield StoredObject(key, size, datetime.utcfromtimestamp(mtime))
+
+
+def _sorted_entries(directory: Path):
+    items = []
+    with os.scandir(directory) as entries:
+        for e in entries:
+            # Dot files are in-flight uploads (".<name>.<id>.part")
+            if e.name.startswith("."):
+                continue
+            if e.is_dir():
+                items.append((e.name, True, 0, 0.0))
+            else:
+                stat = e.stat()
+                items.append((e.name, False, stat.st_size, stat.st_mtime))
+    # Directories sort as "name/" so the walk matches plain string order
+    # of the full keys ("ab/cd/x" < "ab0.pdf").
+    items.sort(key=lambda item: item[0] + "/" if item[1] else item[0])
+    return items
+
+
+class S3Storage(StorageBackend):
+    """S3-compatible object store (AWS, MinIO, ...) through aiobotocore.
+
+    A single client with a bounded connection pool is shared by all
+    requests. Uploads stream through multipart upload so at most one part
+    is held in memory.
+    """
+
+    name = "s3"
+    MIN_PART_SIZE = 5 * 1024 * 1024
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+        max_pool_connections: int = 20,
+        part_size: int = 8 * 1024 * 1024,
+        prefix: str = "",
+    ):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.max_pool_connections = max_pool_connections
+        self.part_size = max(part_size, self.MIN_PART_SIZE)
+        self.prefix = prefix
+        self._client = None
+        self._exit_stack: Optional[AsyncExitStack] = None
+        self._client_lock = asyncio.Lock()
+
+    async def _get_client(self):
+        if self._client is not None:
+            return self._client
+        async with self._client_lock:
+            if self._client is not None:
+                return self._client
+            try:
+                from aiobotocore.config import AioConfig
+                from aiobotocore.session import get_session
+            except ImportError as e:
+                raise StorageError("aiobotocore is required for the s3 storage backend") from e
+            exit_stack = AsyncExitStack()
+            self._client = await exit_stack.enter_async_context(
+                get_session().create_client(
+                    "s3",
+                    endpoint_url=self.endpoint_url,
+                    region_name=self.region,
+                    aws_access_key_id=self.access_key,
+                    aws_secret_access_key=self.secret_key,
+                    config=AioConfig(max_pool_connections=self.max_pool_connections),
+                )
+            )
+            self._exit_stack = exit_stack
+            return self._client
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def save(self, key: str, chunks: AsyncIterator[bytes]) -> int:
+        client = await self._get_client()
+        object_key = self._object_key(key)
+        buffer = bytearray()
+        written = 0
+        upload_id = None
+        parts = []
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                written += len(chunk)
+                if len(buffer) >= self.part_size:
+                    if upload_id is None:
+                        response = await client.create_multipart_upload(Bucket=self.bucket, Key=object_key)
+                        upload_id = response["UploadId"]
+                    part_number = len(parts) + 1
+                    response = await client.upload_part(
+                        Bucket=self.bucket, Key=object_key, UploadId=upload_id,
+                        PartNumber=part_number, Body=bytes(buffer),
+                    )
+                    parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+                    buffer.clear()
+
+            if upload_id is None:
+                # Small object: a single PUT is cheaper than a multipart round trip
+                await client.put_object(Bucket=self.bucket, Key=object_key, Body=bytes(buffer))
+                return written
+
+            if buffer:
+                part_number = len(parts) + 1
+                response = await client.upload_part(
+                    Bucket=self.bucket, Key=object_key, UploadId=upload_id,
+                    PartNumber=part_number, Body=bytes(buffer),
+                )
+                parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+            await client.complete_multipart_upload(
+                Bucket=self.bucket, Key=object_key, UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+            return written
+        except BaseException:
+            if upload_id is not None:
+                try:
+                    await client.abort_multipart_upload(Bucket=self.bucket, Key=object_key, UploadId=upload_id)
+                except Exception as e:
+                    logger.error(f"Error aborting multipart upload {object_key}: {e}")
+            raise
+
+    async def open(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        client = await self._get_client()
+        params = {"Bucket": self.bucket, "Key": self._object_key(key)}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end}"
+        response = await client.get_object(**params)
+        async with response["Body"] as body:
+            while True:
+                chunk = await body.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    async def delete(self, key: str) -> bool:
+        client = await self._get_client()
+        await client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        return True
+
+    async def size(self, key: str) -> Optional[int]:
+        client = await self._get_client()
+        try:
+            response = await client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return response["ContentLength"]
+
+    async def move(self, key: str, new_key: str):
+        client = await self._get_client()
+        await client.copy_object(
+            Bucket=self.bucket, Key=self._object_key(new_key),
+            CopySource={"Bucket": self.bucket, "Key": self._object_key(key)},
+        )
+        await client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    async def list_objects(self, prefix: str = "") -> AsyncIterator[StoredObject]:
+        client = await self._get_client()
+        paginator = client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=self.bucket, Prefix=self._object_key(prefix)):
+            for obj in page.get("Contents", []):
+                modified_at = obj["LastModified"].astimezone(timezone.utc).replace(tzinfo=None)
+                yield StoredObject(obj["Key"][len(self.prefix):], obj["Size"], modified_at)
+
+    async def close(self):
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+            self._exit_stack = None
+            self._client = None
+
+
+_backends: Dict[str, StorageBackend] = {}
+
+
+def get_storage(name: Optional[str] = None) -> StorageBackend:
+    """Return the (cached) backend called ``name``, or the configured default"""
+    name = name or os.environ.get("STORAGE_BACKEND", "local")
+    backend = _backends.get(name)
+    if backend is None:
+        if name == "local":
+            default_root = Path(__file__).parent / "uploads" / "documents"
+            backend = LocalStorage(Path(os.environ.get("STORAGE_LOCAL_ROOT", default_root)))
+        elif name == "s3":
+            backend = S3Storage(
+                bucket=os.environ["S3_BUCKET"],
+                endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+                region=os.environ.get("S3_REGION"),
+                access_key=os.environ.get("S3_ACCESS_KEY_ID"),
+                secret_key=os.environ.get("S3_SECRET_ACCESS_KEY"),
+                max_pool_connections=int(os.environ.get("S3_MAX_POOL_CONNECTIONS", "20")),
+                part_size=int(os.environ.get("S3_PART_SIZE", str(8 * 1024 * 1024))),
+                prefix=os.environ.get("S3_KEY_PREFIX", ""),
+            )
+        else:
+            raise StorageError(f"Unknown storage backend: {name}")
+        _backends[name] = backend
+    return backend
+
+
+def document_location(document: dict):
+    """Return ``(backend, key)`` for a document row.
+
+    Rows written before sharding only have an absolute ``file_path`` into the
+    flat UPLOAD_DIR; their key is the bare filename on the local driver.
+    """
+    if document.get("storage_key"):
+        return get_storage(document.get("storage_backend") or "local"), document["storage_key"]
+    return get_storage("local"), Path(document["file_path"]).name
+
+
+async def close_storages():
+    for backend in list(_backends.values()):
+        await backend.close()
+    _backends.clear()
@@ -0,0 +1,190 @@
+"""
+Per-user data export (data portability).
+
+``export_entries`` yields the entries of a ZIP archive (see zip_stream.py):
+
+* ``account.ndjson``, ``user_profiles.ndjson``, ``retirement_profiles.ndjson``
+  (saved simulation included) and ``documents.ndjson``, one JSON object per
+  line;
+* ``files/<category>/<filename>``: the original files, decrypted.
+
+Rows come from cursors and files are read in storage chunks, so memory
+stays constant whatever the size of the account. ``GET /api/user/export``
+streams the archive to the client. For large accounts, ``POST
+/api/user/exports`` queues an ``export.user`` job instead. The job streams
+the archive into storage under ``exports/`` and emails the user when it is
+ready. The archive can be downloaded for ``EXPORT_RETENTION_SECONDS``,
+after which an ``export.expire`` job deletes it. It holds the decrypted
+documents, so with ``DOCUMENT_MASTER_KEY`` set it is encrypted at rest like
+them (``encryption`` metadata on the ``user_exports`` row) and
+``open_archive`` decrypts it on download.
+"""
+
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from pathlib import PurePath
+from typing import AsyncIterator, Optional, Tuple
+
+import encryption
+import jobs
+import outbox
+from repositories import Repositories, mongo_repositories
+from serialization import dumps
+from storage import CHUNK_SIZE, EXPORTS_PREFIX, document_location, get_storage
+from zip_stream import stream_zip, unique_name
+
+logger = logging.getLogger(__name__)
+
+RETENTION = float(os.environ.get("EXPORT_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+# Credentials and storage internals never leave the server
+ACCOUNT_EXCLUDED = {"hashed_password"}
+DOCUMENT_INTERNAL = {"storage_backend", "storage_key", "file_path", "encryption"}
+FILE_FIELDS = ["id", "filename", "category", "uploaded_at", "file_size",
+               "storage_backend", "storage_key", "file_path", "encryption"]
+
+Entry = Tuple[str, Optional[datetime], AsyncIterator[bytes]]
+
+
+async def _ndjson(rows: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    buffer = bytearray()
+    async for row in rows:
+        buffer += dumps(row)
+        buffer += b"\n"
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _single(row: Optional[dict]) -> AsyncIterator[dict]:
+    if row is not None:
+        yield row
+
+
+async def _document_rows(repos: Repositories, user_id: str) -> AsyncIterator[dict]:
+    async for document in repos.documents.iterate(user_id):
+        yield {k: v for k, v in document.items() if k not in DOCUMENT_INTERNAL}
+
+
+async def export_entries(repos: Repositories, user_id: str) -> AsyncIterator[Entry]:
+    now = datetime.utcnow()
+    account = await repos.users.get(user_id)
+    if account is not None:
+        account = {k: v for k, v in account.items() if k not in ACCOUNT_EXCLUDED}
+    yield "account.ndjson", now, _ndjson(_single(account))
+    yield "user_profiles.ndjson", now, _ndjson(_single(await repos.profiles.get(user_id)))
+    yield "retirement_profiles.ndjson", now, _ndjson(_single(await repos.retirement_profiles.get(user_id)))
+    yield "documents.ndjson", now, _ndjson(_document_rows(repos, user_id))
+
+    seen = set()
+    async for document in repos.documents.iterate(user_id, fields=FILE_FIELDS):
+        storage, key = document_location(document)
+        if not await storage.exists(key):
+            logger.warning(f"Missing file skipped in export: {key}")
+            continue
+        name = unique_name(f"files/{document['category']}/{PurePath(document['filename']).name}", seen)
+        yield name, document.get("uploaded_at"), encryption.open_document(document)
+
+
+def stream_export(repos: Repositories, user_id: str) -> AsyncIterator[bytes]:
+    """The ZIP archive of everything stored about the user"""
+    return stream_zip(export_entries(repos, user_id))
+
+
+def archive_name(moment: datetime) -> str:
+    return f"elysion-export-{moment:%Y-%m-%d}.zip"
+
+
+# ----------------------------------------------------------------------------
+# Background exports
+# ----------------------------------------------------------------------------
+
+async def ensure_indexes(db):
+    await db.user_exports.create_index("id", unique=True)
+    await db.user_exports.create_index([("user_id", 1), ("created_at", -1)])
+
+
+async def request_export(db, user_id: str) -> dict:
+    export = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "status": "pending",
+        "created_at": datetime.utcnow(),
+    }
+    await db.user_exports.insert_one(dict(export))
+    await jobs.enqueue(db, "export.user", {"export_id": export["id"]})
+    return export
+
+
+async def _export_failed(db, payload: dict, error: Exception):
+    await db.user_exports.update_one({"id": payload["export_id"]}, {"$set": {"status": "failed"}})
+
+
+@jobs.job("export.user", queue="documents", max_attempts=3, on_failure=_export_failed)
+async def _export_job(db, payload: dict):
+    export = await db.user_exports.find_one({"id": payload["export_id"]}, {"_id": 0})
+    if export is None or export["status"] == "expired":
+        return
+    repos = mongo_repositories(db.client, db.name)
+
+    if export["status"] != "ready":
+        await db.user_exports.update_one({"id": export["id"]}, {"$set": {"status": "running"}})
+        storage = get_storage()
+        # Same key on every attempt: a retry overwrites the partial archive
+        key = f"{EXPORTS_PREFIX}{export['user_id']}/{export['id']}.zip"
+        chunks = stream_export(repos, export["user_id"])
+        metadata = None
+        if encryption.is_enabled():
+            data_key, metadata = encryption.new_document_key()
+            chunks = encryption.encrypt_stream(chunks, data_key, metadata)
+        size = await storage.save(key, chunks)
+        if metadata:
+            size = encryption.plaintext_size(size, metadata["chunk_size"])
+            export["encryption"] = metadata
+        now = datetime.utcnow()
+        export.update(
+            status="ready",
+            storage_backend=storage.name,
+            storage_key=key,
+            size=size,
+            finished_at=now,
+            expires_at=now + timedelta(seconds=RETENTION),
+        )
+        await db.user_exports.update_one({"id": export["id"]}, {"$set": export})
+
+    # Both deduplicated, so a retry after a crash past this point is harmless
+    await jobs.enqueue(db, "export.expire", {"export_id": export["id"]},
+                       delay=max(0.0, (export["expires_at"] - datetime.utcnow()).total_seconds()),
+                       dedupe_key=f"export_expire:{export['id']}")
+    user = await repos.users.get(export["user_id"], ["email"])
+    if user is not None:
+        await outbox.queue_email(
+            db, user["email"], "Votre export de données Elysion est prêt",
+            "Bonjour,\n\nL'export de vos données Elysion est prêt. Vous pouvez le télécharger "
+            f"depuis votre espace jusqu'au {export['expires_at']:%d/%m/%Y}.\n\n"
+            "L'équipe Elysion\n",
+            kind="export_ready", collapse_key=f"export_ready:{export['id']}", window=RETENTION,
+        )
+
+
+@jobs.job("export.expire")
+async def _expire_job(db, payload: dict):
+    export = await db.user_exports.find_one({"id": payload["export_id"]}, {"_id": 0})
+    if export is None or export["status"] != "ready":
+        return
+    await get_storage(export["storage_backend"]).delete(export["storage_key"])
+    await db.user_exports.update_one({"id": export["id"]}, {"$set": {"status": "expired"}})
+
+
+async def get_export(db, user_id: str, export_id: str) -> Optional[dict]:
+    return await db.user_exports.find_one({"id": export_id, "user_id": user_id}, {"_id": 0})
+
+
+def open_archive(export: dict) -> AsyncIterator[bytes]:
+    """Plaintext bytes of a ready export, decrypting when it is encrypted"""
+    # ``size`` is the archive's plaintext size, as ``file_size`` is a document's
+    return encryption.open_document({**export, "file_size": export["size"]})
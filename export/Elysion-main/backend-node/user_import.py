@@ -0,0 +1,174 @@
+"""
+Bulk user import, to onboard a whole company at once.
+
+``POST /api/internal/users/import`` takes a CSV file (with a header row) or
+an NDJSON file, one user per row: ``email``, ``full_name``, ``user_type``
+(``employee`` by default), optionally ``password`` and any questionnaire
+field (``date_of_birth``, ``salary``...). The file is parsed as it is read
+and valid rows are written in batches of ``USER_IMPORT_BATCH_SIZE``:
+
+* the passwords of a batch are hashed in one call to the process pool.
+  Rows without a password get an invitation to choose one
+  (password_reset.py);
+* users are inserted with one unordered ``insert_many``. The unique email
+  index rejects existing accounts, and repeats within the file, row by row,
+  so no row needs a lookup first;
+* profiles, invitations and the analytics refresh are one write per batch.
+
+The response reports the outcome of every line.
+"""
+
+import codecs
+import csv
+import json
+import os
+from collections import Counter
+from typing import BinaryIO, Callable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import analytics
+import password_reset
+import workers
+from passwords import hash_passwords
+from repositories import Repositories
+
+BATCH_SIZE = int(os.environ.get("USER_IMPORT_BATCH_SIZE", "500"))
+
+CREATED = "created"
+DUPLICATE = "duplicate"
+INVALID = "invalid"
+
+# (line number, cleaned row or why the line could not be parsed)
+Row = Tuple[int, Union[dict, str]]
+
+
+class ImportedUser(NamedTuple):
+    user: dict                # ``users`` row, without the password hash
+    profile: Optional[dict]   # ``user_profiles`` row, None without questionnaire fields
+    password: Optional[str]   # None: the user is invited to choose one
+
+
+def file_format(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    name = (filename or "").lower()
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if name.endswith(".csv") or media_type == "text/csv":
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or media_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    return None
+
+
+def _clean(row: dict) -> dict:
+    """Case-insensitive column names; empty cells are missing values"""
+    cleaned = {}
+    for key, value in row.items():
+        if not isinstance(key, str):
+            continue  # extra CSV cells
+        if isinstance(value, str):
+            value = value.strip()
+        if value not in (None, ""):
+            cleaned[key.strip().lower()] = value
+    return cleaned
+
+
+def read_csv(file: BinaryIO) -> Iterator[Row]:
+    reader = csv.DictReader(codecs.iterdecode(file, "utf-8-sig"))
+    for row in reader:
+        yield reader.line_num, _clean(row)
+
+
+def read_ndjson(file: BinaryIO) -> Iterator[Row]:
+    for number, line in enumerate(codecs.iterdecode(file, "utf-8-sig"), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, "JSON invalide"
+            continue
+        yield number, _clean(row) if isinstance(row, dict) else "Objet JSON attendu"
+
+
+def read_rows(file: BinaryIO, kind: str) -> Iterator[Row]:
+    return read_csv(file) if kind == "csv" else read_ndjson(file)
+
+
+def _describe(error: ValueError) -> str:
+    if hasattr(error, "errors"):
+        # Pydantic validation error: one "field: message" per problem
+        return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+    return str(error)
+
+
+async def import_users(repos: Repositories, rows: Iterator[Row], prepare: Callable[[dict], ImportedUser],
+                       invite_token: Callable[[str], str]) -> dict:
+    """Import ``rows``; ``prepare`` validates a row (raising ValueError) and
+    ``invite_token`` signs the invitation of a user without a password"""
+    results: List[dict] = []
+    batch: List[Tuple[int, ImportedUser]] = []
+    line, aborted = 0, None
+    try:
+        for line, row in rows:
+            if isinstance(row, str):
+                results.append({"line": line, "status": INVALID, "error": row})
+                continue
+            try:
+                batch.append((line, prepare(row)))
+            except ValueError as e:
+                results.append({"line": line, "email": row.get("email"), "status": INVALID, "error": _describe(e)})
+                continue
+            if len(batch) >= BATCH_SIZE:
+                results += await _insert_batch(repos, batch, invite_token)
+                batch = []
+    except (UnicodeDecodeError, csv.Error) as e:
+        # Rows before the unreadable part are imported, the rest is not
+        aborted = f"Fichier illisible après la ligne {line} : {e}"
+    if batch:
+        results += await _insert_batch(repos, batch, invite_token)
+
+    results.sort(key=lambda r: r["line"])
+    counts = Counter(r["status"] for r in results)
+    report = {
+        "total": len(results),
+        "created": counts[CREATED],
+        "duplicates": counts[DUPLICATE],
+        "invalid": counts[INVALID],
+        "results": results,
+    }
+    if aborted:
+        report["error"] = aborted
+    return report
+
+
+async def _insert_batch(repos: Repositories, batch: List[Tuple[int, ImportedUser]],
+                        invite_token: Callable[[str], str]) -> List[dict]:
+    passwords = [imported.password for _, imported in batch if imported.password is not None]
+    hashes = iter(await workers.run_cpu_bound(hash_passwords, passwords) if passwords else [])
+    users = [
+        {**imported.user, "hashed_password": next(hashes) if imported.password is not None else None}
+        for _, imported in batch
+    ]
+    duplicates = await repos.users.create_many(users)
+
+    created = [imported for index, (_, imported) in enumerate(batch) if index not in duplicates]
+    await repos.profiles.insert_many([imported.profile for imported in created if imported.profile])
+    await password_reset.queue_invites(repos, [
+        {"email": imported.user["email"], "full_name": imported.user["full_name"],
+         "token": invite_token(imported.user["email"])}
+        for imported in created if imported.password is None
+    ])
+    signups = Counter(
+        f"signups.{getattr(imported.user['user_type'], 'value', imported.user['user_type'])}"
+        for imported in created
+    )
+    await analytics.record_event(repos.db, dict(signups))
+    await analytics.users_changed(repos.db, [imported.user["id"] for imported in created])
+
+    results = []
+    for index, (line, imported) in enumerate(batch):
+        result = {"line": line, "email": imported.user["email"]}
+        if index in duplicates:
+            result["status"] = DUPLICATE
+        else:
+            result.update(status=CREATED, id=imported.user["id"])
+        results.append(result)
+    return results
@@ -0,0 +1,49 @@
+"""
+Shared process pool for CPU-bound work (PDF extraction, parsing, ...).
+
+Keeping heavy parsing out of the API process' event loop thread means a
+slow PDF never delays other requests.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+_pool: Optional[ProcessPoolExecutor] = None
+_background_tasks = set()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=int(os.environ.get("CPU_WORKERS", "2")))
+    return _pool
+
+
+async def run_cpu_bound(fn, *args):
+    """Run a picklable top-level function in the process pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), fn, *args)
+
+
+def spawn(coro):
+    """Fire-and-forget a coroutine, keeping a reference until it finishes"""
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def cancel_background_tasks():
+    tasks = list(_background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
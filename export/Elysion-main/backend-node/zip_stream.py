@@ -0,0 +1,73 @@
+"""
+On-the-fly ZIP archives.
+
+``stream_zip`` yields the archive chunk by chunk while entries are read, so
+an export never sits in memory or on disk. ``zipfile`` writes data
+descriptors when its output cannot seek, which is what lets each entry be
+emitted before its size and CRC are known.
+"""
+
+import io
+import zipfile
+from datetime import datetime
+from typing import AsyncIterator, Tuple
+
+
+class _Sink(io.RawIOBase):
+    """Write-only, non-seekable buffer drained after every write"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def unique_name(name: str, seen: set) -> str:
+    """``releve.pdf`` -> ``releve (2).pdf`` when the name is already taken"""
+    candidate, n = name, 1
+    while candidate in seen:
+        n += 1
+        stem, dot, ext = name.rpartition(".")
+        candidate = f"{stem} ({n}).{ext}" if dot else f"{name} ({n})"
+    seen.add(candidate)
+    return candidate
+
+
+async def stream_zip(
+    entries: AsyncIterator[Tuple[str, datetime, AsyncIterator[bytes]]],
+    compression: int = zipfile.ZIP_STORED,
+) -> AsyncIterator[bytes]:
+    """Yield a ZIP archive built from ``(name, modified_at, chunks)`` entries"""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, mode="w", compression=compression, allowZip64=True) as archive:
+        async for name, modified_at, chunks in entries:
+            info = zipfile.ZipInfo(name, date_time=(modified_at or datetime.utcnow()).timetuple()[:6])
+            info.compress_type = compression
+            with archive.open(info, mode="w", force_zip64=True) as entry:
+                async for chunk in chunks:
+                    entry.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
@@ -15,9 +15,10 @@ const Dashboard = () => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
 
-  const fetchDashboardData = useCallback(async () => {
+  const fetchDashboardData = useCallback(async (quiet = false) => {
     try {
-      setLoading(true);
+      // Refreshes pushed by the server keep the current view on screen
+      if (!quiet) setLoading(true);
       setError('');
       
       // Fetch dashboard data, simulation and documents in parallel
@@ -50,6 +51,46 @@ const Dashboard = () => {
     fetchDashboardData();
   }, [fetchDashboardData]);
 
+  // Refetch when the server announces a change (another tab, a background job)
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return undefined;
+    let source = null;
+    let retry = null;
+    let closed = false;
+    let lastEventId = '';
+
+    const open = async () => {
+      try {
+        // EventSource cannot send headers: it opens the stream with a
+        // short-lived ticket, so the access token never goes in a URL
+        const { data } = await axios.post(`${API}/changes/ticket`);
+        if (closed) return;
+        const params = new URLSearchParams({ ticket: data.ticket });
+        if (lastEventId) params.set('last_event_id', lastEventId);
+        source = new EventSource(`${API}/changes?${params}`);
+        source.addEventListener('change', (event) => {
+          if (event.lastEventId) lastEventId = event.lastEventId;
+          fetchDashboardData(true);
+        });
+        // The ticket only opens the stream: reconnect with a new one
+        source.onerror = () => {
+          source.close();
+          if (!closed) retry = setTimeout(open, 5000);
+        };
+      } catch (err) {
+        // 401: the session expired, there is nothing left to follow
+        if (!closed && err.response?.status !== 401) retry = setTimeout(open, 30000);
+      }
+    };
+
+    open();
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      if (source) source.close();
+    };
+  }, [fetchDashboardData]);
+
   // Calculate investment data from simulation results
   const getInvestmentData = () => {
     if (simulationData?.results) {
@@ -156,7 +197,7 @@ const Dashboard = () => {
         <div className="card-elysion text-center">
           <p className="text-red-600 mb-4">{error}</p>
           <button 
-            onClick={fetchDashboardData}
+            onClick={() => fetchDashboardData()}
             className="btn-elysion-primary"
             data-testid="dashboard-retry-btn"
           >
@@ -10,7 +10,6 @@ const ForgotPassword = () => {
   const [loading, setLoading] = useState(false);
   const [message, setMessage] = useState('');
   const [error, setError] = useState('');
-  const [resetLink, setResetLink] = useState('');
   const navigate = useNavigate();
 
   const handleSubmit = async (e) => {
@@ -18,16 +17,10 @@ const ForgotPassword = () => {
     setLoading(true);
     setError('');
     setMessage('');
-    setResetLink('');
 
     try {
       const response = await axios.post(`${API}/auth/forgot-password`, { email });
       setMessage(response.data.message);
-      
-      // For MVP, display the reset link (in production, this would be emailed)
-      if (response.data.reset_link) {
-        setResetLink(response.data.reset_link);
-      }
     } catch (err) {
       setError(err.response?.data?.detail || 'Une erreur s\'est produite. Veuillez réessayer.');
     } finally {
@@ -97,26 +90,6 @@ const ForgotPassword = () => {
                 </div>
               )}
 
-              {/* Reset Link (MVP only - remove in production) */}
-              {resetLink && (
-                <div className="bg-blue-50 border border-blue-200 rounded-lg p-4">
-                  <p className="text-sm font-semibold text-blue-800 mb-2">
-                    Lien de réinitialisation (Mode MVP) :
-                  </p>
-                  <a 
-                    href={resetLink} 
-                    className="text-xs text-blue-600 break-all hover:underline"
-                    target="_blank"
-                    rel="noopener noreferrer"
-                  >
-                    {resetLink}
-                  </a>
-                  <p className="text-xs text-gray-600 mt-2">
-                    En production, ce lien sera envoyé par email.
-                  </p>
-                </div>
-              )}
-
               {/* Submit Button */}
               <button
                 type="submit"
@@ -0,0 +1,21 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend is a flat set of modules, run from its own directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend-node"))
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine to completion (the tests are plain functions)"""
+    return asyncio.run
+
+
+@pytest.fixture
+def db(request):
+    """A fresh in-memory Mongo database, named after the test module"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return mongomock_motor.AsyncMongoMockClient()[request.module.__name__.rpartition(".")[2]]
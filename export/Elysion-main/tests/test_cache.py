@@ -0,0 +1,125 @@
+"""Two-tier cache: local hits, generation-bump invalidation, cross-worker broadcast"""
+
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("redis")
+
+from cache import Cache, LocalLRU, RedisTier  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    """One Redis-protocol stand-in shared by every worker of a test"""
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def worker(server):
+    """``worker()`` builds the Cache of one uvicorn worker"""
+    def create(shared=True):
+        tier = None
+        if shared:
+            tier = RedisTier("redis://localhost:6379/0", ttl=60)
+            tier.client = fakeredis.FakeAsyncRedis(server=server)
+        return Cache(LocalLRU(100, ttl=60), tier)
+    return create
+
+
+class Loader:
+    """Returns the next value on each call and counts the calls"""
+
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.values.pop(0)
+
+
+def _get(cache, load, kind="dashboard"):
+    return cache.get_or_load("u1", kind, load, encode=str.encode, decode=bytes.decode)
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_local_hit_then_invalidate(worker, run, shared):
+    cache = worker(shared)
+    load = Loader("v1", "v2")
+
+    async def scenario():
+        first = await _get(cache, load)
+        second = await _get(cache, load)
+        calls = load.calls
+        await cache.invalidate("u1")
+        return first, second, calls, await _get(cache, load)
+
+    first, second, calls, after = run(scenario())
+    assert (first, second) == ("v1", "v1")
+    assert calls == 1
+    assert after == "v2"
+    assert load.calls == 2
+
+
+def test_invalidation_reaches_another_worker(worker, run):
+    a, b = worker(), worker()
+    load = Loader("v1", "v2")
+
+    async def scenario():
+        listener = asyncio.ensure_future(b.listen_for_invalidations())
+        try:
+            await _get(a, load)
+            # Filled by a: b reads it from the shared tier, then locally
+            from_shared = await _get(b, load)
+            await asyncio.sleep(0.05)
+            await a.invalidate("u1")
+            for _ in range(100):
+                if b.local.get("u1", "dashboard") is None:
+                    break
+                await asyncio.sleep(0.01)
+            evicted = b.local.get("u1", "dashboard") is None
+            return from_shared, evicted, await _get(b, load)
+        finally:
+            listener.cancel()
+            await asyncio.gather(listener, return_exceptions=True)
+            await a.close()
+            await b.close()
+
+    from_shared, evicted, after = run(scenario())
+    assert from_shared == "v1"
+    assert evicted
+    assert after == "v2"
+    assert load.calls == 2
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_fill_that_raced_an_invalidation_is_never_served(worker, run, shared):
+    cache = worker(shared)
+
+    async def stale():
+        # A write (and its invalidation) lands while this value is loaded
+        await cache.invalidate("u1")
+        return "stale"
+
+    async def scenario():
+        raced = await _get(cache, stale)
+        return raced, await _get(cache, Loader("fresh"))
+
+    raced, after = run(scenario())
+    # The caller gets what it loaded, but nobody reads it from the cache again
+    assert raced == "stale"
+    assert after == "fresh"
+
+
+def test_shared_values_of_an_old_generation_are_not_read(worker, run):
+    a, b, c = worker(), worker(), worker()
+
+    async def scenario():
+        await _get(a, Loader("v1"))
+        await b.invalidate("u1")
+        # c has nothing locally: only the shared tier could serve v1
+        return await _get(c, Loader("v2"))
+
+    assert run(scenario()) == "v2"
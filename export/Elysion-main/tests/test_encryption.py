@@ -0,0 +1,112 @@
+"""Chunked AES-GCM: round trips, range reads, tampering"""
+
+import base64
+import os
+
+import pytest
+
+pytest.importorskip("cryptography")
+pytest.importorskip("aiofiles")
+
+from cryptography.exceptions import InvalidTag  # noqa: E402
+
+import encryption  # noqa: E402
+from storage import LocalStorage  # noqa: E402
+
+CHUNK = 16
+SEALED = CHUNK + encryption.TAG_SIZE
+
+
+@pytest.fixture(autouse=True)
+def master_key(monkeypatch):
+    monkeypatch.setenv("DOCUMENT_MASTER_KEY", base64.b64encode(os.urandom(32)).decode())
+    monkeypatch.delenv("DOCUMENT_MASTER_KEY_ID", raising=False)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage(tmp_path)
+
+
+async def _chunks(data: bytes, step: int = 7):
+    for i in range(0, len(data), step):
+        yield data[i:i + step]
+
+
+async def store(storage, data: bytes) -> dict:
+    """Encrypt ``data`` into storage; returns the document row"""
+    data_key, metadata = encryption.new_document_key(chunk_size=CHUNK)
+    stored = await storage.save("doc", encryption.encrypt_stream(_chunks(data), data_key, metadata))
+    assert stored == encryption.encrypted_size(len(data), CHUNK)
+    assert encryption.plaintext_size(stored, CHUNK) == len(data)
+    return {"encryption": metadata, "file_size": len(data), "key": "doc"}
+
+
+async def read(storage, document: dict, start: int = 0, end=None) -> bytes:
+    return b"".join([chunk async for chunk in encryption.decrypt_range(
+        storage, document["key"], encryption.unwrap_key(document["encryption"]),
+        document["encryption"], document["file_size"], start, end
+    )])
+
+
+def raw(storage) -> bytes:
+    return storage.local_path("doc").read_bytes()
+
+
+def rewrite(storage, data: bytes):
+    storage.local_path("doc").write_bytes(data)
+
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 3 * CHUNK + 5])
+def test_round_trip(storage, size, run):
+    data = os.urandom(size)
+    document = run(store(storage, data))
+    assert run(read(storage, document)) == data
+    if size >= 8:
+        assert data[:8] not in raw(storage)
+
+
+def test_range_reads_match_the_plaintext(storage, run):
+    data = os.urandom(5 * CHUNK + 3)
+    document = run(store(storage, data))
+    for start, end in [(0, 0), (0, CHUNK - 1), (CHUNK - 1, CHUNK), (5, 3 * CHUNK + 2),
+                       (len(data) - 1, len(data) - 1), (2 * CHUNK, None), (40, 10_000)]:
+        expected = data[start:] if end is None else data[start:end + 1]
+        assert run(read(storage, document, start, end)) == expected
+
+
+def test_truncated_file_is_detected(storage, run):
+    data = os.urandom(3 * CHUNK)
+    document = run(store(storage, data))
+    rewrite(storage, raw(storage)[:2 * SEALED])
+    with pytest.raises(encryption.EncryptionError):
+        run(read(storage, document))
+
+
+def test_truncation_with_a_matching_size_fails_authentication(storage, run):
+    data = os.urandom(3 * CHUNK)
+    document = run(store(storage, data))
+    # The size was shortened too: the new last chunk was not sealed as last
+    rewrite(storage, raw(storage)[:2 * SEALED])
+    document["file_size"] = 2 * CHUNK
+    with pytest.raises(InvalidTag):
+        run(read(storage, document))
+
+
+def test_reordered_chunks_fail_authentication(storage, run):
+    data = os.urandom(3 * CHUNK)
+    document = run(store(storage, data))
+    sealed = raw(storage)
+    rewrite(storage, sealed[SEALED:2 * SEALED] + sealed[:SEALED] + sealed[2 * SEALED:])
+    with pytest.raises(InvalidTag):
+        run(read(storage, document))
+
+
+def test_flipped_bit_fails_authentication(storage, run):
+    data = os.urandom(2 * CHUNK)
+    document = run(store(storage, data))
+    sealed = bytearray(raw(storage))
+    sealed[3] ^= 1
+    rewrite(storage, bytes(sealed))
+    with pytest.raises(InvalidTag):
+        run(read(storage, document, CHUNK // 2, CHUNK // 2))
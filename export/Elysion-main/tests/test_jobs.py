@@ -0,0 +1,207 @@
+"""Job worker: retries, lease loss, release on shutdown"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+import jobs  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(jobs, "_handlers", {})
+    monkeypatch.setattr(jobs, "_wakeups", {})
+    monkeypatch.setattr(jobs, "LEASE", 0.3)
+    monkeypatch.setattr(jobs, "POLL_INTERVAL", 0.05)
+
+
+async def _job(db, job_id):
+    return await db.jobs.find_one({"_id": job_id})
+
+
+def test_parse_queues():
+    assert jobs.parse_queues("default:4, documents:2,mail") == {"default": 4, "documents": 2, "mail": 1}
+    assert jobs.parse_queues("default:0") == {"default": 1}
+
+
+def test_failure_is_retried_then_succeeds(db, run):
+    calls = []
+
+    @jobs.job("test.flaky")
+    async def flaky(db, payload):
+        calls.append(payload["n"])
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+
+    async def scenario():
+        worker = jobs.JobWorker(db, {"default": 1})
+        job_id = await jobs.enqueue(db, "test.flaky", {"n": 1})
+        await worker._execute(await worker._claim("default"))
+        failed = await _job(db, job_id)
+        # Not claimable before its backoff
+        early = await worker._claim("default")
+        await db.jobs.update_one({"_id": job_id}, {"$set": {"run_at": datetime.utcnow()}})
+        await worker._execute(await worker._claim("default"))
+        return failed, early, await _job(db, job_id)
+
+    failed, early, done = run(scenario())
+    assert failed["status"] == jobs.PENDING
+    assert failed["last_error"] == "RuntimeError: boom"
+    assert failed["run_at"] > datetime.utcnow()
+    assert failed["lease_owner"] is None
+    assert early is None
+    assert done["status"] == jobs.DONE
+    assert done["attempts"] == 2
+    assert calls == [1, 1]
+
+
+def test_last_attempt_fails_for_good(db, run):
+    failures = []
+
+    async def on_failure(db, payload, error):
+        failures.append((payload, str(error)))
+
+    @jobs.job("test.broken", max_attempts=1, on_failure=on_failure)
+    async def broken(db, payload):
+        raise ValueError("no")
+
+    async def scenario():
+        worker = jobs.JobWorker(db, {"default": 1})
+        job_id = await jobs.enqueue(db, "test.broken", {"n": 2})
+        await worker._execute(await worker._claim("default"))
+        return await _job(db, job_id)
+
+    row = run(scenario())
+    assert row["status"] == jobs.FAILED
+    assert row["last_error"] == "ValueError: no"
+    assert "finished_at" in row
+    assert failures == [({"n": 2}, "no")]
+
+
+def test_expired_lease_is_claimed_again(db, run):
+    async def scenario():
+        await db.jobs.insert_one({
+            "_id": "stale", "name": "test.any", "queue": "default", "payload": {},
+            "status": jobs.RUNNING, "attempts": 1, "max_attempts": 5,
+            "run_at": datetime.utcnow() - timedelta(minutes=5),
+            "lease_owner": "dead-worker", "lease_expires_at": datetime.utcnow() - timedelta(seconds=1),
+        })
+        worker = jobs.JobWorker(db, {"default": 1})
+        return worker, await worker._claim("default")
+
+    worker, claimed = run(scenario())
+    assert claimed["_id"] == "stale"
+    assert claimed["lease_owner"] == worker.owner
+    assert claimed["attempts"] == 2
+
+
+def test_lost_lease_cancels_the_handler(db, run):
+    cancelled = []
+
+    @jobs.job("test.slow")
+    async def slow(db, payload):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(payload["n"])
+            raise
+
+    async def scenario():
+        worker = jobs.JobWorker(db, {"default": 1})
+        job_id = await jobs.enqueue(db, "test.slow", {"n": 3})
+        execution = asyncio.ensure_future(worker._execute(await worker._claim("default")))
+        await asyncio.sleep(0.05)
+        # Another worker took the job over (this one looked dead)
+        await db.jobs.update_one({"_id": job_id}, {"$set": {"lease_owner": "other-worker"}})
+        await asyncio.wait_for(execution, 2)
+        return await _job(db, job_id)
+
+    row = run(scenario())
+    assert cancelled == [3]
+    # Left to the new owner: neither finished nor released
+    assert row["status"] == jobs.RUNNING
+    assert row["lease_owner"] == "other-worker"
+    assert row["attempts"] == 1
+
+
+def test_lease_is_renewed_while_the_handler_runs(db, run):
+    @jobs.job("test.long")
+    async def long(db, payload):
+        await asyncio.sleep(jobs.LEASE * 2)
+
+    async def scenario():
+        worker = jobs.JobWorker(db, {"default": 1})
+        job_id = await jobs.enqueue(db, "test.long", {})
+        await worker._execute(await worker._claim("default"))
+        return await _job(db, job_id)
+
+    row = run(scenario())
+    assert row["status"] == jobs.DONE
+    assert row["attempts"] == 1
+
+
+def test_shutdown_releases_running_jobs(db, run):
+    started = []
+
+    @jobs.job("test.blocking")
+    async def blocking(db, payload):
+        started.append(payload["n"])
+        await asyncio.sleep(10)
+
+    async def scenario():
+        worker = jobs.JobWorker(db, {"default": 2})
+        job_id = await jobs.enqueue(db, "test.blocking", {"n": 4})
+        running = asyncio.ensure_future(worker.run())
+        for _ in range(100):
+            if started:
+                break
+            await asyncio.sleep(0.01)
+        claimed = await _job(db, job_id)
+        running.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await running
+        return claimed, await _job(db, job_id)
+
+    claimed, released = run(scenario())
+    assert started == [4]
+    assert claimed["status"] == jobs.RUNNING
+    assert released["status"] == jobs.PENDING
+    assert released["lease_owner"] is None
+    # The interrupted attempt is not counted
+    assert released["attempts"] == 0
+    assert released["run_at"] <= datetime.utcnow()
+
+
+def test_shutdown_leaves_cpu_jobs_to_their_lease(db, monkeypatch, run):
+    started = []
+
+    async def run_cpu_bound(fn, payload):
+        # Stands for a pool process, which cancelling does not stop
+        started.append(payload["n"])
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(jobs.workers, "run_cpu_bound", run_cpu_bound)
+    jobs.job("test.cpu", cpu=True)(len)
+
+    async def scenario():
+        worker = jobs.JobWorker(db, {"default": 1})
+        job_id = await jobs.enqueue(db, "test.cpu", {"n": 5})
+        running = asyncio.ensure_future(worker.run())
+        for _ in range(100):
+            if started:
+                break
+            await asyncio.sleep(0.01)
+        running.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await running
+        return worker, await _job(db, job_id)
+
+    worker, row = run(scenario())
+    assert started == [5]
+    # Not claimable before the pool is done with it
+    assert row["status"] == jobs.RUNNING
+    assert row["lease_owner"] == worker.owner
+    assert row["lease_expires_at"] > datetime.utcnow()
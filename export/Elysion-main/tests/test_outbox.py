@@ -0,0 +1,244 @@
+"""Outbox: batching, retries, collapsing and the SMTP pool (against aiosmtpd)"""
+
+import logging
+import smtplib
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+import outbox  # noqa: E402
+
+
+class FakeTransport:
+    """Records each batch; ``errors`` maps a recipient to the error it gets"""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.batches = []
+
+    async def send(self, messages):
+        self.batches.append([message["To"] for message in messages])
+        return [self.errors.get(message["To"]) for message in messages]
+
+    async def close(self):
+        pass
+
+
+async def queue(db, *recipients, **options):
+    return [await outbox.queue_email(db, to, "Sujet", f"Lien pour {to}", kind="test", **options)
+            for to in recipients]
+
+
+def test_drains_in_batches(db, monkeypatch, run):
+    monkeypatch.setattr(outbox, "BATCH_SIZE", 3)
+    transport = FakeTransport()
+    sender = outbox.OutboxSender(db, transport=transport)
+
+    async def scenario():
+        await queue(db, *(f"u{i}@example.com" for i in range(7)))
+        return [await sender.drain_once() for _ in range(4)]
+
+    assert run(scenario()) == [3, 3, 1, 0]
+    assert [len(batch) for batch in transport.batches] == [3, 3, 1]
+    rows = run(db.email_outbox.find({}).to_list(None))
+    assert {row["status"] for row in rows} == {outbox.SENT}
+    # Sent bodies (reset links) are not kept
+    assert not any("body" in row for row in rows)
+
+
+def test_temporary_failure_is_retried_with_backoff(db, run):
+    transport = FakeTransport({"down@example.com": ConnectionError("refused")})
+    sender = outbox.OutboxSender(db, transport=transport)
+
+    async def scenario():
+        [email_id] = await queue(db, "down@example.com")
+        await sender.drain_once()
+        row = await db.email_outbox.find_one({"_id": email_id})
+        # Not due yet: the next drain leaves it alone
+        assert await sender.drain_once() == 0
+        return row
+
+    row = run(scenario())
+    assert row["status"] == outbox.PENDING
+    assert row["attempts"] == 1
+    assert row["send_after"] > datetime.utcnow() + timedelta(seconds=outbox.RETRY_BASE / 2)
+    assert "ConnectionError" in row["last_error"]
+
+
+def test_permanent_failure_and_exhausted_attempts_fail(db, monkeypatch, run):
+    monkeypatch.setattr(outbox, "MAX_ATTEMPTS", 2)
+    refused = smtplib.SMTPRecipientsRefused({"bad@example.com": (550, b"no such user")})
+    transport = FakeTransport({"bad@example.com": refused, "down@example.com": ConnectionError("refused")})
+    sender = outbox.OutboxSender(db, transport=transport)
+
+    async def scenario():
+        bad, down = await queue(db, "bad@example.com", "down@example.com")
+        await sender.drain_once()
+        await db.email_outbox.update_one({"_id": down}, {"$set": {"send_after": datetime.utcnow()}})
+        await sender.drain_once()
+        return await db.email_outbox.find_one({"_id": bad}), await db.email_outbox.find_one({"_id": down})
+
+    bad, down = run(scenario())
+    assert (bad["status"], bad["attempts"]) == (outbox.FAILED, 1)
+    assert (down["status"], down["attempts"]) == (outbox.FAILED, 2)
+
+
+def test_collapse_key_drops_repeats_within_the_window(db, run):
+    async def scenario():
+        first = await queue(db, "a@example.com", collapse_key="reset:a", window=300)
+        second = await queue(db, "a@example.com", collapse_key="reset:a", window=300)
+        other = await queue(db, "b@example.com", collapse_key="reset:b", window=300)
+        return first + second + other, await db.email_outbox.count_documents({})
+
+    ids, count = run(scenario())
+    assert ids[0] is not None and ids[1] is None and ids[2] is not None
+    assert count == 2
+
+
+def test_expired_lease_is_reclaimed(db, run):
+    transport = FakeTransport()
+    sender = outbox.OutboxSender(db, transport=transport)
+
+    async def scenario():
+        [email_id] = await queue(db, "a@example.com")
+        # Claimed by a sender that died
+        await db.email_outbox.update_one({"_id": email_id}, {"$set": {
+            "status": outbox.SENDING, "lease_owner": "dead", "attempts": 1,
+            "lease_expires_at": datetime.utcnow() - timedelta(seconds=1),
+        }})
+        await sender.drain_once()
+        return await db.email_outbox.find_one({"_id": email_id})
+
+    row = run(scenario())
+    assert row["status"] == outbox.SENT
+    assert transport.batches == [["a@example.com"]]
+
+
+def test_log_transport_never_logs_the_body(caplog, run):
+    row = {"_id": "abc", "to": "a@example.com", "subject": "Sujet", "body": "https://x/reset?token=secret"}
+    with caplog.at_level(logging.INFO, logger="outbox"):
+        run(outbox.LogTransport().send([outbox.build_message(row, "no-reply@elysion.fr")]))
+    assert "a@example.com" in caplog.text
+    assert "secret" not in caplog.text
+
+
+def test_smtp_is_required_outside_development(monkeypatch):
+    monkeypatch.delenv("SMTP_HOST", raising=False)
+    monkeypatch.setenv("APP_ENV", "production")
+    with pytest.raises(ValueError):
+        outbox.create_transport()
+
+
+@pytest.mark.parametrize("error, permanent", [
+    (smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no such user")}), True),
+    (smtplib.SMTPDataError(554, b"message rejected"), True),
+    (smtplib.SMTPDataError(451, b"try later"), False),
+    (smtplib.SMTPSenderRefused(553, b"sender not allowed", "no-reply@elysion.fr"), False),
+    (outbox.SMTPUnavailable("SMTPAuthenticationError: (535, b'bad credentials')"), False),
+    (ConnectionError("refused"), False),
+])
+def test_is_permanent(error, permanent):
+    assert outbox.is_permanent(error) is permanent
+
+
+def test_refused_sender_is_retried(db, run):
+    refused = smtplib.SMTPSenderRefused(553, b"sender not allowed", "no-reply@elysion.fr")
+    sender = outbox.OutboxSender(db, transport=FakeTransport({"a@example.com": refused}))
+
+    async def scenario():
+        [email_id] = await queue(db, "a@example.com")
+        await sender.drain_once()
+        return await db.email_outbox.find_one({"_id": email_id})
+
+    row = run(scenario())
+    assert row["status"] == outbox.PENDING
+    assert "SMTPSenderRefused" in row["last_error"]
+
+
+class Handler:
+    def __init__(self):
+        self.received = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received.append(envelope.rcpt_tos[0])
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp_server():
+    """Start a local aiosmtpd server; ``start(**options)`` returns its port"""
+    controller_module = pytest.importorskip("aiosmtpd.controller")
+    controllers = []
+
+    def start(handler, **options):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        controller = controller_module.Controller(handler, hostname="127.0.0.1", port=port, **options)
+        controller.start()
+        controllers.append(controller)
+        return port
+
+    yield start
+    for controller in controllers:
+        controller.stop()
+
+
+def _messages(count):
+    return [outbox.build_message({"_id": str(i), "to": f"u{i}@example.com", "subject": "S", "body": "B"},
+                                 "no-reply@elysion.fr") for i in range(count)]
+
+
+async def _send(pool, messages):
+    try:
+        return await pool.send(messages)
+    finally:
+        await pool.close()
+
+
+def test_smtp_pool_sends_over_persistent_connections(smtp_server, run):
+    handler = Handler()
+    pool = outbox.SMTPPool("127.0.0.1", smtp_server(handler), security="none", size=2)
+
+    assert run(_send(pool, _messages(5))) == [None] * 5
+    assert sorted(handler.received) == sorted(f"u{i}@example.com" for i in range(5))
+
+
+def test_wrong_smtp_password_is_retried(db, smtp_server, run):
+    smtp = pytest.importorskip("aiosmtpd.smtp")
+
+    def authenticator(server, session, envelope, mechanism, auth_data):
+        # Not handled: the server answers 535 itself on failure
+        return smtp.AuthResult(success=auth_data.password == b"secret", handled=False)
+
+    handler = Handler()
+    port = smtp_server(handler, authenticator=authenticator, auth_require_tls=False)
+
+    def pool(password):
+        return outbox.SMTPPool("127.0.0.1", port, security="none", username="elysion", password=password,
+                               size=1, timeout=5)
+
+    results = run(_send(pool("wrong"), _messages(2)))
+    assert [type(error) for error in results] == [outbox.SMTPUnavailable] * 2
+    assert "SMTPAuthenticationError" in str(results[0])
+
+    sender = outbox.OutboxSender(db, transport=pool("wrong"))
+
+    async def scenario():
+        [email_id] = await queue(db, "a@example.com")
+        try:
+            await sender.drain_once()
+        finally:
+            await sender.transport.close()
+        return await db.email_outbox.find_one({"_id": email_id})
+
+    row = run(scenario())
+    assert row["status"] == outbox.PENDING
+    assert "SMTPAuthenticationError" in row["last_error"]
+    assert handler.received == []
+
+    assert run(_send(pool("secret"), _messages(1))) == [None]
+    assert handler.received == ["u0@example.com"]
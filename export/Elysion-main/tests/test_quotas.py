@@ -0,0 +1,96 @@
+"""Quotas: concurrent reservations never overshoot the limits"""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+import quotas  # noqa: E402
+from repositories import memory_repositories, mongo_repositories  # noqa: E402
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def repos(request):
+    if request.param == "memory":
+        return memory_repositories()
+    db = request.getfixturevalue("db")
+    return mongo_repositories(db.client, db.name)
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setenv("QUOTA_MAX_BYTES", "100")
+    monkeypatch.setenv("QUOTA_MAX_FILES", "1000")
+    monkeypatch.delenv("QUOTA_MAX_BYTES_STUDENT", raising=False)
+    monkeypatch.delenv("QUOTA_MAX_FILES_STUDENT", raising=False)
+
+
+async def _attempt(repos, size, files=1, user_type=None):
+    try:
+        await quotas.reserve(repos, "u1", user_type, size, files)
+        return True
+    except quotas.QuotaExceeded:
+        return False
+
+
+async def _reserve_all(repos, count, size, files=1, user_type=None):
+    return await asyncio.gather(*(_attempt(repos, size, files, user_type) for _ in range(count)))
+
+
+def test_concurrent_reservations_stop_at_max_bytes(repos, run):
+    async def scenario():
+        results = await _reserve_all(repos, 30, 10)
+        return results, await quotas.get_usage(repos, "u1")
+
+    results, usage = run(scenario())
+    assert results.count(True) == 10
+    assert usage == {"bytes": 100, "files": 10}
+
+
+def test_concurrent_reservations_stop_at_max_files(repos, monkeypatch, run):
+    monkeypatch.setenv("QUOTA_MAX_FILES", "3")
+
+    async def scenario():
+        results = await _reserve_all(repos, 12, 1)
+        return results, await quotas.get_usage(repos, "u1")
+
+    results, usage = run(scenario())
+    assert results.count(True) == 3
+    assert usage == {"bytes": 3, "files": 3}
+
+
+def test_counter_starts_from_existing_documents(repos, run):
+    async def scenario():
+        for i, size in enumerate((40, 35)):
+            await repos.documents.insert({
+                "id": f"d{i}", "user_id": "u1", "category": "autre",
+                "file_size": size, "uploaded_at": datetime.utcnow(),
+            })
+        results = await _reserve_all(repos, 5, 10)
+        return results, await quotas.get_usage(repos, "u1")
+
+    results, usage = run(scenario())
+    assert results.count(True) == 2
+    assert usage == {"bytes": 95, "files": 4}
+
+
+def test_release_makes_room_again(repos, run):
+    async def scenario():
+        await _reserve_all(repos, 10, 10)
+        refused = await _attempt(repos, 10)
+        await quotas.release(repos, "u1", 10)
+        return refused, await _attempt(repos, 10), await quotas.get_usage(repos, "u1")
+
+    refused, accepted, usage = run(scenario())
+    assert refused is False
+    assert accepted is True
+    assert usage == {"bytes": 100, "files": 10}
+
+
+def test_user_type_overrides_the_default_limit(repos, monkeypatch, run):
+    monkeypatch.setenv("QUOTA_MAX_BYTES_STUDENT", "30")
+
+    results = run(_reserve_all(repos, 8, 10, user_type="student"))
+    assert results.count(True) == 3
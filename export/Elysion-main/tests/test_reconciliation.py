@@ -0,0 +1,132 @@
+"""Storage reconciliation: the rows/files diff, quarantine and purge"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+pytest.importorskip("aiofiles")
+
+import reconciliation  # noqa: E402
+from storage import LocalStorage  # noqa: E402
+
+OLD = 3 * 3600
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage(tmp_path)
+
+
+async def _one(data: bytes):
+    yield data
+
+
+async def _put(storage, key: str, age: float = OLD):
+    await storage.save(key, _one(key.encode()))
+    mtime = time.time() - age
+    os.utime(storage.local_path(key), (mtime, mtime))
+
+
+async def _row(db, document_id: str, storage_key=None, **fields):
+    row = {"id": document_id, "storage_backend": "local", **fields}
+    if storage_key is not None:
+        row["storage_key"] = storage_key
+    await db.documents.insert_one(row)
+
+
+async def _layout(db, storage):
+    await _row(db, "kept", "aa/01/kept.pdf")
+    await _row(db, "back", "aa/02/back.pdf", file_missing=True)
+    await _row(db, "lost", "bb/01/lost.pdf")
+    await _row(db, "legacy")
+    for key in ("aa/01/kept.pdf", "aa/02/back.pdf", "cc/01/orphan.pdf", "exports/u1/export.zip",
+                "quarantine/20240101/dd/01/old.pdf", "flat.pdf"):
+        await _put(storage, key)
+    await _put(storage, "cc/02/uploading.pdf", age=60)
+
+
+def _reconcile(db, storage, **options):
+    return reconciliation.reconcile(db, storage, rate=0, **options)
+
+
+async def _documents(db):
+    return {row["id"]: row async for row in db.documents.find({}, {"_id": 0})}
+
+
+async def _keys(storage):
+    return [obj.key async for obj in storage.list_objects()]
+
+
+def test_diff_flags_rows_and_quarantines_files(db, storage, run):
+    async def scenario():
+        await _layout(db, storage)
+        stats = await _reconcile(db, storage)
+        return stats, await _documents(db), await _keys(storage), \
+            await db.storage_quarantine.find({}, {"_id": 0}).to_list(None)
+
+    stats, documents, keys, quarantined = run(scenario())
+    assert stats == {
+        "matched": 2, "orphan_files": 2, "quarantined": 1, "too_recent": 1,
+        "missing_files": 1, "flagged": 1, "unflagged": 1,
+        "purged": 0, "restored": 0, "legacy_files": 1, "legacy_rows": 1,
+    }
+    assert documents["lost"]["file_missing"] is True
+    assert "file_missing_since" in documents["lost"]
+    assert "file_missing" not in documents["back"]
+    assert "file_missing" not in documents["kept"]
+
+    day = f"{datetime.utcnow():%Y%m%d}"
+    assert f"quarantine/{day}/cc/01/orphan.pdf" in keys
+    assert "cc/01/orphan.pdf" not in keys
+    # Too recent, another module's prefix, legacy layout: left alone
+    for key in ("cc/02/uploading.pdf", "exports/u1/export.zip", "flat.pdf", "quarantine/20240101/dd/01/old.pdf"):
+        assert key in keys
+    assert [(q["key"], q["quarantine_key"]) for q in quarantined] == \
+        [("cc/01/orphan.pdf", f"quarantine/{day}/cc/01/orphan.pdf")]
+
+
+def test_dry_run_changes_nothing(db, storage, run):
+    async def scenario():
+        await _layout(db, storage)
+        before = await _documents(db), await _keys(storage)
+        stats = await _reconcile(db, storage, dry_run=True)
+        after = await _documents(db), await _keys(storage)
+        return stats, before, after, await db.storage_quarantine.count_documents({})
+
+    stats, before, after, quarantined = run(scenario())
+    assert (stats["flagged"], stats["unflagged"], stats["quarantined"]) == (1, 1, 1)
+    assert before == after
+    assert quarantined == 0
+
+
+def test_quarantine_is_purged_or_restored_after_the_grace_period(db, storage, run):
+    now = datetime.utcnow()
+
+    async def quarantined(key, days_ago):
+        quarantine_key = f"quarantine/old/{key}"
+        await _put(storage, quarantine_key)
+        await db.storage_quarantine.insert_one({
+            "backend": "local", "key": key, "quarantine_key": quarantine_key,
+            "size": 1, "quarantined_at": now - timedelta(days=days_ago),
+        })
+
+    async def scenario():
+        await quarantined("ee/01/gone.pdf", 10)
+        await quarantined("ee/02/claimed.pdf", 10)
+        await quarantined("ee/03/recent.pdf", 1)
+        # A row showed up for this file after it was quarantined
+        await _row(db, "claimed", "ee/02/claimed.pdf")
+        stats = await _reconcile(db, storage, grace=timedelta(days=7))
+        remaining = [q["key"] async for q in db.storage_quarantine.find({})]
+        return stats, await _keys(storage), remaining
+
+    stats, keys, remaining = run(scenario())
+    assert (stats["purged"], stats["restored"]) == (1, 1)
+    assert "quarantine/old/ee/01/gone.pdf" not in keys
+    assert "ee/02/claimed.pdf" in keys
+    assert "quarantine/old/ee/02/claimed.pdf" not in keys
+    assert "quarantine/old/ee/03/recent.pdf" in keys
+    assert remaining == ["ee/03/recent.pdf"]
@@ -0,0 +1,212 @@
+"""Retirement calculations: the worked examples of the docs, and properties on random profiles"""
+
+import random
+
+import pytest
+
+import retirement
+
+SAMPLES = 500
+SEED = 20240101
+
+
+def days(count):
+    return retirement.convert_to_months(count, "days")
+
+
+# ----------------------------------------------------------------------------
+# Golden values: CALCUL_RETRAITE_SALARIE.md
+# ----------------------------------------------------------------------------
+
+def test_employee_rate_with_decote_and_surcote():
+    # 3. Taux : 10 trimestres manquants, 8 trimestres supplémentaires
+    rate, decote, _ = retirement.pension_rate(62, 162, 172)
+    assert (decote, rate) == pytest.approx((0.125, 0.4375))
+    rate, _, surcote = retirement.pension_rate(62, 180, 172)
+    assert (surcote, rate) == pytest.approx((0.10, 0.55))
+    # Décote plafonnée à 25%
+    _, decote, _ = retirement.pension_rate(62, 100, 172)
+    assert decote == pytest.approx(0.25)
+
+
+def test_agirc_arrco_points():
+    # 4. 8 500 points × 1,4386
+    complementary = retirement.points_pension(8500)
+    assert round(complementary["annual"]) == 12228
+    assert round(complementary["monthly"]) == 1019
+
+
+@pytest.mark.parametrize("quarters, months, expected", [
+    # 100 jours = 3.33 mois et 3.33 / 1.67 = 1.996 : la formule (partagée avec
+    # le simulateur React) donne 1 trimestre, l'exemple du document arrondit à 2
+    (retirement.unemployment_quarters, days(100), 1),
+    (retirement.unemployment_quarters, 6, 3),
+    (retirement.parental_leave_quarters, days(180), 2),
+    (retirement.parental_leave_quarters, 24, 8),
+    (retirement.parental_leave_quarters, 48, 12),
+    (retirement.sick_leave_quarters, days(120), 2),
+    (retirement.sick_leave_quarters, 6, 3),
+])
+def test_assimilated_quarters(quarters, months, expected):
+    assert quarters(months) == expected
+
+
+@pytest.mark.parametrize("children", [1, 2, 3])
+def test_children_quarters(children):
+    assert retirement.children_quarters("F", children) == children * 8
+    assert retirement.children_quarters("M", children) == 0
+
+
+def test_employee_worked_example():
+    # 5. Salariée de 45 ans, 2 enfants, 22 ans de carrière
+    quarters = retirement.private_quarters(
+        full_time_years=22, unemployment_months=days(100), parental_months=18, gender="F", children=2
+    )
+    assert (quarters["worked"], quarters["parental"], quarters["children"]) == (88, 6, 16)
+    # 112 dans le document (chômage compté 2, voir test_assimilated_quarters)
+    assert quarters["total"] == 111
+
+    at_62 = retirement.employee_scenarios(45, 1980, [48000] * 22, quarters["total"], agirc_arrco_points=6200)[0]
+    assert at_62["totalQuarters"] == 172
+    assert at_62["details"]["decote"] == 0
+    assert at_62["details"]["rate"] == pytest.approx(50)
+    # 48 000 × 50% / 12 et 6 200 × 1,4386 / 12
+    assert at_62["basePension"] == pytest.approx(2000)
+    assert at_62["complementary"] == pytest.approx(6200 * 1.4386 / 12)
+
+
+# ----------------------------------------------------------------------------
+# Golden values: CALCUL_RETRAITE_FREELANCE.md
+# ----------------------------------------------------------------------------
+
+def test_freelance_rate_with_decote_and_surcote():
+    rate, decote, _ = retirement.pension_rate(62, 164, 172, surcote_age=retirement.FULL_RATE_AGE)
+    assert (decote, rate) == pytest.approx((0.10, 0.45))
+    rate, _, surcote = retirement.pension_rate(67, 184, 172, surcote_age=retirement.FULL_RATE_AGE)
+    assert (surcote, rate) == pytest.approx((0.15, 0.575))
+    # Pas de surcote SSI avant 67 ans
+    _, _, surcote = retirement.pension_rate(64, 184, 172, surcote_age=retirement.FULL_RATE_AGE)
+    assert surcote == 0
+
+
+def test_rci_points():
+    complementary = retirement.points_pension(5250)
+    assert round(complementary["annual"]) == 7553
+    assert round(complementary["monthly"]) == 629
+
+
+def test_micro_revenue_conversion():
+    assert retirement.convert_micro_revenue(60000, "service_bnc") == pytest.approx(39600)
+
+
+@pytest.mark.parametrize("quarters, revenue", sorted(retirement.QUARTER_THRESHOLDS.items()))
+def test_quarter_thresholds(quarters, revenue):
+    assert retirement.quarters_for_revenue(revenue) == quarters
+    assert retirement.quarters_for_revenue(revenue - 1) == quarters - 1
+
+
+def test_freelance_worked_example():
+    # 6. Freelance de 40 ans, 2 enfants, 15 ans à 50 000 €
+    revenues = [50000] * 15
+    contributed = sum(retirement.quarters_for_revenue(r) for r in revenues)
+    unemployment = retirement.unemployment_quarters(days(150))
+    parental = retirement.parental_leave_quarters(12)
+    children = retirement.children_quarters("F", 2)
+    # 5 / 1.67 = 2.994 : 2 trimestres de chômage par la formule, 3 dans le document
+    assert (contributed, unemployment, parental, children) == (60, 2, 4, 16)
+    total = contributed + unemployment + parental + children
+    assert total == 82
+
+    at_62 = retirement.freelance_scenarios(40, 1985, revenues, total)[0]
+    assert at_62["totalQuarters"] == 82 + 22 * 4
+    assert at_62["details"]["rate"] == pytest.approx(48.75)
+
+
+# ----------------------------------------------------------------------------
+# Properties, on seeded random profiles
+# ----------------------------------------------------------------------------
+
+@pytest.fixture
+def rng():
+    return random.Random(SEED)
+
+
+def test_more_quarters_never_lowers_the_base_pension(rng):
+    for _ in range(SAMPLES):
+        income = rng.uniform(0, 200_000)
+        age = rng.randint(55, 70)
+        birth_year = rng.choice([None, 1955, 1965, 1980])
+        quarters = rng.randint(0, 200)
+        extra = rng.randint(1, 40)
+        before = retirement.base_pension(income, age, quarters, birth_year)["annual"]
+        after = retirement.base_pension(income, age, quarters + extra, birth_year)["annual"]
+        assert after >= before - 1e-9, (income, age, birth_year, quarters, extra)
+
+
+def test_more_income_never_lowers_the_base_pension(rng):
+    for _ in range(SAMPLES):
+        income = rng.uniform(0, 200_000)
+        age, quarters = rng.randint(55, 70), rng.randint(0, 200)
+        before = retirement.base_pension(income, age, quarters)["annual"]
+        after = retirement.base_pension(income + rng.uniform(1, 10_000), age, quarters)["annual"]
+        assert after >= before - 1e-9, (income, age, quarters)
+
+
+def test_rate_bounds(rng):
+    for _ in range(SAMPLES):
+        required = retirement.required_quarters(rng.choice([None, 1955, 1965, 1980]))
+        age, quarters = rng.randint(50, 75), rng.randint(0, 250)
+        rate, decote, surcote = retirement.pension_rate(age, quarters, required)
+        assert 0 <= decote <= retirement.MAX_DECOTE
+        assert surcote >= 0
+        assert not (decote and surcote)
+        assert rate >= retirement.FULL_RATE * (1 - retirement.MAX_DECOTE)
+
+
+def test_private_quarters_are_bounded_and_monotonic(rng):
+    for _ in range(SAMPLES):
+        inputs = {
+            "full_time_years": rng.randint(0, 45),
+            "part_time_years": rng.randint(0, 10),
+            "unemployment_months": rng.uniform(0, 48),
+            "parental_months": rng.uniform(0, 60),
+            "sick_leave_months": rng.uniform(0, 24),
+            "gender": rng.choice(["F", "M", None]),
+            "children": rng.randint(0, 4),
+        }
+        total = retirement.private_quarters(**inputs)["total"]
+        key = rng.choice(["full_time_years", "part_time_years", "unemployment_months",
+                          "parental_months", "sick_leave_months", "children"])
+        more = dict(inputs, **{key: inputs[key] + rng.randint(1, 12)})
+        assert 0 <= total <= retirement.MAX_QUARTERS
+        assert retirement.private_quarters(**more)["total"] >= total, (inputs, key)
+
+
+def test_later_departure_never_lowers_the_total_pension(rng):
+    for _ in range(SAMPLES):
+        current_age = rng.randint(25, 61)
+        quarters = rng.randint(0, 150)
+        if rng.random() < 0.5:
+            salaries = [rng.uniform(15_000, 120_000) for _ in range(rng.randint(1, 40))]
+            scenarios = retirement.employee_scenarios(current_age, 1980, salaries, quarters)
+        else:
+            revenues = [rng.uniform(0, 120_000) for _ in range(rng.randint(1, 40))]
+            scenarios = retirement.freelance_scenarios(current_age, 1980, revenues, quarters)
+        totals = [s["totalMonthly"] for s in scenarios]
+        assert totals == sorted(totals), (current_age, quarters)
+
+
+def test_savings_effort_rises_with_the_target_and_falls_with_savings(rng):
+    for _ in range(SAMPLES):
+        target = rng.uniform(1000, 6000)
+        pension = rng.uniform(0, 5000)
+        years = rng.randint(1, 40)
+        profile = rng.choice(list(retirement.RISK_PROFILES))
+        savings = rng.uniform(0, 200_000)
+
+        def effort(target, savings):
+            return retirement.required_savings(target, pension, years, profile, savings)["monthly_contribution"]
+
+        base = effort(target, savings)
+        assert 0 <= effort(target, savings + 10_000) <= base <= effort(target + 500, savings), \
+            (target, pension, years, profile, savings)
@@ -0,0 +1,293 @@
+"""Storage drivers: local sharded layout and S3 (against moto, or MinIO), and migrate_storage.py"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import socket
+import uuid
+
+import pytest
+
+pytest.importorskip("aiofiles")
+
+import storage  # noqa: E402
+from storage import LocalStorage, S3Storage, StorageError, sharded_key  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture
+def run():
+    """asyncio.run, closing the S3 clients before the loop ends (their
+    connection pools cannot outlive it)"""
+    def run(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                for backend in run.storages:
+                    await backend.close()
+        return asyncio.run(main())
+    run.storages = []
+    return run
+
+
+@pytest.fixture(scope="module")
+def s3_endpoint():
+    """A local S3 stand-in: S3_TEST_ENDPOINT_URL (MinIO...) or a moto server"""
+    pytest.importorskip("aiobotocore")
+    url = os.environ.get("S3_TEST_ENDPOINT_URL")
+    if url:
+        yield url, os.environ.get("S3_TEST_ACCESS_KEY_ID", "minioadmin"), \
+            os.environ.get("S3_TEST_SECRET_ACCESS_KEY", "minioadmin")
+        return
+    server_module = pytest.importorskip("moto.server")
+    port = _free_port()
+    server = server_module.ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}", "testing", "testing"
+    server.stop()
+
+
+@pytest.fixture
+def s3(s3_endpoint, run):
+    url, access_key, secret_key = s3_endpoint
+    backend = S3Storage(f"elysion-test-{uuid.uuid4().hex[:12]}", endpoint_url=url, region="us-east-1",
+                        access_key=access_key, secret_key=secret_key, part_size=S3Storage.MIN_PART_SIZE)
+
+    async def create_bucket():
+        client = await backend._get_client()
+        await client.create_bucket(Bucket=backend.bucket)
+
+    run.storages.append(backend)
+    run(create_bucket())
+    return backend
+
+
+@pytest.fixture(params=["local", "s3"])
+def backend(request, tmp_path):
+    if request.param == "local":
+        return LocalStorage(tmp_path)
+    return request.getfixturevalue("s3")
+
+
+async def _chunks(data: bytes, step: int = MB):
+    for i in range(0, len(data), step):
+        yield data[i:i + step]
+
+
+async def _read(backend, key, start=0, end=None):
+    return b"".join([chunk async for chunk in backend.open(key, start, end)])
+
+
+async def _keys(backend, prefix=""):
+    return [obj.key async for obj in backend.list_objects(prefix)]
+
+
+def test_sharded_key():
+    digest = hashlib.sha256(b"releve.pdf").hexdigest()
+    assert sharded_key("releve.pdf") == f"{digest[:2]}/{digest[2:4]}/releve.pdf"
+    assert storage.new_storage_key(".pdf").endswith(".pdf")
+    assert storage.new_storage_key(".pdf").count("/") == 2
+
+
+def test_round_trip_and_range_reads(backend, run):
+    data = os.urandom(3 * MB + 17)
+    key = sharded_key("a.pdf")
+
+    async def scenario():
+        written = await backend.save(key, _chunks(data, 100_000))
+        ranges = [await _read(backend, key, start, end)
+                  for start, end in [(0, 0), (5, 99), (MB - 1, MB + 1), (len(data) - 3, None)]]
+        return written, await _read(backend, key), ranges, await backend.size(key)
+
+    written, whole, ranges, size = run(scenario())
+    assert written == size == len(data)
+    assert whole == data
+    assert ranges == [data[0:1], data[5:100], data[MB - 1:MB + 2], data[-3:]]
+
+
+def test_delete_move_and_missing_objects(backend, run):
+    async def scenario():
+        await backend.save("aa/01/a.pdf", _chunks(b"a"))
+        await backend.move("aa/01/a.pdf", "quarantine/aa/01/a.pdf")
+        moved = await backend.exists("aa/01/a.pdf"), await _read(backend, "quarantine/aa/01/a.pdf")
+        await backend.delete("quarantine/aa/01/a.pdf")
+        return moved, await backend.size("quarantine/aa/01/a.pdf"), await backend.size("nope/00/x.pdf")
+
+    (source_exists, content), deleted_size, missing_size = run(scenario())
+    assert not source_exists
+    assert content == b"a"
+    assert deleted_size is None
+    assert missing_size is None
+
+
+def test_list_objects_in_key_order(backend, run):
+    keys = ["ab/cd/x.pdf", "ab0.pdf", "ab/ce/y.pdf", "exports/u1/e.zip", "0f/00/z.pdf"]
+
+    async def scenario():
+        for key in keys:
+            await backend.save(key, _chunks(key.encode()))
+        return await _keys(backend), await _keys(backend, "ab/"), [obj async for obj in backend.list_objects()]
+
+    listed, prefixed, objects = run(scenario())
+    assert listed == sorted(keys)
+    assert prefixed == ["ab/cd/x.pdf", "ab/ce/y.pdf"]
+    assert {obj.key: obj.size for obj in objects} == {key: len(key) for key in keys}
+    assert all(obj.modified_at.tzinfo is None for obj in objects)
+
+
+def test_failed_upload_leaves_nothing(backend, run):
+    async def failing():
+        yield os.urandom(3 * MB)
+        yield os.urandom(3 * MB)
+        raise ConnectionError("client went away")
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await backend.save("aa/02/b.pdf", failing())
+        return await _keys(backend)
+
+    assert run(scenario()) == []
+
+
+def test_local_layout_and_key_checks(tmp_path, run):
+    backend = LocalStorage(tmp_path)
+    key = sharded_key("c.pdf")
+    run(backend.save(key, _chunks(b"c")))
+    assert (tmp_path / key).read_bytes() == b"c"
+    assert backend.local_path(key) == (tmp_path / key).resolve()
+    # In-flight uploads are dot files, never listed
+    (tmp_path / key).with_name(".c.pdf.123.part").write_bytes(b"partial")
+    assert run(_keys(backend)) == [key]
+    with pytest.raises(StorageError):
+        backend.local_path("../outside.pdf")
+    assert run(backend.delete("zz/99/none.pdf")) is False
+
+
+def test_s3_small_object_is_a_single_put(s3, run):
+    async def scenario():
+        await s3.save("aa/03/small.pdf", _chunks(b"x" * 1000, 100))
+        client = await s3._get_client()
+        head = await client.head_object(Bucket=s3.bucket, Key="aa/03/small.pdf")
+        return head["ETag"]
+
+    # Multipart ETags end with "-<number of parts>"
+    assert "-" not in run(scenario())
+
+
+def test_s3_large_object_uses_multipart(s3, run):
+    data = os.urandom(2 * S3Storage.MIN_PART_SIZE + 123)
+
+    async def scenario():
+        written = await s3.save("aa/04/large.pdf", _chunks(data))
+        client = await s3._get_client()
+        head = await client.head_object(Bucket=s3.bucket, Key="aa/04/large.pdf")
+        return written, head["ETag"], await _read(s3, "aa/04/large.pdf")
+
+    written, etag, content = run(scenario())
+    assert written == len(data)
+    assert etag.strip('"').endswith("-3")
+    assert content == data
+
+
+def test_s3_failed_multipart_upload_is_aborted(s3, run):
+    async def failing():
+        yield os.urandom(S3Storage.MIN_PART_SIZE + 1)
+        raise ConnectionError("client went away")
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await s3.save("aa/05/aborted.pdf", failing())
+        client = await s3._get_client()
+        uploads = await client.list_multipart_uploads(Bucket=s3.bucket)
+        return uploads.get("Uploads", []), await _keys(s3)
+
+    uploads, keys = run(scenario())
+    assert uploads == []
+    assert keys == []
+
+
+def test_s3_key_prefix(s3, run):
+    s3.prefix = "tenant/"
+
+    async def scenario():
+        await s3.save("aa/06/p.pdf", _chunks(b"p"))
+        client = await s3._get_client()
+        raw = await client.list_objects_v2(Bucket=s3.bucket)
+        return [obj["Key"] for obj in raw["Contents"]], await _keys(s3)
+
+    raw_keys, keys = run(scenario())
+    assert raw_keys == ["tenant/aa/06/p.pdf"]
+    assert keys == ["aa/06/p.pdf"]
+
+
+# ----------------------------------------------------------------------------
+# migrate_storage.py
+# ----------------------------------------------------------------------------
+
+@pytest.fixture
+def migration(db, tmp_path, monkeypatch):
+    pytest.importorskip("dotenv")
+    import migrate_storage
+
+    monkeypatch.setattr(storage, "_backends", {})
+    monkeypatch.setenv("STORAGE_LOCAL_ROOT", str(tmp_path / "documents"))
+    monkeypatch.setenv("MONGO_URL", "mongodb://localhost:27017")
+    monkeypatch.setenv("DB_NAME", db.name)
+    monkeypatch.setattr(migrate_storage, "AsyncIOMotorClient", lambda url: db.client)
+
+    def migrate(to, **options):
+        args = dict(to=to, concurrency=2, batch_size=10, grace_seconds=0, keep_source=False, dry_run=False)
+        return migrate_storage.migrate(argparse.Namespace(**{**args, **options}))
+    return migrate
+
+
+def _legacy_row(db, tmp_path, run):
+    """A row from before sharding: a flat file in the local root"""
+    root = tmp_path / "documents"
+    root.mkdir(exist_ok=True)
+    (root / "legacy.pdf").write_bytes(b"legacy")
+    run(db.documents.insert_one({"id": "d1", "file_path": "/app/uploads/legacy.pdf"}))
+    return root
+
+
+def test_migration_moves_a_legacy_row_to_the_sharded_layout(db, tmp_path, migration, run):
+    root = _legacy_row(db, tmp_path, run)
+
+    run(migration("local"))
+    row = run(db.documents.find_one({"id": "d1"}))
+    assert (row["storage_backend"], row["storage_key"]) == ("local", sharded_key("legacy.pdf"))
+    assert (root / row["storage_key"]).read_bytes() == b"legacy"
+    # Removed after the grace period
+    assert not (root / "legacy.pdf").exists()
+
+    # Already migrated: a second run skips it
+    run(migration("local"))
+    assert run(db.documents.find_one({"id": "d1"}))["storage_key"] == row["storage_key"]
+
+
+def test_migration_dry_run_changes_nothing(db, tmp_path, migration, run):
+    root = _legacy_row(db, tmp_path, run)
+
+    run(migration("local", dry_run=True))
+    assert "storage_key" not in run(db.documents.find_one({"id": "d1"}))
+    assert (root / "legacy.pdf").exists()
+
+
+def test_migration_to_s3(db, tmp_path, migration, s3, monkeypatch, run):
+    root = _legacy_row(db, tmp_path, run)
+    monkeypatch.setitem(storage._backends, "s3", s3)
+
+    run(migration("s3"))
+    row = run(db.documents.find_one({"id": "d1"}))
+    assert (row["storage_backend"], row["storage_key"]) == ("s3", sharded_key("legacy.pdf"))
+    assert run(_read(s3, row["storage_key"])) == b"legacy"
+    assert not (root / "legacy.pdf").exists()
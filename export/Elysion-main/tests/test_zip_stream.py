@@ -0,0 +1,89 @@
+"""Streamed ZIP archives: readable by zipfile, built lazily, unique names"""
+
+import io
+import os
+import zipfile
+from datetime import datetime
+
+import pytest
+
+from zip_stream import stream_zip, unique_name
+
+MODIFIED = datetime(2024, 3, 1, 12, 30, 10)
+
+
+async def _chunks(data: bytes, step: int = 1000):
+    for i in range(0, len(data), step):
+        yield data[i:i + step]
+
+
+async def _entries(files):
+    for name, data in files.items():
+        yield name, MODIFIED, _chunks(data)
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+FILES = {
+    "releve.pdf": os.urandom(5000),
+    "vide.txt": b"",
+    "dossier/notes.txt": b"bonjour " * 2000,
+}
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_archive_reads_back(compression, run):
+    chunks = run(_collect(stream_zip(_entries(FILES), compression=compression)))
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == list(FILES)
+        for name, data in FILES.items():
+            assert archive.read(name) == data
+            info = archive.getinfo(name)
+            assert info.date_time == (2024, 3, 1, 12, 30, 10)
+            assert info.compress_type == compression
+
+
+def test_chunks_are_yielded_while_entries_are_read(run):
+    read = []
+
+    async def entries():
+        for name, data in FILES.items():
+            read.append(name)
+            yield name, MODIFIED, _chunks(data)
+
+    async def scenario():
+        stream = stream_zip(entries())
+        first = await stream.__anext__()
+        seen = list(read)
+        await _collect(stream)
+        return first, seen
+
+    first, seen = run(scenario())
+    assert first
+    # Nothing beyond the first entry was read to produce the first chunk
+    assert seen == ["releve.pdf"]
+
+
+def test_empty_archive(run):
+    async def nothing():
+        return
+        yield
+
+    data = b"".join(run(_collect(stream_zip(nothing()))))
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == []
+
+
+def test_unique_name():
+    seen = set()
+    names = [unique_name(name, seen) for name in
+             ("releve.pdf", "releve.pdf", "releve.pdf", "notes", "notes", "releve (2).pdf", "a.tar.gz", "a.tar.gz")]
+    assert names == [
+        "releve.pdf", "releve (2).pdf", "releve (3).pdf", "notes", "notes (2)",
+        "releve (2) (2).pdf", "a.tar.gz", "a.tar (2).gz",
+    ]
+    assert seen == set(names)